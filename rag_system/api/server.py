@@ -3,6 +3,7 @@ FastAPI server for RAG system
 """
 
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from typing import Optional
 import sys
@@ -12,6 +13,7 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from core.advanced_rag import AdvancedRAGSystem, RAGResult
+from utils.metrics import SnapshotStore
 
 app = FastAPI(title="Advanced RAG API", version="1.0.0")
 
@@ -69,6 +71,13 @@ async def health():
     """Health check"""
     return {"status": "ok", "rag_initialized": rag_system is not None}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics (merged registry snapshots of all RAG processes)"""
+    store = SnapshotStore(Path(__file__).parent.parent / "logs" / "metrics")
+    return PlainTextResponse(store.load_merged().to_prometheus(),
+                             media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def root():
     """API info"""
@@ -77,7 +86,8 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "query": "POST /api/rag/query",
-            "health": "GET /health"
+            "health": "GET /health",
+            "metrics": "GET /metrics"
         }
     }
 
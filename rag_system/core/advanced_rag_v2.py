@@ -19,23 +19,41 @@ from .mcp_direct import MCPMemoryDirect
 # LLM for query expansion and generation
 from anthropic import Anthropic
 
-# Cross-encoder for re-ranking
-from sentence_transformers import CrossEncoder
+# Cross-encoder for re-ranking (PyTorch, or ONNX Runtime via env)
+from rag_system.utils.onnx_backend import inference_backend, load_cross_encoder
+
+# Bi-encoder cosine (rerank cascade stage 1)
+import numpy as np
 
 # For multi-agent orchestration
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 import asyncio
 from enum import Enum
 
 from rag_system.config.settings import settings
-from rag_system.utils.cache import QueryCache
+from rag_system.utils.cache import CorpusVersions, QueryCache, SearchMemo, TieredQueryCache
+from rag_system.utils.deadline import Cancelled, CancelScope, cancel_scope, check_cancelled
 from rag_system.utils.monitoring import RAGMonitor
+from rag_system.utils.code_index import CodeIndex
 from rag_system.utils.serena_code_index import SerenaCodeIndex
 from rag_system.utils.keyword_retriever import KeywordRetriever
 from rag_system.utils.entity_graph import EntityGraph
 from rag_system.utils.feedback_loop import BotScalpBrain
-from rag_system.utils.tracing import get_tracer  # Phase 3
+from rag_system.utils.tracing import get_tracer, propagate  # Phase 3
+from rag_system.utils.llm_gateway import LLMGateway, LLMUsage
+from rag_system.utils.metrics import start_http_server
+from rag_system.utils.log_sink import get_log_sink
+from rag_system.utils.profiler import StageProfiler, print_report, profile_enabled, profiling
 from rag_system.utils.ast_chunker import ASTChunker  # Phase 4
+from rag_system.utils.fusion import (
+    merge_fused,
+    rank_within_agent,
+    reciprocal_rank_fusion,
+    reciprocal_rank_fusion_groups,
+)
+from rag_system.utils.batching import run_bucketed, token_lengths
+from rag_system.utils.dedup import NearDuplicateFilter
+from rag_system.utils.strategy_table import TUNABLE_FIELDS, StrategyTable, default_table_path
 
 class AgentType(Enum):
     """Types of specialized agents"""
@@ -61,11 +79,19 @@ class AdvancedRAGv2:
                  project_name: str = "scalp",
                  project_root: Optional[str] = None,
                  context_max_chars: Optional[int] = None,
-                 default_top_k: Optional[int] = None):
+                 default_top_k: Optional[int] = None,
+                 *,
+                 vector_store: Optional[VectorStore] = None,
+                 mcp_client=None,
+                 llm_client=None,
+                 logs_dir: Optional[Path] = None):
         """Initialize all RAG components
         Args:
             project_name: Logical project identifier (affects vector DB namespace)
             project_root: Filesystem path to project root for local ingestion
+            vector_store, mcp_client, llm_client: Ready components used instead
+                of Chroma/MCP/Anthropic (offline benchmark with local fakes)
+            logs_dir: Run logs, metrics snapshots, traces and profiles directory
         """
         print("\n🚀 Initializing Advanced RAG v2...")
         self.project_name = project_name
@@ -74,50 +100,163 @@ class AdvancedRAGv2:
         self.context_max_chars = int(os.getenv('RAG_CONTEXT_CHARS', context_max_chars or 120000))
         self.default_top_k = int(os.getenv('RAG_TOP_K', default_top_k or 40))
         
-        # 1. Vector Store (NEW!)
+        # 1. Vector Store (NEW!) — ingestion bumps corpus versions so cached
+        # answers built from changed partitions are invalidated precisely
+        cache_dir = settings.CACHE_DIR / self.project_name
+        self.corpus_versions = CorpusVersions(cache_dir / 'corpus_versions.sqlite3')
         persist = f"/home/scalp/rag_system/chroma_db/{self.project_name}"
         collection = f"{self.project_name}_knowledge"
-        self.vector_store = VectorStore(persist_dir=persist, collection_name=collection)
+        self.vector_store = vector_store or VectorStore(
+            persist_dir=persist, collection_name=collection,
+            corpus_versions=self.corpus_versions,
+            near_dup_threshold=float(os.getenv('RAG_INGEST_DEDUP_THRESHOLD', '0')),
+        )
         
         # 2. MCP Memory Client (existing)
-        self.mcp_client = MCPMemoryDirect()
+        self.mcp_client = mcp_client or MCPMemoryDirect()
         
         # 3. LLM for intelligence
-        api_key = os.getenv('ANTHROPIC_API_KEY')
-        if not api_key:
-            raise ValueError("ANTHROPIC_API_KEY not set!")
-        self.claude = Anthropic(api_key=api_key)
+        if llm_client is not None:
+            self.claude = llm_client
+        else:
+            api_key = os.getenv('ANTHROPIC_API_KEY')
+            if not api_key:
+                raise ValueError("ANTHROPIC_API_KEY not set!")
+            # Retries live in the LLM gateway (jittered backoff + circuit breaker)
+            self.claude = Anthropic(api_key=api_key, max_retries=0)
         # Model selection with safe defaults (allow env override)
         self.model_fast = os.getenv('ANTHROPIC_MODEL_FAST', 'claude-3-5-haiku-20241022')
         self.model_main = os.getenv('ANTHROPIC_MODEL', 'claude-sonnet-4-5-20250929')
         
         # 4. Cross-encoder for re-ranking
         print("  📊 Loading cross-encoder...")
-        self.reranker = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+        self.reranker = load_cross_encoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+        # Rerank cascade: a small cross-encoder between bi-encoder cosine and
+        # the full model; stage sizes per intent as "pool,light,full"
+        # (pool 0 = max(RAG_RERANK_MIN_CANDIDATES, top_k x factor); the pool can
+        # be wider than before since cosine scoring is nearly free)
+        self.light_reranker = None
+        if os.getenv('RAG_RERANK_CASCADE', '1') == '1':
+            try:
+                self.light_reranker = load_cross_encoder(
+                    os.getenv('RAG_RERANK_LIGHT_MODEL', 'cross-encoder/ms-marco-TinyBERT-L-2-v2')
+                )
+            except Exception as exc:
+                print(f"  ⚠️  Light reranker unavailable ({exc}); cascade disabled")
+        self.rerank_cascade = {
+            intent: self._parse_cascade(os.getenv(f'RAG_RERANK_CASCADE_{intent.upper()}', default))
+            for intent, default in (
+                ('code', '60,24,8'),
+                ('config', '48,20,8'),
+                ('status', '48,20,8'),
+                ('explain', '100,40,16'),
+                ('general', '80,32,12'),
+            )
+        }
+        # Near-duplicate filter after fusion (estimated Jaccard threshold)
+        dedup_threshold = float(os.getenv('RAG_DEDUP_THRESHOLD', '0.8'))
+        self.near_dup_filter: Optional[NearDuplicateFilter] = (
+            NearDuplicateFilter(threshold=dedup_threshold) if dedup_threshold > 0 else None
+        )
+        # Rank fusion feeding the cross-encoder (RRF k, per-agent weights)
+        self.rrf_k = int(os.getenv('RAG_RRF_K', '60'))
+        self.fusion_weights = {
+            AgentType.VECTOR.value: 1.0,
+            AgentType.MEMORY.value: 1.0,
+            AgentType.RECENT.value: 1.0,
+            AgentType.CODE.value: 1.0,
+            AgentType.KEYWORD.value: 0.8,
+            AgentType.GRAPH.value: 0.6,
+        }
+        # Retrieval deadlines: global budget per intent + per-agent timeouts (s)
+        self.retrieval_budget = {
+            'code': float(os.getenv('RAG_RETRIEVAL_BUDGET_CODE', '6')),
+            'config': float(os.getenv('RAG_RETRIEVAL_BUDGET_CONFIG', '4')),
+            'status': float(os.getenv('RAG_RETRIEVAL_BUDGET_STATUS', '4')),
+            'explain': float(os.getenv('RAG_RETRIEVAL_BUDGET_EXPLAIN', '8')),
+            'general': float(os.getenv('RAG_RETRIEVAL_BUDGET_GENERAL', '6')),
+        }
+        self.agent_timeouts = {
+            agent.value: float(os.getenv(f'RAG_AGENT_TIMEOUT_{agent.name}', default))
+            for agent, default in (
+                (AgentType.VECTOR, '5'),
+                (AgentType.MEMORY, '8'),
+                (AgentType.RECENT, '8'),
+                (AgentType.CODE, '5'),
+                (AgentType.KEYWORD, '3'),
+                (AgentType.GRAPH, '1'),
+            )
+        }
+        # One bounded pool for every query's agents. Agents that are stopped
+        # early are cancelled (queued ones never start, running ones stop at
+        # their next backend call or deadline), so abandoned work can't pile
+        # up threads or MCP subprocesses under load
+        self.agent_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('RAG_AGENT_WORKERS', '32')), thread_name_prefix='rag-agent'
+        )
+        # Candidates sent to the cross-encoder: max(min, top_k * factor)
+        self.rerank_min_candidates = int(os.getenv('RAG_RERANK_MIN_CANDIDATES', '30'))
+        self.rerank_candidate_factor = float(os.getenv('RAG_RERANK_CANDIDATE_FACTOR', '1.5'))
+        # Per-intent strategy table (defaults, overridden by `rag optimize` output)
+        strategy_path = default_table_path(cache_dir)
+        try:
+            self.strategy_table = StrategyTable(strategy_path)
+            if self.strategy_table.learned:
+                print(f"  🎯 Learned strategy table: {', '.join(sorted(self.strategy_table.learned))}")
+        except Exception as exc:
+            print(f"  ⚠️  Strategy table ignored ({exc}); using defaults")
+            self.strategy_table = StrategyTable()
         
         # 5. Cache + monitoring
-        cache_dir = settings.CACHE_DIR / self.project_name
         cache_ttl = int(os.getenv('RAG_CACHE_TTL', '900'))
         cache_cap = int(os.getenv('RAG_CACHE_MAX_ENTRIES', '256'))
+        memory_cap = int(os.getenv('RAG_CACHE_MEMORY_ENTRIES', '128'))
         disable_cache = os.getenv('RAG_DISABLE_CACHE', '0') == '1'
-        self.cache: Optional[QueryCache] = None if disable_cache else QueryCache(
-            cache_dir=cache_dir,
-            ttl_seconds=cache_ttl,
-            max_entries=cache_cap,
+        self.cache: Optional[TieredQueryCache] = None if disable_cache else TieredQueryCache(
+            QueryCache(
+                cache_dir=cache_dir,
+                ttl_seconds=cache_ttl,
+                max_entries=cache_cap,
+            ),
+            memory_entries=memory_cap,
         )
-        logs_dir = Path(__file__).resolve().parent.parent / 'logs'
+        trace_dir = Path(logs_dir) / 'traces' if logs_dir else None
+        logs_dir = Path(logs_dir) if logs_dir else Path(__file__).resolve().parent.parent / 'logs'
         self.monitor = RAGMonitor(project_name=self.project_name, logs_dir=logs_dir)
 
         self.serena_index: Optional[SerenaCodeIndex]
         try:
-            self.serena_index = SerenaCodeIndex(project_root=self.project_root)
+            self.serena_index = SerenaCodeIndex(
+                project_root=self.project_root,
+                index_path=cache_dir / 'serena_symbols.bin',
+            )
             if self.serena_index.available():
                 print("  🧭 Serena code index ready")
         except Exception as exc:
             print(f"  ⚠️  Serena index unavailable: {exc}")
             self.serena_index = None
 
-        self.keyword_retriever = KeywordRetriever(self.project_root)
+        # Native code index when Serena has no caches: built/refreshed in the
+        # background (watchdog events or mtime polling), never on the query path
+        self.code_index: Optional[CodeIndex] = None
+        if not (self.serena_index and self.serena_index.available()):
+            try:
+                self.code_index = CodeIndex(
+                    self.project_root,
+                    index_path=cache_dir / 'code_index.pkl',
+                    refresh_interval=float(os.getenv('RAG_CODE_INDEX_REFRESH_SEC', '300')),
+                    watch=os.getenv('RAG_CODE_INDEX_WATCH', '1') != '0',
+                ).start()
+            except Exception as exc:
+                print(f"  ⚠️  Code index unavailable: {exc}")
+
+        # Keyword retrieval: persistent BM25 index (default) or ripgrep scan
+        keyword_backend = os.getenv('RAG_KEYWORD_BACKEND', 'bm25').lower()
+        self.keyword_retriever = KeywordRetriever(
+            self.project_root,
+            index_path=cache_dir / 'keyword_index.pkl' if keyword_backend == 'bm25' else None,
+            refresh_interval=float(os.getenv('RAG_KEYWORD_REFRESH_SEC', '300')),
+        )
         config_dir = Path(__file__).resolve().parent.parent / 'config'
         self.entity_graph = EntityGraph(config_dir / 'entity_graph.json')
 
@@ -127,13 +266,34 @@ class AdvancedRAGv2:
             'explain': int(os.getenv('RAG_CACHE_TTL_EXPLAIN', '600')),
             'code': int(os.getenv('RAG_CACHE_TTL_CODE', '90')),
         }
+        # Stale-while-revalidate window (seconds past TTL); 0 disables it
+        self.intent_stale_policy = {
+            'status': int(os.getenv('RAG_CACHE_STALE_STATUS', '60')),
+            'general': int(os.getenv('RAG_CACHE_STALE_GENERAL', '300')),
+            'explain': int(os.getenv('RAG_CACHE_STALE_EXPLAIN', '300')),
+            'code': int(os.getenv('RAG_CACHE_STALE_CODE', '30')),
+        }
 
         # Initialize BotScalp Brain for intelligent tracking
         self.brain = BotScalpBrain()
         self.auto_save_enabled = os.getenv('RAG_AUTO_SAVE', '1') == '1'
         
         # Phase 3: Tracing system
-        self.tracer = get_tracer(project_name=self.project_name)
+        self.tracer = get_tracer(project_name=self.project_name, logs_dir=trace_dir)
+        # Every LLM call goes through the gateway: tokens, cost, latency, retries
+        self.llm = LLMGateway(self.claude, tracer=self.tracer)
+        # Optional Prometheus endpoint for this process (long-running servers)
+        metrics_port = int(os.getenv('RAG_METRICS_PORT', '0'))
+        if metrics_port:
+            try:
+                start_http_server(metrics_port)
+                print(f"  📡 /metrics on port {metrics_port}")
+            except OSError as exc:
+                print(f"  ⚠️  Metrics endpoint unavailable: {exc}")
+        # Opt-in per-stage profiler (RAG_PROFILE=1 or `rag profile`)
+        self.profile_enabled = profile_enabled()
+        self.profile_dir = logs_dir / 'profiles'
+        self.last_profile: Optional[Dict] = None
         
         # Phase 4: AST-based chunking
         self.ast_chunker = ASTChunker(max_chunk_size=1500)
@@ -141,7 +301,13 @@ class AdvancedRAGv2:
         print("  ✅ Advanced RAG v2 initialized!\n")
     
     def _build_cache_key(self, query: str, processed_query: Dict, strategy: Dict) -> Optional[str]:
-        """Generate cache key - now with semantic similarity support."""
+        """Generate cache key from local signals only (normalized query, intent, strategy).
+
+        Must not depend on LLM-derived fields (concepts/expansions) so the
+        lookup can happen before process_query(). The whole effective
+        strategy (overrides included) is part of the key, so answers built
+        with one configuration are never served to another.
+        """
         if not self.cache:
             return None
         
@@ -156,11 +322,8 @@ class AdvancedRAGv2:
             'project': self.project_name,
             'query': normalized_query,
             'intent': processed_query.get('intent', 'general'),
-            'top_k': strategy.get('top_k'),
             'context_max': self.context_max_chars,
-            'vector': strategy.get('use_vector', True),
-            'memory': strategy.get('use_memory', True),
-            'recent': strategy.get('use_recent', False),
+            'strategy': strategy,
         }
         return self.cache.make_key(**key_parts)
 
@@ -173,6 +336,7 @@ class AdvancedRAGv2:
         elapsed: float,
         *,
         from_cache: bool = False,
+        llm: Optional[Dict] = None,
     ) -> None:
         """Pretty-print pipeline stats (works for live and cached responses)."""
         print(f"\n{'='*80}")
@@ -182,6 +346,9 @@ class AdvancedRAGv2:
         print(f"  • Context: {context_chars} chars")
         print(f"  • Confidence: {confidence:.0f}%")
         print(f"  • Time: {elapsed:.2f}s")
+        if llm and llm.get('calls'):
+            print(f"  • LLM: {llm['calls']} calls, {llm['input_tokens']} in / {llm['output_tokens']} out tokens "
+                  f"({llm['cached_tokens']} cached), ~${llm['cost_usd']:.4f}")
         if from_cache:
             print("  • Source: disk cache")
         print(f"{'='*80}\n")
@@ -197,30 +364,38 @@ class AdvancedRAGv2:
         """
         print(f"\n🧠 Processing query: {query}")
         
-        # Extract multiple query representations in parallel
-        with ThreadPoolExecutor(max_workers=4) as executor:
+        # Local signals are cheap; only the LLM extractions run in parallel
+        processed = self.local_query_signals(query)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # propagate: workers see the query's trace and LLM ledger
             futures = {
-                executor.submit(self.extract_concepts, query): 'concepts',
-                executor.submit(self.expand_query, query): 'expansions',
-                executor.submit(self.extract_temporal, query): 'temporal',
-                executor.submit(self.classify_intent, query): 'intent'
+                executor.submit(propagate(self.extract_concepts), query): 'concepts',
+                executor.submit(propagate(self.expand_query), query): 'expansions',
             }
             
-            results = {}
             for future in as_completed(futures):
                 key = futures[future]
                 try:
-                    results[key] = future.result()
+                    processed[key] = future.result() or []
                 except Exception as e:
                     print(f"  ⚠️  Failed to extract {key}: {e}")
-                    results[key] = None
+                    processed[key] = []
+        
+        return processed
+
+    def local_query_signals(self, query: str) -> Dict:
+        """
+        Query representation built only from local heuristics (no LLM calls).
         
+        Has the same shape as process_query() output, with empty concepts and
+        expansions, so it can drive strategy selection and cache lookups.
+        """
         return {
             'original': query,
-            'concepts': results.get('concepts', []),
-            'expansions': results.get('expansions', []),
-            'temporal': results.get('temporal', {}),
-            'intent': results.get('intent', 'general')
+            'concepts': [],
+            'expansions': [],
+            'temporal': self.extract_temporal(query),
+            'intent': self.classify_intent(query)
         }
     
     def extract_concepts(self, query: str) -> List[str]:
@@ -235,7 +410,8 @@ class AdvancedRAGv2:
             Return only the concepts, one per line, max 5.
             """
             
-            response = self.claude.messages.create(
+            response = self.llm.create(
+                'extract_concepts',
                 model=self.model_fast,
                 max_tokens=100,
                 temperature=0.1,
@@ -256,7 +432,8 @@ class AdvancedRAGv2:
             Return max 3 variations, one per line.
             """
             
-            response = self.claude.messages.create(
+            response = self.llm.create(
+                'expand_query',
                 model=self.model_fast,
                 max_tokens=100,
                 temperature=0.3,
@@ -313,72 +490,228 @@ class AdvancedRAGv2:
     
     def multi_agent_retrieval(self, processed_query: Dict, strategy: Optional[Dict] = None) -> List[Dict]:
         """
-        Parallel multi-agent retrieval with different strategies
+        Parallel multi-agent retrieval with different strategies.
+
+        Deadline-aware: each agent has its own timeout, the whole stage has a
+        latency budget per intent, and agents still running are abandoned as
+        soon as they can no longer change the candidate pool (RRF bound).
         """
         print("\n🤖 Multi-agent retrieval starting...")
-        
-        all_documents = []
-        
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            # Launch parallel agents based on query analysis
-            futures = []
-            
-            # Decide which agents to use
-            use_vector = True
-            use_memory = True
-            use_recent = processed_query['temporal']['has_temporal']
-            use_code = processed_query.get('intent') == 'code'
-            if strategy:
-                use_vector = strategy.get('use_vector', use_vector)
-                use_memory = strategy.get('use_memory', use_memory)
-                use_recent = strategy.get('use_recent', use_recent)
-                use_code = strategy.get('use_code', use_code)
-                use_keywords = strategy.get('use_keywords', True)
-                use_graph = strategy.get('use_graph', False)
-            else:
-                use_keywords = True
-                use_graph = False
+        weights = (strategy or {}).get('fusion_weights') or self.fusion_weights
+        ranked_lists = self._gather_agent_rankings(processed_query, strategy)
+        # Fuse per-agent rankings on a common scale (RRF) — also deduplicates
+        unique_docs = reciprocal_rank_fusion(ranked_lists, k=self.rrf_k, weights=weights)
+        return self._finish_fused(unique_docs, processed_query)
 
-            if use_vector:
-                futures.append(executor.submit(self._vector_agent, processed_query, strategy))
+    def multi_query_retrieval(self,
+                              processed_queries: List[Dict],
+                              strategy: Optional[Dict],
+                              stats_query: Dict) -> List[Dict]:
+        """
+        Retrieval for planned sub-questions: all sub-questions run at once,
+        and their per-agent rankings are fused together (one RRF, one
+        near-dup pass) so the caller reranks a single candidate list.
+        Stats are recorded on ``stats_query``.
+        """
+        print(f"\n🤖 Multi-agent retrieval starting ({len(processed_queries)} subperguntas em paralelo)...")
+        weights = (strategy or {}).get('fusion_weights') or self.fusion_weights
+        with ThreadPoolExecutor(max_workers=len(processed_queries)) as executor:
+            groups = list(executor.map(
+                propagate(lambda pq: self._gather_agent_rankings(pq, strategy)), processed_queries
+            ))
+        stopped: Dict[str, str] = {}
+        for pq in processed_queries:
+            stopped.update(pq.get('retrieval_stats', {}).get('agents_stopped', {}))
+        stats_query.setdefault('retrieval_stats', {})['agents_stopped'] = stopped
+        unique_docs = reciprocal_rank_fusion_groups(groups, k=self.rrf_k, weights=weights)
+        return self._finish_fused(unique_docs, stats_query)
 
-            if use_memory:
-                futures.append(executor.submit(self._memory_agent, processed_query, strategy))
-            
-            if use_recent:
-                futures.append(executor.submit(self._temporal_agent, processed_query, strategy))
+    def _gather_agent_rankings(self, processed_query: Dict, strategy: Optional[Dict]) -> Dict[str, List[Dict]]:
+        """Run the enabled agents under their deadlines; {agent: ranked docs}."""
+        ranked_lists: Dict[str, List[Dict]] = {}
+        
+        # Decide which agents to use
+        use_vector = True
+        use_memory = True
+        use_recent = processed_query['temporal']['has_temporal']
+        use_code = processed_query.get('intent') == 'code'
+        if strategy:
+            use_vector = strategy.get('use_vector', use_vector)
+            use_memory = strategy.get('use_memory', use_memory)
+            use_recent = strategy.get('use_recent', use_recent)
+            use_code = strategy.get('use_code', use_code)
+            use_keywords = strategy.get('use_keywords', True)
+            use_graph = strategy.get('use_graph', False)
+        else:
+            use_keywords = True
+            use_graph = False
 
-            if use_code:
-                futures.append(executor.submit(self._code_agent, processed_query, strategy))
+        agents = []
+        if use_vector:
+            agents.append((AgentType.VECTOR, self._vector_agent))
+        if use_memory:
+            agents.append((AgentType.MEMORY, self._memory_agent))
+        if use_recent:
+            agents.append((AgentType.RECENT, self._temporal_agent))
+        if use_code:
+            agents.append((AgentType.CODE, self._code_agent))
+        if use_keywords:
+            agents.append((AgentType.KEYWORD, self._keyword_agent))
+        if use_graph:
+            agents.append((AgentType.GRAPH, self._graph_agent))
+        if not agents:
+            return ranked_lists
 
-            if use_keywords:
-                futures.append(executor.submit(self._keyword_agent, processed_query, strategy))
+        weights = (strategy or {}).get('fusion_weights') or self.fusion_weights
+        intent = processed_query.get('intent', 'general')
+        budget = float((strategy or {}).get('latency_budget_sec') or self._latency_budget_for_intent(intent))
+        pool_size = self._cascade_stages(
+            intent, (strategy or {}).get('top_k', self.default_top_k), (strategy or {}).get('rerank_candidates')
+        )[0]
+        stopped: Dict[str, Tuple[str, float]] = {}  # agent -> (reason, stopped_at)
 
-            if use_graph:
-                futures.append(executor.submit(self._graph_agent, processed_query, strategy))
-            
-            # Collect results from all agents
-            for future in as_completed(futures):
-                try:
-                    docs = future.result()
+        started = time.time()
+        deadline = started + budget
+        scopes = {agent: CancelScope(started + self._agent_timeout(agent)) for agent, _ in agents}
+        futures = {
+            self.agent_executor.submit(propagate(self._run_agent), fn, processed_query, strategy, scopes[agent]): agent
+            for agent, fn in agents
+        }
+        agent_deadline = {future: scopes[agent].deadline for future, agent in futures.items()}
+        pending = set(futures)
+        try:
+            while pending:
+                now = time.time()
+                for future in [f for f in pending if now >= agent_deadline[f]]:
+                    pending.discard(future)
+                    stopped[futures[future].value] = ('timeout', now)
+                if not pending:
+                    break
+                if now >= deadline and ranked_lists:
+                    for future in pending:
+                        stopped[futures[future].value] = ('budget_exceeded', now)
+                    break
+                pending_agents = [futures[f].value for f in pending]
+                if self._candidate_pool_settled(ranked_lists, pending_agents, weights, pool_size):
+                    for agent in pending_agents:
+                        stopped[agent] = ('cannot_improve', now)
+                    break
+
+                # Sleep until the next agent finishes or the nearest deadline
+                next_deadline = min(agent_deadline[f] for f in pending)
+                if ranked_lists:
+                    next_deadline = min(next_deadline, deadline)
+                done, _ = wait(pending, timeout=max(0.01, next_deadline - now), return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.discard(future)
+                    agent = futures[future]
+                    try:
+                        docs, t_start, t_end = future.result()
+                    except Cancelled:
+                        stopped[agent.value] = ('timeout', time.time())
+                        continue
+                    except Exception as e:
+                        print(f"  ⚠️  {agent.value} agent failed: {e}")
+                        self.tracer.record_span(f'agent.{agent.value}', started, time.time(),
+                                                {'agent': agent.value}, status='error', error=str(e))
+                        continue
+                    self.tracer.record_span(f'agent.{agent.value}', t_start, t_end,
+                                            {'agent': agent.value, 'docs': len(docs or [])})
                     if docs:
-                        all_documents.extend(docs)
-                        print(f"  ✅ Agent returned {len(docs)} documents")
-                except Exception as e:
-                    print(f"  ⚠️  Agent failed: {e}")
-        
-        # Deduplicate documents
-        seen = set()
-        unique_docs = []
-        for doc in all_documents:
-            doc_hash = hash(doc['content'][:200])
-            if doc_hash not in seen:
-                seen.add(doc_hash)
-                unique_docs.append(doc)
+                        rank_by = 'temporal_boost' if agent is AgentType.RECENT else 'score'
+                        ranked_lists[agent.value] = rank_within_agent(docs, by=rank_by)
+                        print(f"  ✅ {agent.value} agent returned {len(docs)} documents")
+        finally:
+            # Don't wait for abandoned agents: unstarted ones are dropped from
+            # the queue, running ones give up at their next check
+            for future in pending:
+                future.cancel()
+                scopes[futures[future]].cancel()
+
+        for agent, (reason, stopped_at) in stopped.items():
+            print(f"  ⏹️  {agent} agent stopped ({reason})")
+            self.tracer.record_span(f'agent.{agent}', started, stopped_at,
+                                    {'agent': agent, 'reason': reason, 'budget_sec': budget},
+                                    status='cancelled')
+        processed_query.setdefault('retrieval_stats', {})['agents_stopped'] = {
+            agent: reason for agent, (reason, _) in stopped.items()
+        }
+        return ranked_lists
+
+    def _finish_fused(self, unique_docs: List[Dict], processed_query: Dict) -> List[Dict]:
+        """Near-duplicate pass over a fused list; stats go to ``processed_query``."""
+        # Near-duplicates (same text via memory, overlapping chunks, session logs)
+        removed = 0
+        if self.near_dup_filter:
+            unique_docs, removed = self.near_dup_filter.filter(unique_docs, on_duplicate=merge_fused)
+            unique_docs.sort(key=lambda d: d['rrf_score'], reverse=True)
+            if removed:
+                print(f"  🧹 Removed {removed} near-duplicate documents")
+        processed_query.setdefault('retrieval_stats', {})['near_duplicates_removed'] = removed
         
         print(f"  📚 Total unique documents: {len(unique_docs)}")
         return unique_docs
     
+    @staticmethod
+    def _run_agent(fn, processed_query: Dict, strategy: Optional[Dict],
+                   scope: CancelScope) -> Tuple[List[Dict], float, float]:
+        with cancel_scope(scope):
+            check_cancelled()  # waited in the pool past its deadline
+            t_start = time.time()
+            docs = fn(processed_query, strategy)
+            return docs, t_start, time.time()
+
+    def _candidate_pool_settled(self,
+                                ranked_lists: Dict[str, List[Dict]],
+                                pending_agents: List[str],
+                                weights: Dict[str, float],
+                                pool_size: int) -> bool:
+        """True if no pending agent can change which docs reach the reranker.
+
+        A pending agent adds at most w / (k + 1) to any document's RRF score,
+        so the pool is final once both the gap between the last document in
+        the pool and the first one outside it, and the last pool score itself
+        (for docs not seen yet), exceed the sum of pending weights / (k + 1).
+        """
+        if not ranked_lists or not pending_agents:
+            return False
+        fused = reciprocal_rank_fusion(ranked_lists, k=self.rrf_k, weights=weights)
+        if len(fused) < pool_size:
+            return False
+        max_gain = sum(float(weights.get(a, 1.0)) for a in pending_agents) / (self.rrf_k + 1)
+        last_in = fused[pool_size - 1]['rrf_score']
+        first_out = fused[pool_size]['rrf_score'] if len(fused) > pool_size else 0.0
+        return last_in - first_out > max_gain and last_in > max_gain
+
+    def _rerank_candidate_count(self, top_k: int, strategy: Optional[Dict] = None) -> int:
+        """Number of fused candidates handed to the cross-encoder."""
+        candidates = (strategy or {}).get('rerank_candidates')
+        if candidates is None:
+            candidates = max(self.rerank_min_candidates, int(top_k * self.rerank_candidate_factor))
+        return max(top_k, int(candidates))
+
+    def _latency_budget_for_intent(self, intent: str) -> float:
+        return self.retrieval_budget.get(intent, self.retrieval_budget['general'])
+
+    def _agent_timeout(self, agent: AgentType) -> float:
+        return self.agent_timeouts.get(agent.value, 10.0)
+
+    def _vector_search(self, processed_query: Dict, q: str, n_results: int) -> List[Dict]:
+        check_cancelled()  # agents loop over query variations: stop between calls
+        memo: Optional[SearchMemo] = processed_query.get('search_memo')
+        if memo is None:
+            return self.vector_store.search(q, n_results=n_results)
+        return memo.get_or_search(('vector', q, n_results),
+                                  lambda: self.vector_store.search(q, n_results=n_results))
+
+    def _memory_search(self, processed_query: Dict, q: str, limit: int) -> List[Dict]:
+        check_cancelled()
+        memo: Optional[SearchMemo] = processed_query.get('search_memo')
+        if memo is None:
+            return self.mcp_client.search(q, limit=limit)
+        return memo.get_or_search(('memory', q, limit),
+                                  lambda: self.mcp_client.search(q, limit=limit))
+
     def _vector_agent(self, processed_query: Dict, strategy: Optional[Dict] = None) -> List[Dict]:
         """Agent for vector/semantic search with dynamic budget"""
         print("  🔍 Vector agent searching...")
@@ -398,7 +731,7 @@ class AdvancedRAGv2:
         quality_budget = 30  # Stop if we have 30+ docs with score > 0.8
         
         for q in all_queries:
-            results = self.vector_store.search(q, n_results=n_results)
+            results = self._vector_search(processed_query, q, n_results)
             all_results.extend(results)
             
             # Early stopping: check if budget met
@@ -419,7 +752,7 @@ class AdvancedRAGv2:
         limit = 20
         if strategy:
             limit = int(strategy.get('memory_limit', limit))
-        results = self.mcp_client.search(processed_query['original'], limit=limit)
+        results = self._memory_search(processed_query, processed_query['original'], limit)
         all_results.extend(results)
         
         # Search with concepts
@@ -427,7 +760,7 @@ class AdvancedRAGv2:
         if strategy:
             per_concept = int(strategy.get('memory_concepts', per_concept))
         for concept in processed_query['concepts'][:per_concept]:
-            results = self.mcp_client.search(concept, limit=max(5, limit//2))
+            results = self._memory_search(processed_query, concept, max(5, limit//2))
             all_results.extend(results)
         
         return all_results
@@ -439,7 +772,7 @@ class AdvancedRAGv2:
         print("  ⏰ Temporal agent searching (aggressive trading mode)...")
         
         # Search baseline
-        results = self.mcp_client.search(processed_query['original'], limit=30)
+        results = self._memory_search(processed_query, processed_query['original'], 30)
         
         # AGGRESSIVE temporal weighting for trading context
         from datetime import datetime, timezone
@@ -496,37 +829,9 @@ class AdvancedRAGv2:
         if self.serena_index and self.serena_index.available():
             return self.serena_index.search(queries, limit=limit)
 
-        # Fallback scan (only if Serena cache is inaccessible)
-        import re
-
-        patterns = [pat for pat in queries if pat]
-        if not patterns:
-            return []
-
-        root = self.project_root
-        exts = {'.py', '.ts', '.tsx', '.md'}
-        results: List[Dict] = []
-        scanned = 0
-        for path in root.rglob('*'):
-            if scanned >= 400 or len(results) >= limit:
-                break
-            if not path.is_file() or path.suffix not in exts:
-                continue
-            try:
-                text = path.read_text(encoding='utf-8', errors='ignore')
-            except Exception:
-                continue
-            if any(re.search(re.escape(pat), text, re.IGNORECASE) for pat in patterns):
-                snippet = '\n'.join(text.splitlines()[:200])
-                rel = str(path.relative_to(self.project_root))
-                results.append({
-                    'id': f'code::{rel}',
-                    'content': f"# File: {rel}\n{snippet}",
-                    'source': 'code_fallback',
-                    'metadata': {'path': rel}
-                })
-                scanned += 1
-        return results
+        if self.code_index is not None:
+            return self.code_index.search(queries, limit=limit)
+        return []
 
     def _keyword_agent(self, processed_query: Dict, strategy: Optional[Dict] = None) -> List[Dict]:
         print("  🧾 Keyword agent searching...")
@@ -544,60 +849,169 @@ class AdvancedRAGv2:
     
     # ============= STAGE 3: INTELLIGENT RE-RANKING =============
     
-    def rerank_documents(self, query: str, documents: List[Dict], top_k: int = 30) -> List[Dict]:
+    def rerank_documents(self,
+                         query: str,
+                         documents: List[Dict],
+                         top_k: int = 30,
+                         candidates: Optional[int] = None,
+                         intent: str = 'general',
+                         stats: Optional[Dict] = None) -> List[Dict]:
         """
-        Two-stage re-ranking: quick filter first, then cross-encoder on best candidates
+        Cascade re-ranking of the fused candidates (stage sizes per intent):
+        1. bi-encoder cosine over the pool (stored/cached embeddings, no model call
+           for vector hits)
+        2. small cross-encoder over the cosine survivors
+        3. full cross-encoder over the final shortlist only
+        Results are ordered by tier (full > small > cosine). The tiers' scores
+        are not calibrated against each other, so when ``top_k`` exceeds the
+        full tier the tail is only ordered by a weaker scorer: each document
+        is tagged with its ``rerank_tier`` and the mix is logged (``stats``
+        ``tiers``). With the cascade disabled the full cross-encoder scores
+        the whole pool.
         """
         if not documents:
             return []
+        stats = stats if stats is not None else {}
         
         print(f"\n📊 Re-ranking {len(documents)} documents...")
         
-        # STAGE 1: Quick filter by existing scores (vector similarity, etc.)
-        # Sort by score if available, otherwise keep order
+        # Pool: top by fused rank (RRF puts every agent on the same scale);
+        # raw scores only as fallback for unfused inputs
         quick_sorted = sorted(
             documents, 
-            key=lambda x: x.get('score', 0) + x.get('vector_score', 0), 
+            key=lambda x: x.get('rrf_score', x.get('score', 0) + x.get('vector_score', 0)), 
             reverse=True
         )
+        pool_size, light_size, full_size = self._cascade_stages(intent, top_k, candidates)
+        pool = quick_sorted[:pool_size]
         
-        # Only use cross-encoder on top candidates (60% reduction)
-        candidates_limit = min(len(quick_sorted), max(50, top_k * 2))
-        candidates = quick_sorted[:candidates_limit]
-        
-        print(f"  🔍 Stage 1: Filtered to top {len(candidates)} candidates")
-        
-        # STAGE 2: Prepare for cross-encoder
-        pairs = [[query, doc['content'][:1000]] for doc in candidates]
-        
-        # Get cross-encoder scores
-        ce_scores = self.reranker.predict(pairs)
-        
-        print(f"  🎯 Stage 2: Cross-encoder evaluated {len(candidates)} docs")
+        print(f"  🔍 Pool: top {len(pool)} fused candidates")
         
-        # Combine multiple signals
-        for i, doc in enumerate(candidates):
-            # Base score from cross-encoder
-            final_score = float(ce_scores[i])
-            
-            # Boost for vector similarity
-            if 'vector_score' in doc:
-                final_score += doc['vector_score'] * 0.2
-            
-            # Boost for temporal relevance
-            if 'temporal_boost' in doc:
-                final_score *= float(doc['temporal_boost'])
+        if self.light_reranker is None:
+            tiers = [('full', pool, self._cross_encode(self.reranker, query, pool))]
+            stats.update({'pool': len(pool), 'light_ce_pairs': 0, 'full_ce_pairs': len(pool)})
+        else:
+            # Stage 1: bi-encoder cosine
+            cosine = self._bi_encoder_scores(query, pool)
+            by_cosine = sorted(range(len(pool)), key=lambda i: cosine[i], reverse=True)
+            light_docs = [pool[i] for i in by_cosine[:light_size]]
+            cosine_tail = [(pool[i], cosine[i]) for i in by_cosine[light_size:]]
+            print(f"  🧭 Stage 1: bi-encoder cosine kept {len(light_docs)} of {len(pool)}")
             
-            # Boost for exact match
-            if query.lower() in doc['content'].lower():
-                final_score *= 1.2
+            # Stage 2: small cross-encoder
+            light_scores = self._cross_encode(self.light_reranker, query, light_docs)
+            by_light = sorted(range(len(light_docs)), key=lambda i: light_scores[i], reverse=True)
+            full_docs = [light_docs[i] for i in by_light[:full_size]]
+            light_tail = [(light_docs[i], light_scores[i]) for i in by_light[full_size:]]
             
-            doc['final_score'] = final_score
+            # Stage 3: full cross-encoder on the shortlist
+            full_scores = self._cross_encode(self.reranker, query, full_docs)
+            tiers = [
+                ('full', full_docs, full_scores),
+                ('light', [d for d, _ in light_tail], [sc for _, sc in light_tail]),
+                ('cosine', [d for d, _ in cosine_tail], [sc for _, sc in cosine_tail]),
+            ]
+            stats.update({'pool': len(pool), 'light_ce_pairs': len(light_docs), 'full_ce_pairs': len(full_docs)})
+        
+        full_cost = self._cross_encoder_cost(self.reranker)
+        light_cost = self._cross_encoder_cost(self.light_reranker) if self.light_reranker is not None else 0.0
+        # Baseline: full cross-encoder over the pre-cascade candidate count
+        baseline_pairs = min(len(documents), self._rerank_candidate_count(top_k, {'rerank_candidates': candidates}))
+        if full_cost and baseline_pairs:
+            spent = stats['full_ce_pairs'] * full_cost + stats['light_ce_pairs'] * (light_cost or full_cost)
+            stats['ce_flops_ratio'] = round(spent / (baseline_pairs * full_cost), 3)
+            print(f"  🎯 Cross-encoder: {stats['full_ce_pairs']} full + {stats['light_ce_pairs']} light pairs "
+                  f"(~{stats['ce_flops_ratio']:.0%} of the FLOPs of {baseline_pairs} full pairs)")
+        
+        # Combine signals within each tier; tiers keep their order (scores of
+        # different tiers are on different scales, never compared)
+        ranked: List[Dict] = []
+        for tier, docs, scores in tiers:
+            for doc, score in zip(docs, scores):
+                doc['final_score'] = self._final_score(query, doc, float(score))
+                doc['rerank_tier'] = tier
+            ranked.extend(sorted(docs, key=lambda x: x['final_score'], reverse=True))
+            if len(ranked) >= top_k:
+                break
+        ranked = ranked[:top_k]
+        
+        tier_counts: Dict[str, int] = {}
+        for doc in ranked:
+            tier_counts[doc['rerank_tier']] = tier_counts.get(doc['rerank_tier'], 0) + 1
+        stats['tiers'] = tier_counts
+        weaker = len(ranked) - tier_counts.get('full', 0)
+        if weaker:
+            print(f"  ℹ️  top_k={top_k} > full cross-encoder tier ({tier_counts.get('full', 0)}): "
+                  f"the last {weaker} docs are ordered by weaker scorers ({tier_counts})")
+        
+        return ranked
+
+    def _final_score(self, query: str, doc: Dict, base: float) -> float:
+        final_score = base
+        
+        # Boost for vector similarity
+        if 'vector_score' in doc:
+            final_score += doc['vector_score'] * 0.2
+        
+        # Boost for temporal relevance
+        if 'temporal_boost' in doc:
+            final_score *= float(doc['temporal_boost'])
         
-        # Sort by final score
-        candidates.sort(key=lambda x: x['final_score'], reverse=True)
+        # Boost for exact match
+        if query.lower() in doc['content'].lower():
+            final_score *= 1.2
         
-        return candidates[:top_k]
+        return final_score
+
+    def _cascade_stages(self, intent: str, top_k: int, candidates: Optional[int] = None) -> Tuple[int, int, int]:
+        """(pool, light, full) sizes; pool 0 = derive from top_k."""
+        pool, light, full = self.rerank_cascade.get(intent, self.rerank_cascade['general'])
+        # Without the small model the full cross-encoder scores the whole pool
+        if candidates is None and pool and self.light_reranker is not None:
+            candidates = pool
+        pool = self._rerank_candidate_count(top_k, {'rerank_candidates': candidates})
+        light = min(light, pool)
+        return pool, light, min(full, light)
+
+    @staticmethod
+    def _parse_cascade(spec: str) -> Tuple[int, int, int]:
+        pool, light, full = (int(x) for x in spec.split(','))
+        return pool, max(1, light), max(1, full)
+
+    def _cross_encode(self, model, query: str, docs: List[Dict]) -> List[float]:
+        """Cross-encoder scores in input order (length-bucketed batches)."""
+        if not docs:
+            return []
+        pairs = [[query, doc['content'][:1000]] for doc in docs]
+        lengths = token_lengths(pairs, getattr(model, 'tokenizer', None),
+                                getattr(model, 'max_length', None) or 512)
+        scores, batch_stats = run_bucketed(
+            pairs, lambda batch: model.predict(batch, batch_size=len(batch)), lengths
+        )
+        print(f"  ⚖️  {type(model).__name__}: {batch_stats.summary()}")
+        return [float(sc) for sc in scores]
+
+    def _bi_encoder_scores(self, query: str, docs: List[Dict]) -> List[float]:
+        """Cosine between query and docs; reuses Chroma embeddings when present."""
+        vectors = [doc.get('embedding') for doc in docs]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            texts = [docs[i]['content'][:1000] for i in missing]
+            for i, vec in zip(missing, self.vector_store.embed_texts(texts)):
+                vectors[i] = vec
+        matrix = np.asarray(vectors, dtype=np.float32)
+        matrix /= np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+        q = np.asarray(self.vector_store.embed_query(query), dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)  # copy: q is the cached embedding
+        return (matrix @ q).tolist()
+
+    @staticmethod
+    def _cross_encoder_cost(model) -> Optional[float]:
+        """Relative per-pair cost (layers x hidden^2) from the model config."""
+        config = getattr(model, 'config', None) or getattr(getattr(model, 'model', None), 'config', None)
+        layers = getattr(config, 'num_hidden_layers', None)
+        hidden = getattr(config, 'hidden_size', None)
+        return float(layers * hidden * hidden) if layers and hidden else None
     
     # ============= STAGE 4: CONTEXT COMPRESSION =============
     
@@ -694,7 +1108,8 @@ class AdvancedRAGv2:
         RESPOSTA DETALHADA (pule a seção de análise, vá direto para síntese):
         """
         
-        response = self.claude.messages.create(
+        response = self.llm.create(
+            'generate_answer',
             model=self.model_main,
             max_tokens=8000,
             temperature=0.2,
@@ -705,43 +1120,102 @@ class AdvancedRAGv2:
     
     # ============= MAIN QUERY INTERFACE =============
     
-    def query(self, user_query: str) -> Tuple[str, float]:
+    def query(self,
+              user_query: str,
+              strategy_overrides: Optional[Dict] = None,
+              search_memo: Optional[SearchMemo] = None) -> Tuple[str, float]:
         """
         Main query interface - orchestrates the entire RAG pipeline
         Phase 3: Added detailed tracing
+
+        Evaluation hooks, per call so concurrent queries don't see each
+        other's: ``strategy_overrides`` are forced over the decided strategy
+        (the configuration under test) and ``search_memo`` is shared by every
+        case/configuration of a run (backend lookups + LLM query processing).
         """
         start_time = time.time()
         
-        # Phase 3: Start trace
+        # Phase 3: Start trace (per context: concurrent queries don't mix)
         _ = self.tracer.start_trace(
             operation='rag_query',
             query=user_query,
             metadata={'project': self.project_name}
         )
+        profiler = StageProfiler() if self.profile_enabled else None
+        try:
+            with profiling(profiler):
+                return self._answer_query(user_query, start_time, strategy_overrides, search_memo)
+        except Exception as e:
+            self.tracer.end_trace(status='error', error=str(e))
+            raise
+        finally:
+            # Every path ends its trace; this only catches the ones that didn't
+            self.tracer.end_trace()
+            if profiler is not None:
+                self._save_profile(profiler, user_query)
+
+    def _save_profile(self, profiler: StageProfiler, user_query: str) -> None:
+        """Write the per-query profile report (+ collapsed stacks) and print it."""
+        try:
+            report_path, folded_path = profiler.write(self.profile_dir, user_query)
+        except OSError as exc:
+            print(f"⚠️  Failed to write profile: {exc}")
+            return
+        report = profiler.report(user_query)
+        report['report_path'] = str(report_path)
+        report['folded_path'] = str(folded_path) if folded_path else None
+        self.last_profile = report
+        print_report(report)
+        print(f"  📄 {report_path}" + (f"\n  🔥 {folded_path} (flamegraph.pl / speedscope)" if folded_path else ""))
 
+    def _answer_query(self,
+                      user_query: str,
+                      start_time: float,
+                      strategy_overrides: Optional[Dict] = None,
+                      search_memo: Optional[SearchMemo] = None) -> Tuple[str, float]:
+        """Cache lookup, then the pipeline (single-flight per cache key)."""
         print(f"\n{'='*80}")
         print("🚀 ADVANCED RAG v2 - Processing Query")
         print(f"{'='*80}")
 
-        # Stage 1: Process Query
-        with self.tracer.span('query_processing', {'query_length': len(user_query)}):
-            processed_query = self.process_query(user_query)
+        # Local signals (intent, temporal) — no network involved
+        local_query = self.local_query_signals(user_query)
         metadata = {
-            'intent': processed_query.get('intent', 'general'),
-            'concepts': processed_query.get('concepts', []),
+            'intent': local_query.get('intent', 'general'),
+            'concepts': [],
             'total_docs': 0,
             'reranked_docs': 0,
         }
 
-        # Decide retrieval strategy (adaptive)
-        strategy = self._decide_retrieval_strategy(processed_query)
+        # Decide retrieval strategy (adaptive, depends only on local signals)
+        strategy = self._decide_retrieval_strategy(local_query, strategy_overrides)
 
-        # Cache lookup (if enabled)
-        cache_key = self._build_cache_key(user_query, processed_query, strategy)
-        cached_payload = self.cache.get(cache_key) if cache_key else None
+        # Cache lookup (if enabled) BEFORE any LLM call
+        with self.tracer.span('cache_lookup', {'intent': metadata['intent']}) as span:
+            cache_key = self._build_cache_key(user_query, local_query, strategy)
+            stale_grace = self._stale_grace_for_intent(metadata['intent'])
+            cached_entry = self.cache.get_entry(cache_key, stale_grace=stale_grace) if cache_key else None
+            if span is not None:
+                span['attributes'].update({
+                    'cache.hit': cached_entry is not None,
+                    'cache.stale': bool(cached_entry and cached_entry.stale),
+                })
+        cached_payload = cached_entry.payload if cached_entry else None
+        if cached_payload and not self.corpus_versions.is_current(cached_payload.get('corpus_versions') or {}):
+            print("\n🔄 Corpus atualizado desde o cache — descartando resposta antiga.")
+            self.cache.delete(cache_key)
+            cached_entry = cached_payload = None
         if cached_payload:
             cache_elapsed = time.time() - start_time
-            print("\n⚡ Cache hit — reutilizando resposta anterior.")
+            if cached_entry.stale:
+                # Stale-while-revalidate: answer now, refresh once in background
+                refreshing = self.cache.inflight.do_async(
+                    cache_key,
+                    lambda: self._refresh_pipeline(user_query, metadata['intent'], strategy, cache_key),
+                )
+                print("\n♻️  Cache stale — reutilizando resposta" + (" e atualizando em background." if refreshing else "."))
+            else:
+                print("\n⚡ Cache hit — reutilizando resposta anterior.")
             self._display_pipeline_stats(
                 cached_payload.get('retrieved', 0),
                 cached_payload.get('reranked', 0),
@@ -751,21 +1225,79 @@ class AdvancedRAGv2:
                 from_cache=True,
             )
             log_entry = dict(cached_payload)
+            log_entry.pop('llm', None)  # the original run paid for it, not this hit
             log_entry.update({
                 'query': user_query,
                 'intent': metadata['intent'],
-                'elapsed_sec': round(cache_elapsed, 2),
+                'elapsed_sec': round(cache_elapsed, 4),
                 'from_cache': True,
                 'project': self.project_name,
                 'timestamp': datetime.utcnow().isoformat() + 'Z',
                 'cache_ttl': cached_payload.get('cache_ttl'),
+                'cache_stale': cached_entry.stale,
             })
             self.monitor.log_run(log_entry)
+            self.tracer.end_trace(result=log_entry)
             return cached_payload['answer'], cached_payload['confidence']
 
+        if not cache_key:
+            return self._run_pipeline(user_query, metadata['intent'], strategy, None, start_time, search_memo)
+
+        # Single-flight: concurrent identical queries wait on one computation
+        (answer, confidence), shared = self.cache.inflight.do(
+            cache_key,
+            lambda: self._run_pipeline(user_query, metadata['intent'], strategy, cache_key, start_time, search_memo),
+        )
+        if shared:
+            print("\n🔗 Resposta compartilhada com query idêntica em andamento.")
+            self.tracer.end_trace(result={'intent': metadata['intent'], 'confidence': confidence, 'shared': True})
+        return answer, confidence
+
+    def _refresh_pipeline(self, user_query: str, intent: str, strategy: Dict, cache_key: str) -> Tuple[str, float]:
+        """Background stale-while-revalidate refresh, traced on its own."""
+        self.tracer.start_trace(
+            operation='rag_refresh',
+            query=user_query,
+            metadata={'project': self.project_name, 'intent': intent}
+        )
+        try:
+            return self._run_pipeline(user_query, intent, strategy, cache_key, time.time())
+        finally:
+            self.tracer.end_trace()
+
+    def _run_pipeline(self,
+                      user_query: str,
+                      intent: str,
+                      strategy: Dict,
+                      cache_key: Optional[str],
+                      start_time: float,
+                      search_memo: Optional[SearchMemo] = None) -> Tuple[str, float]:
+        """Full pipeline for a cache miss (LLM processing → retrieval → generation)."""
+        with self.llm.track() as llm_usage:
+            return self._execute_pipeline(user_query, intent, strategy, cache_key, start_time, llm_usage,
+                                          search_memo)
+
+    def _execute_pipeline(self,
+                          user_query: str,
+                          intent: str,
+                          strategy: Dict,
+                          cache_key: Optional[str],
+                          start_time: float,
+                          llm_usage: LLMUsage,
+                          search_memo: Optional[SearchMemo] = None) -> Tuple[str, float]:
+        # Taken before retrieval so ingestion racing with this run invalidates it
+        corpus_snapshot = self.corpus_versions.snapshot()
+        metadata = {
+            'intent': intent,
+            'concepts': [],
+            'total_docs': 0,
+            'reranked_docs': 0,
+        }
+
         # Optional: no retrieval if obvious
         if strategy.get('mode') == 'none':
-            answer = self.generate_answer(user_query, context="", metadata={'intent': processed_query['intent']})
+            with self.tracer.span('generation', {'context_chars': 0}):
+                answer = self.generate_answer(user_query, context="", metadata={'intent': metadata['intent']})
             confidence = 50.0
             elapsed = time.time() - start_time
             cache_ttl = self._cache_ttl_for_intent(metadata['intent'])
@@ -782,26 +1314,19 @@ class AdvancedRAGv2:
                 'project': self.project_name,
                 'timestamp': datetime.utcnow().isoformat() + 'Z',
                 'cache_ttl': cache_ttl,
+                'llm': llm_usage.to_dict(),
             }
             if cache_key:
                 self.cache.set(cache_key, stats, ttl=cache_ttl)
             self.monitor.log_run(stats)
-            self._display_pipeline_stats(0, 0, 0, confidence, elapsed, from_cache=False)
+            self.tracer.end_trace(result=stats)
+            self._display_pipeline_stats(0, 0, 0, confidence, elapsed, from_cache=False, llm=stats['llm'])
             return answer, confidence
 
-        # Stage 2: Retrieval (Parallel), with optional query planning
-        with self.tracer.span('multi_agent_retrieval', {'strategy': strategy}):
-            if strategy.get('use_planning'):
-                print("\n🗺️  Query planning enabled. Decompondo em subperguntas...")
-                subqs = self._plan_query(user_query)
-                documents = []
-                for i, sq in enumerate(subqs, start=1):
-                    print(f"  🔹 Subpergunta {i}: {sq}")
-                    pq = self.process_query(sq)
-                    docs_sq = self.multi_agent_retrieval(pq, strategy)
-                    documents.extend(docs_sq)
-            else:
-                documents = self.multi_agent_retrieval(processed_query, strategy)
+        stages = self._retrieval_stages(user_query, intent, strategy, search_memo=search_memo)
+        documents = stages['documents']
+        near_dups = stages['near_duplicates_removed']
+        metadata['concepts'] = stages['processed_query'].get('concepts', [])
 
         if not documents:
             elapsed = time.time() - start_time
@@ -819,18 +1344,25 @@ class AdvancedRAGv2:
                 'project': self.project_name,
                 'timestamp': datetime.utcnow().isoformat() + 'Z',
                 'cache_ttl': cache_ttl,
+                'corpus_versions': self._corpus_dependencies(corpus_snapshot, documents),
+                'base_strategy': self._strategy_signature(intent, strategy),
+            'strategy_overrides': strategy.get('overrides'),
+                'llm': llm_usage.to_dict(),
             }
             if cache_key:
                 self.cache.set(cache_key, no_data_stats, ttl=cache_ttl)
             self.monitor.log_run(no_data_stats)
-            self._display_pipeline_stats(0, 0, 0, 0.0, elapsed, from_cache=False)
+            self.tracer.end_trace(result=no_data_stats)
+            self._display_pipeline_stats(0, 0, 0, 0.0, elapsed, from_cache=False, llm=no_data_stats['llm'])
             return no_data_stats['answer'], 0.0
 
-        # Stage 3: Re-ranking
-        reranked_docs = self.rerank_documents(user_query, documents, top_k=strategy.get('top_k', self.default_top_k))
+        reranked_docs = stages['reranked']
 
         # Stage 4: Context Compression
-        compressed_context = self.compress_context(reranked_docs, max_chars=self.context_max_chars)
+        with self.tracer.span('compression', {'docs': len(reranked_docs), 'max_chars': self.context_max_chars}) as span:
+            compressed_context = self.compress_context(reranked_docs, max_chars=self.context_max_chars)
+            if span is not None:
+                span['attributes']['context_chars'] = len(compressed_context)
 
         # Stage 5: Answer Generation
         metadata.update({
@@ -838,14 +1370,17 @@ class AdvancedRAGv2:
             'reranked_docs': len(reranked_docs),
         })
 
-        answer = self.generate_answer(user_query, compressed_context, metadata)
+        with self.tracer.span('generation', {'context_chars': len(compressed_context)}):
+            answer = self.generate_answer(user_query, compressed_context, metadata)
 
         # Calculate confidence
         confidence = min(100, len(reranked_docs) * 2.0)
 
         elapsed = time.time() - start_time
 
-        self._display_pipeline_stats(len(documents), len(reranked_docs), len(compressed_context), confidence, elapsed)
+        llm_summary = llm_usage.to_dict()
+        self._display_pipeline_stats(len(documents), len(reranked_docs), len(compressed_context), confidence, elapsed,
+                                     llm=llm_summary)
 
         cache_ttl = self._cache_ttl_for_intent(metadata['intent'])
         run_payload = {
@@ -861,6 +1396,12 @@ class AdvancedRAGv2:
             'project': self.project_name,
             'timestamp': datetime.utcnow().isoformat() + 'Z',
             'cache_ttl': cache_ttl,
+            'corpus_versions': self._corpus_dependencies(corpus_snapshot, documents),
+            'near_duplicates_removed': near_dups,
+            'base_strategy': self._strategy_signature(intent, strategy),
+            'strategy_overrides': strategy.get('overrides'),
+            'agent_contrib': self._agent_contributions(reranked_docs),
+            'llm': llm_summary,
         }
         
         # Auto-save chat interaction to Brain
@@ -876,6 +1417,110 @@ class AdvancedRAGv2:
         
         return answer, confidence
     
+    def _retrieval_stages(self,
+                          user_query: str,
+                          intent: str,
+                          strategy: Dict,
+                          use_llm: bool = True,
+                          search_memo: Optional[SearchMemo] = None) -> Dict:
+        """Stages 1-3: query processing/planning, multi-agent retrieval, rerank.
+
+        Shared by the full pipeline and retrieval-only evaluation. Returns the
+        processed query, fused documents, reranked documents (empty when
+        nothing was retrieved), near-duplicates removed and rerank stats.
+        ``use_llm=False`` searches with local signals only.
+        """
+        # Per-request memo (sub-questions and agents share backend lookups),
+        # or the evaluation run's memo shared across cases/configurations
+        if search_memo is None:
+            search_memo = SearchMemo()
+
+        # Stage 1: Process Query (LLM concepts + expansions, cache miss only).
+        # With planning, one LLM call yields sub-questions and their expansions.
+        sub_queries: List[Dict] = []
+        if not use_llm:
+            processed_query = self.local_query_signals(user_query)
+        elif strategy.get('use_planning'):
+            print("\n🗺️  Query planning enabled. Decompondo em subperguntas...")
+            with self.tracer.span('query_planning', {'query_length': len(user_query)}) as span:
+                sub_queries = search_memo.get_or_search(('plan_query', user_query),
+                                                        lambda: self._plan_and_expand(user_query))
+                if span is not None:
+                    span['attributes']['sub_questions'] = len(sub_queries) - 1
+            processed_query = self.local_query_signals(user_query)
+            concepts: List[str] = []
+            for i, sq in enumerate(sub_queries):
+                if i:  # the first entry is the original question itself
+                    print(f"  🔹 Subpergunta {i}: {sq['original']}")
+                sq['search_memo'] = search_memo
+                sq['intent'] = intent  # same strategy, same latency budget
+                concepts.extend(c for c in sq['concepts'] if c not in concepts)
+            processed_query['concepts'] = concepts
+        else:
+            with self.tracer.span('query_processing', {'query_length': len(user_query)}):
+                processed_query = search_memo.get_or_search(('process_query', user_query),
+                                                            lambda: [self.process_query(user_query)])[0]
+        processed_query['search_memo'] = search_memo
+
+        # Stage 2: Retrieval (parallel agents; planned sub-questions in parallel too)
+        with self.tracer.span('multi_agent_retrieval', {'strategy': strategy}) as span:
+            if sub_queries:
+                documents = self.multi_query_retrieval(sub_queries, strategy, processed_query)
+            else:
+                documents = self.multi_agent_retrieval(processed_query, strategy)
+            near_dups = processed_query.get('retrieval_stats', {}).get('near_duplicates_removed', 0)
+            if span is not None:
+                span['attributes']['near_duplicates_removed'] = near_dups
+                span['attributes']['search_memo_hits'] = search_memo.hits
+
+        # Stage 3: Re-ranking (cascade: cosine → small CE → full CE)
+        reranked_docs: List[Dict] = []
+        rerank_stats: Dict = {}
+        if documents:
+            with self.tracer.span('rerank', {'intent': intent}) as span:
+                reranked_docs = self.rerank_documents(user_query, documents,
+                                                      top_k=strategy.get('top_k', self.default_top_k),
+                                                      candidates=strategy.get('rerank_candidates'),
+                                                      intent=intent,
+                                                      stats=rerank_stats)
+                if span is not None:
+                    span['attributes'].update(rerank_stats)
+
+        return {
+            'processed_query': processed_query,
+            'documents': documents,
+            'reranked': reranked_docs,
+            'near_duplicates_removed': near_dups,
+            'rerank_stats': rerank_stats,
+        }
+
+    def retrieve(self,
+                 user_query: str,
+                 use_llm: bool = True,
+                 strategy_overrides: Optional[Dict] = None,
+                 search_memo: Optional[SearchMemo] = None) -> Tuple[List[Dict], Dict]:
+        """Retrieval + rerank only: no generation, answer cache or run log.
+
+        Used by retrieval-only evaluation (recall@k, MRR). Returns the
+        reranked documents and a summary (intent, retrieved, rerank stats,
+        LLM usage of query processing). ``strategy_overrides`` and
+        ``search_memo`` are the evaluation hooks of :meth:`query`.
+        """
+        local_query = self.local_query_signals(user_query)
+        intent = local_query.get('intent', 'general')
+        strategy = self._decide_retrieval_strategy(local_query, strategy_overrides)
+        if strategy.get('mode') == 'none':
+            return [], {'intent': intent, 'retrieved': 0, 'mode': 'none'}
+        with self.llm.track() as llm_usage:
+            stages = self._retrieval_stages(user_query, intent, strategy, use_llm=use_llm,
+                                            search_memo=search_memo)
+        return stages['reranked'], {
+            'intent': intent,
+            'retrieved': len(stages['documents']),
+            'rerank': stages['rerank_stats'],
+            'llm': llm_usage.to_dict(),
+        }
+
     def _auto_save_interaction(self, query: str, answer: str, metadata: Dict):
         """Auto-save chat interaction to Brain's memory system."""
         try:
@@ -891,13 +1536,12 @@ class AdvancedRAGv2:
                 feedback=None  # Will be updated if user provides feedback
             )
             
-            # Also save to session logs for RAG ingestion
+            # Also save to session logs for RAG ingestion (background sink
+            # creates the directory and appends off the query path)
             session_log_dir = Path("/home/scalp/chat_orchestrator/session_logs")
-            session_log_dir.mkdir(parents=True, exist_ok=True)
             
             context_id = metadata.get('intent', 'general')
             session_file = session_log_dir / f"{context_id}" / f"{self.project_name}_{datetime.now().strftime('%Y%m%d')}.jsonl"
-            session_file.parent.mkdir(parents=True, exist_ok=True)
             
             log_entry = {
                 'timestamp': metadata.get('timestamp', datetime.utcnow().isoformat() + 'Z'),
@@ -910,41 +1554,29 @@ class AdvancedRAGv2:
                 'from_cache': metadata.get('from_cache', False)
             }
             
-            with open(session_file, 'a') as f:
-                json.dump(log_entry, f)
-                f.write('\n')
+            get_log_sink().write(session_file, log_entry)
             
             print(f"  💾 Auto-saved to: {session_file.name}")
             
         except Exception as e:
             print(f"  ⚠️  Failed to auto-save interaction: {e}")
 
-    def _decide_retrieval_strategy(self, processed_query: Dict) -> Dict:
-        """Decide retrieval mode, agents, and top_k dynamically"""
+    def _decide_retrieval_strategy(self, processed_query: Dict, overrides: Optional[Dict] = None) -> Dict:
+        """Decide retrieval mode, agents, and top_k dynamically (``overrides`` win)"""
         intent = processed_query.get('intent', 'general')
         q = processed_query.get('original', '')
         qlen = len(q)
         is_objective = any(x in q.lower() for x in ['onde', 'qual arquivo', 'linha', 'parâmetro', 'flag', 'comando'])
+        # Per-intent base from the strategy table (learned if available)
+        base = self.strategy_table.for_intent(intent)
         strategy = {
             'mode': 'hybrid',
             'use_vector': True,
-            'use_memory': True,
             'use_recent': processed_query['temporal'].get('has_temporal', False),
-            'use_code': intent == 'code',
-            'use_keywords': intent != 'code',
-            'use_graph': intent in {'status', 'explain', 'general'},
-            'top_k': 20,
-            'vector_n_results': 10,
-            'memory_limit': 20,
-            'memory_concepts': 3,
         }
-        # Intent-based adjustments
-        if intent == 'code':
-            strategy.update({'use_code': True, 'top_k': 15, 'vector_n_results': 15, 'memory_limit': 10})
-        elif intent in ('status', 'config'):
-            strategy.update({'top_k': 15, 'vector_n_results': 8, 'memory_limit': 15})
-        elif intent == 'explain':
-            strategy.update({'top_k': max(self.default_top_k, 50), 'vector_n_results': 15, 'memory_limit': 30})
+        strategy.update(base)
+        if intent == 'explain' and not self.strategy_table.is_learned(intent):
+            strategy['top_k'] = max(self.default_top_k, strategy['top_k'])
 
         # Objective vs open-ended
         if is_objective:
@@ -968,38 +1600,109 @@ class AdvancedRAGv2:
             strategy['use_graph'] = False
 
         # Enable planning for complex/system questions
-        planning_triggers = ['pipeline', 'fluxo', 'passos', 'decompor', 'entender', 'descrever', 'inteiro']
-        strategy['use_planning'] = (len(q) > 160) or any(t in q.lower() for t in planning_triggers)
+        if strategy.get('use_planning') is None:
+            planning_triggers = ['pipeline', 'fluxo', 'passos', 'decompor', 'entender', 'descrever', 'inteiro']
+            strategy['use_planning'] = (len(q) > 160) or any(t in q.lower() for t in planning_triggers)
 
+        if overrides:
+            strategy.update(overrides)
+            # Tagged so `rag optimize` skips these runs (not a production choice)
+            strategy['overrides'] = sorted(overrides)
         return strategy
 
-    def _plan_query(self, query: str) -> List[str]:
-        """Decompose a complex question into sub-questions (max 3)."""
+    def _strategy_signature(self, intent: str, strategy: Dict) -> Dict:
+        """Tunable part of the intent's base strategy, logged so `rag optimize` can fit it.
+
+        The base is what the table returns, before the query-level
+        adjustments _decide_retrieval_strategy applies again at runtime;
+        ``use_planning`` is the decision actually taken.
+        """
+        base = self.strategy_table.for_intent(intent)
+        signature = {name: base.get(name) for name in TUNABLE_FIELDS}
+        signature['use_planning'] = bool(strategy.get('use_planning'))
+        return signature
+
+    @staticmethod
+    def _agent_contributions(docs: List[Dict]) -> Dict[str, int]:
+        """How many of the final documents each agent retrieved."""
+        contrib: Dict[str, int] = {}
+        for doc in docs:
+            for agent in doc.get('agents') or {}:
+                contrib[agent] = contrib.get(agent, 0) + 1
+        return contrib
+
+    def _plan_and_expand(self, query: str) -> List[Dict]:
+        """
+        Decompose a complex question into sub-questions (max 3) and extract
+        concepts/expansions for each one, in a single LLM call.
+
+        Returns the original question (local signals) followed by one
+        processed query per sub-question (same shape as process_query), so a
+        poor plan never drops the question itself from retrieval. A malformed
+        plan falls back to the original question alone.
+        """
+        original = self.local_query_signals(query)
+        fallback = [original]
         try:
             prompt = f"""
             Decompose the following question into 2-3 concise sub-questions that help answer it step-by-step.
-            Return only the sub-questions, one per line.
+            For each sub-question give up to 5 key technical concepts (nouns, technical terms, keywords)
+            and up to 3 search variations (synonyms, related terms, different phrasings).
 
             Question: "{query}"
+
+            Return only JSON:
+            {{"sub_questions": [{{"question": "...", "concepts": ["..."], "expansions": ["..."]}}]}}
             """
-            response = self.claude.messages.create(
+            response = self.llm.create(
+                'plan_query',
                 model=self.model_fast,
-                max_tokens=120,
+                max_tokens=600,
                 temperature=0.2,
                 messages=[{"role": "user", "content": prompt}]
             )
-            subs = [s.strip() for s in response.content[0].text.strip().split('\n') if s.strip()]
-            return subs[:3] if subs else [query]
+            text = response.content[0].text.strip()
+            # Tolerate prose or ```json fences around the object
+            data = json.loads(text[text.index('{'):text.rindex('}') + 1])
         except Exception:
-            return [query]
+            return fallback
+
+        sub_questions = data.get('sub_questions') if isinstance(data, dict) else None
+        if not isinstance(sub_questions, list):
+            return fallback
+
+        def terms(value, limit: int) -> List[str]:
+            if not isinstance(value, list):
+                return []
+            return [str(t).strip() for t in value if str(t).strip()][:limit]
+
+        processed = [original]
+        for item in sub_questions:
+            if len(processed) > 3:
+                break
+            if not isinstance(item, dict):
+                continue
+            question = str(item.get('question') or '').strip()
+            if not question or question == query.strip():
+                continue
+            pq = self.local_query_signals(question)
+            pq['concepts'] = terms(item.get('concepts'), 5)
+            pq['expansions'] = terms(item.get('expansions'), 3)
+            processed.append(pq)
+        return processed
     
     # ============= MAINTENANCE FUNCTIONS =============
     
     def update_vector_store(self):
         """Update vector store with latest MCP memories"""
         print("\n🔄 Updating vector store from MCP...")
-        count = self.vector_store.update_from_mcp(self.mcp_client)
-        print(f"✅ Updated {count} chunks in vector store")
+        memories = self.mcp_client.search("", limit=1000)  # Empty query gets all
+        if not memories:
+            print("  ⚠️  No memories found in MCP")
+            return 0
+        count = self.vector_store.add_documents(memories)
+        indexed = self.keyword_retriever.index_documents(memories, namespace='mcp')
+        print(f"✅ Updated {count} chunks in vector store ({indexed} memories in keyword index)")
         return count
 
     def update_local_knowledge(self) -> int:
@@ -1032,6 +1735,14 @@ class AdvancedRAGv2:
                 "docs/**/*.md",
             ]
 
+        updated_files = self.keyword_retriever.refresh()
+        if updated_files:
+            print(f"  🧾 Keyword index refreshed ({updated_files} files)")
+        if self.code_index is not None:
+            updated_code = self.code_index.refresh()
+            if updated_code:
+                print(f"  🧩 Code index refreshed ({updated_code} files)")
+
         documents: List[Dict] = []
         paths = self._expand_globs(globs)
         for path in paths:
@@ -1075,9 +1786,29 @@ class AdvancedRAGv2:
             'vector_store': self.vector_store.get_stats(),
             'mcp_available': True,
             'claude_model': self.model_main,
-            'reranker_model': 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+            'reranker_model': 'cross-encoder/ms-marco-MiniLM-L-6-v2',
+            'inference_backend': type(self.reranker).__name__ if inference_backend() == 'onnx' else 'torch',
+            'llm': self.llm.stats(),
         }
 
+    def _corpus_dependencies(self, snapshot: Dict[str, int], documents: List[Dict]) -> Dict[str, int]:
+        """Corpus partitions (with versions) an answer was built from.
+
+        An empty retrieval depends on the whole corpus: any ingestion may
+        turn it into a real answer.
+        """
+        if not documents:
+            names = {CorpusVersions.GLOBAL}
+        else:
+            names = set()
+            for doc in documents:
+                names.update(CorpusVersions.partitions_for(doc.get('metadata')))
+        return {name: snapshot.get(name, 0) for name in sorted(names)}
+
+    def _stale_grace_for_intent(self, intent: str) -> int:
+        """Seconds past TTL during which a stale answer may still be served."""
+        return max(0, self.intent_stale_policy.get(intent, self.intent_stale_policy['general']))
+
     def _cache_ttl_for_intent(self, intent: str) -> int:
         if not self.cache:
             return 0
@@ -1124,10 +1855,12 @@ class AdvancedRAGv2:
     async def batch_query(self, queries: List[str], parallel: bool = True) -> List[Dict]:
         """Processar múltiplas queries em batch para otimizar throughput."""
         if parallel and len(queries) > 1:
-            # Usar ThreadPoolExecutor para queries paralelas
+            # Usar ThreadPoolExecutor para queries paralelas, sem bloquear o event loop;
+            # cada query abre seu próprio trace no contexto da thread
+            loop = asyncio.get_running_loop()
             with ThreadPoolExecutor(max_workers=min(len(queries), 10)) as executor:
-                futures = [executor.submit(self.query, q) for q in queries]
-                return [f.result() for f in futures]
+                futures = [loop.run_in_executor(executor, propagate(self.query), q) for q in queries]
+                return list(await asyncio.gather(*futures))
         else:
             return [self.query(q) for q in queries]
 
@@ -10,6 +10,8 @@ import asyncio
 from typing import List, Dict
 from pathlib import Path
 
+from rag_system.utils.deadline import time_left
+
 
 class MCPMemoryDirect:
     """Direct access to MCP Memory via mcp_memory_client.py"""
@@ -22,15 +24,17 @@ class MCPMemoryDirect:
         """
         Search memories using mcp_memory_client.py (same as memory CLI)
         
-        Returns list of documents with content
+        Returns list of documents with content. Inside a retrieval agent the
+        subprocess is killed at the agent's deadline instead of after 30s.
         """
+        timeout = time_left(30)
         try:
             # Call exactly like memory-cli.sh does
             result = subprocess.run(
                 [self.python_path, self.client_path, "search", json.dumps({"query": query})],
                 capture_output=True,
                 text=True,
-                timeout=30
+                timeout=timeout
             )
             
             if result.returncode != 0:
@@ -6,6 +6,8 @@ Uses ChromaDB for local vector storage and sentence-transformers for embeddings
 import os
 import json
 import hashlib
+import threading
+from collections import OrderedDict
 from typing import List, Dict, Optional, Tuple
 from pathlib import Path
 import numpy as np
@@ -15,8 +17,12 @@ import glob
 import chromadb
 from chromadb.config import Settings
 
-# Sentence transformers for embeddings
-from sentence_transformers import SentenceTransformer
+# Sentence transformers for embeddings (PyTorch, or ONNX Runtime via env)
+from rag_system.utils.onnx_backend import load_embedder
+
+from rag_system.utils.batching import run_bucketed, token_lengths
+from rag_system.utils.cache import CorpusVersions
+from rag_system.utils.dedup import NearDuplicateFilter
 
 # For chunking
 try:
@@ -26,11 +32,17 @@ except ImportError:
 
 class VectorStore:
     """Advanced vector store with semantic search capabilities"""
+
+    QUERY_EMBEDDING_CACHE = 256
+    TEXT_EMBEDDING_CACHE = 4096
     
     def __init__(self, 
                  persist_dir: str = "/home/scalp/rag_system/chroma_db",
                  embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2",
-                 collection_name: str = "scalp_knowledge"):
+                 collection_name: str = "scalp_knowledge",
+                 corpus_versions: Optional[CorpusVersions] = None,
+                 near_dup_threshold: float = 0.0,
+                 embedder=None):
         """
         Initialize vector store with ChromaDB and embeddings
         
@@ -38,12 +50,23 @@ class VectorStore:
             persist_dir: Directory to persist ChromaDB
             embedding_model: Model for generating embeddings
             collection_name: Name of the ChromaDB collection
+            corpus_versions: Optional partition counters bumped on ingestion
+                (used to invalidate cached answers precisely)
+            near_dup_threshold: Drop chunks of a batch whose estimated Jaccard
+                similarity to an earlier chunk is >= this (0 disables)
+            embedder: Ready encoder (``encode`` like SentenceTransformer) used
+                instead of loading ``embedding_model`` (offline benchmark)
         """
         print(f"🚀 Initializing Vector Store...")
+        self.corpus_versions = corpus_versions
+        self.near_dup_filter = NearDuplicateFilter(near_dup_threshold) if near_dup_threshold > 0 else None
         
         # Initialize embedding model
-        print(f"  📊 Loading embedding model: {embedding_model}")
-        self.embedder = SentenceTransformer(embedding_model)
+        if embedder is not None:
+            self.embedder = embedder
+        else:
+            print(f"  📊 Loading embedding model: {embedding_model}")
+            self.embedder = load_embedder(embedding_model)
         
         # Initialize ChromaDB client
         print(f"  💾 Initializing ChromaDB at: {persist_dir}")
@@ -64,6 +87,11 @@ class VectorStore:
             )
             print(f"  ✅ Created new collection: {collection_name}")
         
+        # Embedding caches (query strings; non-indexed texts by content hash)
+        self._embed_lock = threading.Lock()
+        self._query_embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._text_embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        
         # Initialize text splitter for chunking
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
@@ -89,9 +117,9 @@ class VectorStore:
         print(f"\n📝 Processing {len(documents)} documents for vector store...")
         
         all_chunks = []
-        all_embeddings = []
         all_metadatas = []
         all_ids = []
+        seen_ids = set()
         
         for doc in documents:
             content = doc.get('content', '')
@@ -109,6 +137,9 @@ class VectorStore:
                 # This ensures re-ingestion of same content creates same ID
                 # DO NOT include index or count as they may vary between runs
                 chunk_id = hashlib.sha256(chunk.encode('utf-8')).hexdigest()
+                if chunk_id in seen_ids:
+                    continue
+                seen_ids.add(chunk_id)
                 
                 # Enhanced metadata
                 chunk_metadata = self._sanitize_metadata({
@@ -126,35 +157,76 @@ class VectorStore:
         if not all_chunks:
             print("  ⚠️  No valid chunks to add")
             return 0
+
+        # Near-duplicate chunks within this batch (e.g. same note from MCP
+        # and from a session log) would only waste embeddings and context
+        if self.near_dup_filter:
+            indexed = [{'content': c, 'i': i} for i, c in enumerate(all_chunks)]
+            kept, removed = self.near_dup_filter.filter(indexed)
+            if removed:
+                keep = [d['i'] for d in kept]
+                all_chunks = [all_chunks[i] for i in keep]
+                all_metadatas = [all_metadatas[i] for i in keep]
+                all_ids = [all_ids[i] for i in keep]
+                print(f"  🧹 Skipped {removed} near-duplicate chunks")
+
+        # Skip chunks already stored (IDs are content hashes): saves the
+        # embedding work and keeps corpus versions stable on re-ingestion
+        existing = self._existing_ids(all_ids)
+        if existing:
+            keep = [i for i, chunk_id in enumerate(all_ids) if chunk_id not in existing]
+            all_chunks = [all_chunks[i] for i in keep]
+            all_metadatas = [all_metadatas[i] for i in keep]
+            all_ids = [all_ids[i] for i in keep]
+            print(f"  ⏭️  {len(existing)} chunks already indexed")
+            if not all_chunks:
+                return 0
             
         print(f"  🔄 Generating embeddings for {len(all_chunks)} chunks...")
         
-        # Generate embeddings in batches
+        # Embed in length-sorted buckets (less padding), then store in order
+        lengths = token_lengths(all_chunks, getattr(self.embedder, 'tokenizer', None), self._max_seq_length())
+        embeddings, batch_stats = run_bucketed(
+            all_chunks,
+            lambda batch: self.embedder.encode(batch, batch_size=len(batch),
+                                               convert_to_numpy=True, show_progress_bar=False),
+            lengths,
+        )
+        print(f"  ⚡ Embeddings: {batch_stats.summary()}")
+
         for i in range(0, len(all_chunks), batch_size):
-            batch_chunks = all_chunks[i:i+batch_size]
-            batch_ids = all_ids[i:i+batch_size]
-            batch_metadatas = all_metadatas[i:i+batch_size]
-            
-            # Generate embeddings
-            batch_embeddings = self.embedder.encode(
-                batch_chunks,
-                convert_to_numpy=True,
-                show_progress_bar=False
-            ).tolist()
-            
             # Add to ChromaDB
             self.collection.add(
-                embeddings=batch_embeddings,
-                documents=batch_chunks,
-                metadatas=batch_metadatas,
-                ids=batch_ids
+                embeddings=[e.tolist() for e in embeddings[i:i+batch_size]],
+                documents=all_chunks[i:i+batch_size],
+                metadatas=all_metadatas[i:i+batch_size],
+                ids=all_ids[i:i+batch_size]
             )
             
             print(f"  ✅ Added batch {i//batch_size + 1}/{(len(all_chunks) + batch_size - 1)//batch_size}")
         
         print(f"  ✅ Added {len(all_chunks)} chunks to vector store")
+        if self.corpus_versions is not None:
+            partitions = set()
+            for meta in all_metadatas:
+                partitions.update(CorpusVersions.partitions_for(meta))
+            self.corpus_versions.bump(partitions)
         return len(all_chunks)
 
+    def _max_seq_length(self) -> Optional[int]:
+        return getattr(self.embedder, 'max_seq_length', None) or getattr(self.embedder, 'max_length', None)
+
+    def _existing_ids(self, ids: List[str], batch_size: int = 500) -> set:
+        """Return the subset of ids already present in the collection."""
+        found = set()
+        for i in range(0, len(ids), batch_size):
+            try:
+                res = self.collection.get(ids=ids[i:i+batch_size], include=[])
+            except Exception:
+                continue
+            found.update(res.get('ids') or [])
+        return found
+
     def _sanitize_metadata(self, metadata: Dict) -> Dict:
         """Ensure metadata values are Chroma-compatible (no None)."""
         clean: Dict = {}
@@ -220,28 +292,72 @@ class VectorStore:
         Returns:
             List of relevant documents with scores
         """
-        # Generate query embedding
-        query_embedding = self.embedder.encode(query, convert_to_numpy=True).tolist()
+        # Generate query embedding (cached: the reranker reuses it)
+        query_embedding = self.embed_query(query).tolist()
         
-        # Search in ChromaDB
+        # Search in ChromaDB (stored embeddings feed the cascade reranker)
         results = self.collection.query(
             query_embeddings=[query_embedding],
             n_results=n_results,
-            where=filter_metadata if filter_metadata else None
+            where=filter_metadata if filter_metadata else None,
+            include=['documents', 'metadatas', 'distances', 'embeddings']
         )
         
         # Format results
         documents = []
+        embeddings = results.get('embeddings')
         if results['documents'] and results['documents'][0]:
             for i, doc in enumerate(results['documents'][0]):
                 documents.append({
                     'content': doc,
                     'score': 1 - results['distances'][0][i],  # Convert distance to similarity
-                    'metadata': results['metadatas'][0][i] if results['metadatas'] else {}
+                    'metadata': results['metadatas'][0][i] if results['metadatas'] else {},
+                    'embedding': embeddings[0][i] if embeddings is not None and len(embeddings) else None
                 })
         
         return documents
     
+    def embed_query(self, text: str) -> np.ndarray:
+        """Query embedding, LRU-cached per process."""
+        with self._embed_lock:
+            cached = self._query_embeddings.get(text)
+            if cached is not None:
+                self._query_embeddings.move_to_end(text)
+                return cached
+        vector = np.asarray(self.embedder.encode(text, convert_to_numpy=True), dtype=np.float32)
+        vector.setflags(write=False)  # shared by every caller; never normalise in place
+        with self._embed_lock:
+            self._query_embeddings[text] = vector
+            while len(self._query_embeddings) > self.QUERY_EMBEDDING_CACHE:
+                self._query_embeddings.popitem(last=False)
+        return vector
+
+    def embed_texts(self, texts: List[str]) -> List[np.ndarray]:
+        """Embeddings for arbitrary texts (e.g. keyword/memory hits not stored
+        in Chroma), cached by content hash and computed in length buckets."""
+        keys = [hashlib.sha1(t.encode('utf-8')).hexdigest() for t in texts]
+        with self._embed_lock:
+            found = {k: self._text_embeddings[k] for k in keys if k in self._text_embeddings}
+        missing = list(dict.fromkeys(k for k in keys if k not in found))
+        if missing:
+            by_key = dict(zip(keys, texts))
+            pending = [by_key[k] for k in missing]
+            lengths = token_lengths(pending, getattr(self.embedder, 'tokenizer', None), self._max_seq_length())
+            vectors, _ = run_bucketed(
+                pending,
+                lambda batch: self.embedder.encode(batch, batch_size=len(batch),
+                                                   convert_to_numpy=True, show_progress_bar=False),
+                lengths,
+            )
+            with self._embed_lock:
+                for k, v in zip(missing, vectors):
+                    vector = np.asarray(v, dtype=np.float32)
+                    vector.setflags(write=False)
+                    found[k] = self._text_embeddings[k] = vector
+                while len(self._text_embeddings) > self.TEXT_EMBEDDING_CACHE:
+                    self._text_embeddings.popitem(last=False)
+        return [found[k] for k in keys]
+
     def hybrid_search(self,
                      query: str,
                      keyword_results: List[Dict],
@@ -340,6 +456,8 @@ class VectorStore:
             name=self.collection.name,
             metadata={"hnsw:space": "cosine"}
         )
+        if self.corpus_versions is not None:
+            self.corpus_versions.bump_all()
         print("  ✅ Vector store cleared")
     
     def get_stats(self) -> Dict:
@@ -8,14 +8,28 @@ queries the current RAG system, and scores on:
 - hallucination (0-10, higher is worse → inverted for score)
 - completeness (0-10)
 
+Cases run with bounded concurrency and every case records its latency per
+pipeline stage. One search memo is shared by the whole run, so backend
+lookups and LLM query processing are reused across cases and across
+configurations (strategy overrides compared in the same run).
+
+Retrieval-only mode (no generation) scores cases labeled with
+``relevant_docs`` (file paths, path suffixes, MCP entity names or chunk ids)
+with recall@k and MRR@k.
+
 Outputs JSON logs under rag_eval_runs/run_<timestamp>.json
 """
 
 from __future__ import annotations
+import hashlib
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Set
+
+from rag_system.utils.cache import SearchMemo
+from rag_system.utils.profiler import StageProfiler, profiling
 
 
 def _tokenize(text: str) -> List[str]:
@@ -70,48 +84,169 @@ def score_answer(ideal: str, system_answer: str) -> Dict[str, float]:
     }
 
 
-def run_quality_suite(rag, suite_path: Path, out_dir: Path) -> Path:
-    suite = json.loads(Path(suite_path).read_text(encoding='utf-8'))
-    results = []
-    start = time.time()
+def doc_identifiers(doc: Dict) -> Set[str]:
+    """Labels a retrieved document can be matched by."""
+    meta = doc.get('metadata') or {}
+    ids = {hashlib.sha256(doc.get('content', '').encode('utf-8')).hexdigest()}
+    for key in ('path', 'file_path', 'file', 'entity', 'id'):
+        value = meta.get(key) or doc.get(key)
+        if value:
+            ids.add(str(value))
+    return ids
 
-    for case in suite.get('tests', []):
-        question = case.get('question', '')
-        ideal = case.get('ideal_answer', '')
-        try:
-            answer, confidence = rag.query(question)
-        except Exception as e:
-            answer, confidence = f"❌ Erro ao responder: {e}", 0.0
-
-        scores = score_answer(ideal, answer)
-        results.append({
-            'question': question,
-            'ideal_answer': ideal,
-            'system_answer': answer,
-            'confidence': confidence,
-            'scores': scores,
-        })
 
-    elapsed = time.time() - start
-    summary = {
-        'avg_precisao': round(sum(r['scores']['precisao'] for r in results) / max(1, len(results)), 2),
-        'avg_uso_contexto': round(sum(r['scores']['uso_contexto'] for r in results) / max(1, len(results)), 2),
-        'avg_alucinacao': round(sum(r['scores']['alucinacao'] for r in results) / max(1, len(results)), 2),
-        'avg_completude': round(sum(r['scores']['completude'] for r in results) / max(1, len(results)), 2),
+def _label_matches(label: str, ids: Set[str]) -> bool:
+    return label in ids or any(i.endswith('/' + label) for i in ids)
+
+
+def retrieval_scores(docs: List[Dict], relevant: List[str], k: int) -> Dict[str, float]:
+    """recall@k (share of labels found in the top k) and MRR@k."""
+    found: Set[str] = set()
+    first_rank = 0
+    for rank, doc in enumerate(docs[:k], start=1):
+        ids = doc_identifiers(doc)
+        matched = {label for label in relevant if _label_matches(label, ids)}
+        if matched and not first_rank:
+            first_rank = rank
+        found |= matched
+    return {
+        f'recall@{k}': round(len(found) / len(relevant), 4) if relevant else 0.0,
+        f'mrr@{k}': round(1.0 / first_rank, 4) if first_rank else 0.0,
+        'found': sorted(found),
     }
 
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))], 1)
+
+
+def _run_case(rag, case: Dict, retrieval_only: bool, k: int, use_llm: bool,
+              overrides: Dict, memo: SearchMemo) -> Dict:
+    question = case.get('question', '')
+    # Stage wall times for this case only (the profiler is per context)
+    profiler = StageProfiler(sample_ms=0, trace_memory=False)
+    start = time.perf_counter()
+    # Wall-clock window: `rag optimize` joins the score to the run logged in it
+    result: Dict = {'question': question, 'started_at': time.time()}
+    with profiling(profiler):
+        if retrieval_only:
+            try:
+                docs, info = rag.retrieve(question, use_llm=use_llm,
+                                          strategy_overrides=overrides, search_memo=memo)
+            except Exception as e:
+                docs, info = [], {'error': str(e)}
+            relevant = [str(label) for label in case.get('relevant_docs') or []]
+            result.update({
+                'relevant_docs': relevant,
+                'retrieved': info.get('retrieved', 0),
+                'intent': info.get('intent'),
+                'scores': retrieval_scores(docs, relevant, k),
+            })
+            if 'error' in info:
+                result['error'] = info['error']
+        else:
+            ideal = case.get('ideal_answer', '')
+            try:
+                answer, confidence = rag.query(question, strategy_overrides=overrides, search_memo=memo)
+            except Exception as e:
+                answer, confidence = f"❌ Erro ao responder: {e}", 0.0
+            result.update({
+                'ideal_answer': ideal,
+                'system_answer': answer,
+                'confidence': confidence,
+                'scores': score_answer(ideal, answer),
+            })
+    latency = {path: round(rec['wall_ms'], 1) for path, rec in profiler.stages.items()}
+    latency['total_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    result['latency_ms'] = latency
+    result['finished_at'] = time.time()
+    return result
+
+
+def _summarize(results: List[Dict], retrieval_only: bool, k: int) -> Dict:
+    n = max(1, len(results))
+    if retrieval_only:
+        summary = {
+            f'avg_recall@{k}': round(sum(r['scores'][f'recall@{k}'] for r in results) / n, 4),
+            f'avg_mrr@{k}': round(sum(r['scores'][f'mrr@{k}'] for r in results) / n, 4),
+        }
+    else:
+        summary = {
+            'avg_precisao': round(sum(r['scores']['precisao'] for r in results) / n, 2),
+            'avg_uso_contexto': round(sum(r['scores']['uso_contexto'] for r in results) / n, 2),
+            'avg_alucinacao': round(sum(r['scores']['alucinacao'] for r in results) / n, 2),
+            'avg_completude': round(sum(r['scores']['completude'] for r in results) / n, 2),
+        }
+    totals = [r['latency_ms']['total_ms'] for r in results]
+    summary['p50_ms'] = _percentile(totals, 50)
+    summary['p95_ms'] = _percentile(totals, 95)
+    stages = sorted({stage for r in results for stage in r['latency_ms'] if stage != 'total_ms'})
+    summary['avg_stage_ms'] = {
+        stage: round(sum(r['latency_ms'].get(stage, 0.0) for r in results) / n, 1) for stage in stages
+    }
+    return summary
+
+
+def run_quality_suite(rag,
+                      suite_path: Path,
+                      out_dir: Path,
+                      concurrency: int = 4,
+                      retrieval_only: bool = False,
+                      k: int = 10,
+                      configs: Optional[List[Dict]] = None,
+                      use_llm: bool = True) -> Path:
+    """Run the suite once per configuration (``{"name", "strategy": {...}}``).
+
+    Cases run on ``concurrency`` threads; retrieval-only runs score the
+    cases that have ``relevant_docs``. The top-level ``results``/``summary``
+    are those of the first configuration, ``runs`` holds all of them.
+    """
+    suite = json.loads(Path(suite_path).read_text(encoding='utf-8'))
+    cases = suite.get('tests', [])
+    if retrieval_only:
+        cases = [c for c in cases if c.get('relevant_docs')]
+        if not cases:
+            raise ValueError(f"{suite_path} não tem casos com 'relevant_docs' para avaliação de retrieval")
+    configs = configs or [{'name': 'default'}]
+    # Once: each call counts the Chroma collection
+    stats = rag.get_stats()
+
+    # Overrides and memo go with each call: the shared pipeline is not mutated
+    memo = SearchMemo()
+    runs = []
+    start = time.time()
+    for config in configs:
+        overrides = dict(config.get('strategy') or {})
+        run_start = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            results = list(pool.map(
+                lambda case: _run_case(rag, case, retrieval_only, k, use_llm, overrides, memo), cases))
+        runs.append({
+            'config': config,
+            'elapsed_sec': round(time.time() - run_start, 2),
+            'results': results,
+            'summary': _summarize(results, retrieval_only, k),
+        })
+
     payload = {
         'timestamp': int(time.time()),
-        'elapsed_sec': round(elapsed, 2),
-        'model': rag.get_stats().get('claude_model'),
-        'reranker': rag.get_stats().get('reranker_model'),
-        'vector_store': rag.get_stats().get('vector_store'),
-        'results': results,
-        'summary': summary,
+        'elapsed_sec': round(time.time() - start, 2),
+        'mode': 'retrieval' if retrieval_only else 'full',
+        'concurrency': concurrency,
+        'k': k if retrieval_only else None,
+        'model': stats.get('claude_model'),
+        'reranker': stats.get('reranker_model'),
+        'vector_store': stats.get('vector_store'),
+        'search_memo': {'hits': memo.hits, 'misses': memo.misses},
+        'results': runs[0]['results'],
+        'summary': runs[0]['summary'],
+        'runs': runs,
     }
 
     out_dir.mkdir(parents=True, exist_ok=True)
     out_file = out_dir / f"run_{int(time.time())}.json"
     out_file.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding='utf-8')
     return out_file
-
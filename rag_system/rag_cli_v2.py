@@ -3,6 +3,7 @@
 RAG CLI v2 - Interface for Truly Advanced RAG System
 """
 
+import argparse
 import os
 import sys
 import json
@@ -67,8 +68,18 @@ def print_help():
   rag update                   - Atualiza o vector store com novos dados
   rag stats                    - Mostra estatísticas do sistema
   rag eval                     - Roda painel de qualidade (test suite)
+                                 (--concurrency N, --retrieval-only [--k N] [--no-llm],
+                                  --configs configs.json para comparar estratégias)
   rag distill                  - Gera cartas de conhecimento a partir do Memory
   rag logs                     - Mostra últimos registros de execução
+  rag optimize                 - Ajusta a estratégia por intent a partir dos logs
+  rag metrics                  - Latência p50/p95/p99 por intent e span, custo de LLM
+                                 (--prometheus, --serve [--port N] para /metrics)
+  rag bench                    - Benchmark offline (corpus sintético, LLM/MCP fakes):
+                                 ingestão, busca, rerank, e2e p50/p99 vs baseline
+                                 (--chunks N, --concurrency N, --save-baseline, -h)
+  rag profile "sua pergunta"   - Perfil por estágio (wall/CPU/alocações) + flame graph
+                                 (RAG_DISABLE_CACHE=1 para perfilar o pipeline completo)
   rag help                     - Mostra esta mensagem
 
 🔍 EXEMPLOS DE USO:
@@ -159,6 +170,47 @@ def main():
     sys.argv = filtered_argv
     command = sys.argv[1].lower() if len(sys.argv) > 1 else "help"
     
+    if command == "metrics":
+        # Metrics come from the per-process registry snapshots: no models to load
+        try:
+            from rag_system.tools.metrics_report import run as metrics_report
+        except Exception:
+            from tools.metrics_report import run as metrics_report
+        metrics_report(current_dir / "logs" / "metrics", sys.argv[2:])
+        return
+    
+    if command == "bench":
+        # Builds its own offline RAG (fake LLM/MCP): no API key needed
+        try:
+            from rag_system.tools.bench_rag import run as bench_run
+        except Exception:
+            from tools.bench_rag import run as bench_run
+        sys.exit(bench_run(sys.argv[2:]))
+    
+    if command == "optimize":
+        # Mines log files only: no models or API key, works with a corrupt table
+        try:
+            from rag_system.config.settings import settings
+            from rag_system.tools.optimize_strategy import optimize, print_summary
+            from rag_system.utils.strategy_table import default_table_path
+        except Exception:
+            from config.settings import settings
+            from tools.optimize_strategy import optimize, print_summary
+            from utils.strategy_table import default_table_path
+        project_name = project_name or os.environ.get("RAG_PROJECT", "scalp")
+        out_path = default_table_path(settings.CACHE_DIR / project_name)
+        print("\n🎯 Ajustando estratégia de retrieval a partir dos logs...")
+        table = optimize(
+            current_dir / "logs",
+            out_path,
+            eval_dir=current_dir.parent / "rag_eval_runs",
+            latency_weight=float(os.getenv('RAG_OPTIMIZE_LATENCY_WEIGHT', '0.01')),
+            min_runs=int(os.getenv('RAG_OPTIMIZE_MIN_RUNS', '3')),
+        )
+        print_summary(table, out_path)
+        print("💡 A tabela é carregada na próxima inicialização do RAG.")
+        return
+    
     # Initialize RAG system
     try:
         # Ensure permanent keys are picked up before initializing
@@ -202,6 +254,20 @@ def main():
         # Format and print answer
         format_answer(answer, confidence)
         
+    elif command == "profile":
+        if len(sys.argv) < 3:
+            print("❌ Uso: rag profile \"sua pergunta\"")
+            sys.exit(1)
+        
+        # Same query path as 'ask', with the stage profiler on for this run
+        rag.profile_enabled = True
+        answer, confidence = rag.query(" ".join(sys.argv[2:]))
+        format_answer(answer, confidence)
+        if rag.last_profile:
+            print(f"📄 Relatório: {rag.last_profile['report_path']}")
+            if rag.last_profile.get('folded_path'):
+                print(f"🔥 Flame graph: flamegraph.pl {rag.last_profile['folded_path']} > profile.svg")
+        
     elif command == "update":
         print("\n🔄 Atualizando vector store...")
         
@@ -233,16 +299,51 @@ def main():
         print(f"    • Vector Search: ✅ Ativo")
         print(f"    • Multi-Agent: ✅ Ativo")
         print()
+        metrics = rag.monitor.load_metrics()
+        if metrics.get("llm_calls"):
+            print("  LLM (histórico):")
+            print(f"    • Chamadas: {metrics['llm_calls']} ({metrics['llm_retries']} retries, {metrics['llm_errors']} erros)")
+            print(f"    • Tokens: {metrics['sum_llm_input_tokens']} in / {metrics['sum_llm_output_tokens']} out "
+                  f"({metrics['sum_llm_cached_tokens']} cached)")
+            print(f"    • Custo: ${metrics['sum_llm_cost_usd']:.4f} (média ${metrics.get('avg_llm_cost_usd', 0.0):.4f}/query)")
+            for stage, data in sorted(metrics.get("llm_by_stage", {}).items()):
+                print(f"    • {stage}: {data['calls']} chamadas, ${data['cost_usd']:.4f}, {data.get('avg_latency_ms', 0)} ms/chamada")
+            print()
     
     elif command == "eval":
         # Run quality panel with default suite
         suite_path = Path(suite_override) if suite_override else (current_dir / "eval" / "test_suite.json")
         out_dir = current_dir.parent / "rag_eval_runs"
+        parser = argparse.ArgumentParser(prog="rag eval")
+        parser.add_argument("--concurrency", type=int, default=int(os.environ.get("RAG_EVAL_CONCURRENCY", "4")))
+        parser.add_argument("--retrieval-only", action="store_true", help="recall@k/MRR sem geração")
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--no-llm", action="store_true", help="retrieval só com sinais locais")
+        parser.add_argument("--configs", type=Path, default=None,
+                            help='JSON: [{"name": "...", "strategy": {"top_k": 20, ...}}, ...]')
+        eval_args = parser.parse_args(sys.argv[2:])
         try:
-            out_file = run_quality_suite(rag, suite_path, out_dir)
+            configs = json.loads(eval_args.configs.read_text(encoding='utf-8')) if eval_args.configs else None
+            out_file = run_quality_suite(rag, suite_path, out_dir,
+                                         concurrency=eval_args.concurrency,
+                                         retrieval_only=eval_args.retrieval_only,
+                                         k=eval_args.k,
+                                         configs=configs,
+                                         use_llm=not eval_args.no_llm)
             print(f"\n✅ Avaliação concluída. Log salvo em: {out_file}")
             # Also print quick summary
             data = json.loads(out_file.read_text(encoding='utf-8'))
+            for run in data['runs']:
+                s = run['summary']
+                stages = ", ".join(f"{k} {v:.0f}ms" for k, v in s['avg_stage_ms'].items())
+                print(f"\n⏱️  [{run['config'].get('name', '?')}] {run['elapsed_sec']}s, "
+                      f"p50 {s['p50_ms']:.0f}ms, p95 {s['p95_ms']:.0f}ms" + (f" ({stages})" if stages else ""))
+                if data['mode'] == 'retrieval':
+                    k = data['k']
+                    print(f"  • Recall@{k}: {s['avg_recall@%d' % k]:.2%}   MRR@{k}: {s['avg_mrr@%d' % k]:.3f}")
+            print(f"  ♻️  Search memo: {data['search_memo']['hits']} hits / {data['search_memo']['misses']} misses")
+            if data['mode'] == 'retrieval':
+                return
             s = data['summary']
             print("\n📊 RESUMO (0–10):")
             print(f"  • Precisão:      {s['avg_precisao']}")
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Inference benchmark – PyTorch vs ONNX Runtime (int8) no nosso corpus.
+
+Amostra chunks da collection do projeto no ChromaDB e usa as perguntas das
+test suites como queries. Mede, para o embedder e o cross-encoder:
+
+- throughput (docs/s, pares/s) e latência por query (p50/p95);
+- concordância com o caminho PyTorch: cosseno entre embeddings, overlap@10
+  do retrieval, Spearman e overlap@10 do rerank;
+- ganho do batching por tamanho (utils/batching) sobre lotes na ordem de chegada.
+
+Uso:
+    python -m rag_system.tools.bench_inference --project scalp [--docs 512] [--fp32]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from rag_system.utils.batching import run_bucketed, token_lengths
+from rag_system.utils.onnx_backend import (
+    OnnxCrossEncoder,
+    OnnxEncoder,
+    default_threads,
+    load_cross_encoder,
+    load_embedder,
+)
+
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+EVAL_DIR = Path(__file__).resolve().parent.parent / "eval"
+
+
+def load_corpus(project: str, limit: int) -> List[str]:
+    import chromadb
+    from chromadb.config import Settings
+
+    client = chromadb.PersistentClient(
+        path=f"/home/scalp/rag_system/chroma_db/{project}",
+        settings=Settings(anonymized_telemetry=False),
+    )
+    collection = client.get_collection(f"{project}_knowledge")
+    docs = collection.get(limit=limit, include=["documents"]).get("documents") or []
+    return [d for d in docs if d]
+
+
+def load_queries() -> List[str]:
+    queries: List[str] = []
+    for suite in sorted(EVAL_DIR.glob("test_suite*.json")):
+        data = json.loads(suite.read_text(encoding="utf-8"))
+        queries.extend(t["question"] for t in data.get("tests", []) if t.get("question"))
+    return list(dict.fromkeys(queries))
+
+
+def _pct(values: List[float], q: float) -> float:
+    return round(float(np.percentile(values, q)), 2) if values else 0.0
+
+
+def _ranks(x: np.ndarray) -> np.ndarray:
+    ranks = np.empty(len(x))
+    ranks[np.argsort(x)] = np.arange(len(x))
+    return ranks
+
+
+def spearman(a: np.ndarray, b: np.ndarray) -> float:
+    if len(a) < 2:
+        return 1.0
+    return float(np.corrcoef(_ranks(a), _ranks(b))[0, 1])
+
+
+def overlap_at(a: np.ndarray, b: np.ndarray, k: int) -> float:
+    top_a = set(np.argsort(-a)[:k])
+    top_b = set(np.argsort(-b)[:k])
+    return len(top_a & top_b) / max(1, min(k, len(a)))
+
+
+def bench_embedder(torch_model, onnx_model, docs: List[str], queries: List[str], batch_size: int) -> Dict:
+    result: Dict[str, Dict] = {}
+    vectors = {}
+    for name, model in (("torch", torch_model), ("onnx", onnx_model)):
+        model.encode(docs[:batch_size], batch_size=batch_size)  # warm-up
+        t0 = time.perf_counter()
+        doc_vecs = np.asarray(model.encode(docs, batch_size=batch_size, convert_to_numpy=True))
+        elapsed = time.perf_counter() - t0
+        latencies, query_vecs = [], []
+        for q in queries:
+            t1 = time.perf_counter()
+            query_vecs.append(np.asarray(model.encode(q, convert_to_numpy=True)))
+            latencies.append((time.perf_counter() - t1) * 1000)
+        vectors[name] = (_normalize(doc_vecs), _normalize(np.stack(query_vecs)))
+        result[name] = {
+            "docs_per_sec": round(len(docs) / elapsed, 1),
+            "query_p50_ms": _pct(latencies, 50),
+            "query_p95_ms": _pct(latencies, 95),
+        }
+
+    (td, tq), (od, oq) = vectors["torch"], vectors["onnx"]
+    cosines = (td * od).sum(axis=1)
+    overlaps = [overlap_at(td @ tq[i], od @ oq[i], 10) for i in range(len(queries))]
+    result["agreement"] = {
+        "doc_cosine_mean": round(float(cosines.mean()), 4),
+        "doc_cosine_min": round(float(cosines.min()), 4),
+        "retrieval_overlap_at_10": round(float(np.mean(overlaps)), 3),
+    }
+    result["_candidates"] = [np.argsort(-(td @ tq[i]))[:30] for i in range(len(queries))]
+    return result
+
+
+def bench_reranker(torch_model, onnx_model, docs: List[str], queries: List[str],
+                   candidates: List[np.ndarray], batch_size: int) -> Dict:
+    result: Dict[str, Dict] = {}
+    scores = {}
+    for name, model in (("torch", torch_model), ("onnx", onnx_model)):
+        model.predict([[queries[0], docs[0][:1000]]], batch_size=batch_size)  # warm-up
+        latencies, per_query, pairs_total = [], [], 0
+        for q, cand in zip(queries, candidates):
+            pairs = [[q, docs[i][:1000]] for i in cand]
+            t0 = time.perf_counter()
+            per_query.append(np.asarray(model.predict(pairs, batch_size=batch_size), dtype=np.float64))
+            latencies.append((time.perf_counter() - t0) * 1000)
+            pairs_total += len(pairs)
+        scores[name] = per_query
+        result[name] = {
+            "pairs_per_sec": round(pairs_total / (sum(latencies) / 1000), 1),
+            "query_p50_ms": _pct(latencies, 50),
+            "query_p95_ms": _pct(latencies, 95),
+        }
+    rhos = [spearman(a, b) for a, b in zip(scores["torch"], scores["onnx"])]
+    overlaps = [overlap_at(a, b, 10) for a, b in zip(scores["torch"], scores["onnx"])]
+    result["agreement"] = {
+        "spearman_mean": round(float(np.mean(rhos)), 4),
+        "spearman_min": round(float(np.min(rhos)), 4),
+        "rerank_overlap_at_10": round(float(np.mean(overlaps)), 3),
+    }
+    return result
+
+
+def bench_batching(embedder, reranker, docs: List[str], queries: List[str],
+                   candidates: List[np.ndarray]) -> Dict:
+    """Arrival-order fixed batches (old path) vs length-bucketed batches."""
+
+    result: Dict[str, Dict] = {}
+    pairs = [[q, docs[i][:1000]] for q, cand in zip(queries, candidates) for i in cand]
+    jobs = {
+        # add_documents used to encode 100-chunk slices in insertion order
+        "embedder": (
+            docs,
+            lambda items: [embedder.encode(items[i:i + 100], convert_to_numpy=True)
+                           for i in range(0, len(items), 100)],
+            lambda batch: embedder.encode(batch, batch_size=len(batch), convert_to_numpy=True),
+            token_lengths(docs, getattr(embedder, "tokenizer", None),
+                          getattr(embedder, "max_seq_length", None) or getattr(embedder, "max_length", None)),
+        ),
+        "reranker": (
+            pairs,
+            lambda items: reranker.predict(items),
+            lambda batch: reranker.predict(batch, batch_size=len(batch)),
+            token_lengths(pairs, getattr(reranker, "tokenizer", None),
+                          getattr(reranker, "max_length", None) or 512),
+        ),
+    }
+    for stage, (items, naive_fn, batch_fn, lengths) in jobs.items():
+        t0 = time.perf_counter()
+        naive_fn(items)
+        naive_sec = time.perf_counter() - t0
+        _, stats = run_bucketed(items, batch_fn, lengths)
+        result[stage] = {
+            "items": len(items),
+            "naive_items_per_sec": round(len(items) / naive_sec, 1),
+            "bucketed_items_per_sec": round(len(items) / stats.elapsed_sec, 1),
+            "speedup": round(naive_sec / stats.elapsed_sec, 2),
+            "padding_efficiency": round(stats.padding_efficiency, 3),
+            "naive_padding_efficiency": round(stats.naive_efficiency, 3),
+        }
+    return result
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.clip(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12, None)
+
+
+def run(project: str, n_docs: int, batch_size: int, quantize: bool, threads: int) -> Dict:
+    docs = load_corpus(project, n_docs)
+    queries = load_queries()
+    if not docs or not queries:
+        raise RuntimeError("corpus ou queries vazios (rode 'rag update' antes)")
+    print(f"📊 {len(docs)} chunks, {len(queries)} queries, ONNX {'int8' if quantize else 'fp32'}, {threads} threads")
+
+    torch_embedder = load_embedder(EMBED_MODEL, backend="torch")
+    torch_reranker = load_cross_encoder(RERANK_MODEL, backend="torch")
+    embedder = bench_embedder(
+        torch_embedder,
+        OnnxEncoder(EMBED_MODEL, threads=threads, quantize=quantize),
+        docs, queries, batch_size,
+    )
+    candidates = embedder.pop("_candidates")
+    reranker = bench_reranker(
+        torch_reranker,
+        OnnxCrossEncoder(RERANK_MODEL, threads=threads, quantize=quantize),
+        docs, queries, candidates, batch_size,
+    )
+    batching = bench_batching(torch_embedder, torch_reranker, docs, queries, candidates)
+    return {
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "project": project,
+        "docs": len(docs),
+        "queries": len(queries),
+        "quantized": quantize,
+        "threads": threads,
+        "batch_size": batch_size,
+        "embedder": embedder,
+        "reranker": reranker,
+        "batching": batching,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PyTorch vs ONNX Runtime inference benchmark")
+    parser.add_argument("--project", default="scalp")
+    parser.add_argument("--docs", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--fp32", action="store_true", help="ONNX sem quantização int8")
+    parser.add_argument("--out", type=Path, default=None)
+    args = parser.parse_args()
+
+    report = run(args.project, args.docs, args.batch_size, not args.fp32, args.threads or default_threads())
+    for stage in ("embedder", "reranker"):
+        data = report[stage]
+        print(f"\n🔬 {stage}")
+        for backend in ("torch", "onnx"):
+            print(f"  • {backend:5s} " + "  ".join(f"{k}={v}" for k, v in data[backend].items()))
+        print("  • agreement " + "  ".join(f"{k}={v}" for k, v in data["agreement"].items()))
+    print("\n📦 batching (PyTorch, ordem de chegada vs buckets por tamanho)")
+    for stage, data in report["batching"].items():
+        print(f"  • {stage:8s} " + "  ".join(f"{k}={v}" for k, v in data.items()))
+
+    out = args.out or Path(__file__).resolve().parent.parent / "logs" / f"bench_inference_{int(time.time())}.json"
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"\n✅ Relatório salvo em {out}")
+
+
+if __name__ == "__main__":
+    main()
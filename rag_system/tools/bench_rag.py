@@ -0,0 +1,579 @@
+#!/usr/bin/env python3
+"""
+RAG benchmark – pipeline completo offline, reprodutível, sem Claude nem MCP.
+
+Monta um corpus sintético (determinístico por --seed, 1k–1M chunks) ou usa um
+corpus fixo (diretório de arquivos ou JSONL com "content"), troca o LLM e o
+MCP por fakes locais determinísticos e mede:
+
+- ingestão: chunks/s pelo VectorStore.add_documents real (chunking, dedup,
+  embeddings, Chroma);
+- busca vetorial: latência p50/p95/p99 de VectorStore.search;
+- rerank: pares/s e latência da cascata (cosseno → CE leve → CE completo);
+- ponta a ponta: p50/p99 e QPS de AdvancedRAGv2.query com N queries
+  concorrentes (cache desligado, a menos de --cache).
+
+O LLM fake responde no formato que cada etapa espera (conceitos, expansões,
+plano JSON, resposta) com latência fixa opcional (--llm-latency-ms), assim o
+tempo medido é o do nosso pipeline. --embedder hash troca o bi-encoder por um
+hashing embedder para testar a escala do índice (1M chunks) sem o custo do
+modelo; o rerank usa sempre os cross-encoders reais.
+
+O resultado vai para logs/bench/bench_<ts>.json e é comparado com o baseline
+(logs/bench/baseline.json ou --baseline): cada métrica que piorar mais que
+--tolerance é marcada como regressão e o comando sai com código 1.
+
+Uso:
+    rag bench                                  # 10k chunks sintéticos, concorrência 4
+    rag bench --chunks 1000000 --embedder hash --index-dir /data/bench_1m
+    rag bench --corpus docs/ --concurrency 8 --save-baseline
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+BENCH_DIR = Path(__file__).resolve().parent.parent / "logs" / "bench"
+EVAL_DIR = Path(__file__).resolve().parent.parent / "eval"
+FILE_SUFFIXES = {".md", ".txt", ".log", ".py", ".ts", ".tsx", ".yaml", ".yml"}
+
+# Metric path -> True when higher is better
+TRACKED_METRICS: Dict[str, bool] = {
+    "ingestion.chunks_per_sec": True,
+    "vector_search.p50_ms": False,
+    "vector_search.p99_ms": False,
+    "rerank.pairs_per_sec": True,
+    "rerank.p50_ms": False,
+    "e2e.p50_ms": False,
+    "e2e.p99_ms": False,
+    "e2e.qps": True,
+}
+# A baseline measured with a different setup is not comparable
+CONFIG_KEYS = ("corpus", "chunks", "embedder", "backend", "concurrency", "top_k", "llm_latency_ms", "mcp_latency_ms")
+
+TOPICS: Dict[str, List[str]] = {
+    "backtest": ["walk-forward", "backtest", "janela", "sharpe", "drawdown", "otimização", "out-of-sample",
+                 "overfitting", "fold", "métrica", "retorno", "benchmark"],
+    "execution": ["ordem", "latência", "exchange", "websocket", "fill", "slippage", "book", "spread",
+                  "market-maker", "taker", "reconexão", "rate-limit"],
+    "selector": ["selector21", "feature", "score", "ranking", "threshold", "sinal", "filtro", "regime",
+                 "volatilidade", "momentum", "janela", "peso"],
+    "risk": ["stop-loss", "posição", "alavancagem", "exposição", "limite", "kill-switch", "margem",
+             "liquidação", "hedge", "var", "capital", "alerta"],
+    "infra": ["deploy", "docker", "systemd", "log", "métricas", "prometheus", "cron", "backup",
+              "disco", "memória", "cpu", "config"],
+    "ml": ["modelo", "treino", "validação", "xgboost", "lstm", "dataset", "label", "feature-store",
+           "embedding", "inferência", "onnx", "calibração"],
+}
+FILLER = ["o", "a", "de", "para", "com", "no", "na", "quando", "depois", "antes", "sobre", "entre",
+          "usa", "ajusta", "verifica", "registra", "corrige", "mede", "compara", "atualiza"]
+QUERY_TEMPLATES = [
+    "como funciona {a} com {b}?",
+    "qual o status do {a} e {b}?",
+    "explique o {a} no contexto de {b} e {c}",
+    "onde está o código de {a} {b}?",
+    "por que o {a} afeta {b}?",
+    "quais mudanças recentes em {a} e {c}?",
+]
+
+
+# ============= Corpus & queries =============
+
+def synthetic_documents(n_chunks: int, seed: int) -> Iterator[Dict]:
+    """One ~700-char document (= one chunk) per item, unique and deterministic."""
+    rng = random.Random(seed)
+    topics = sorted(TOPICS)
+    for i in range(n_chunks):
+        topic = topics[i % len(topics)]
+        words = TOPICS[topic]
+        sentences = []
+        while sum(len(s) for s in sentences) < 650:
+            n = rng.randint(8, 14)
+            sentence = " ".join(rng.choice(words) if rng.random() < 0.45 else rng.choice(FILLER) for _ in range(n))
+            sentences.append(sentence.capitalize() + ".")
+        yield {
+            "content": f"[{topic} #{i}] " + " ".join(sentences),
+            "metadata": {"source": "bench", "topic": topic, "path": f"bench/{topic}/{i}.md"},
+        }
+
+
+def fixture_documents(path: Path) -> List[Dict]:
+    """Documents from a directory of text files or a JSONL with ``content``."""
+    docs: List[Dict] = []
+    if path.is_dir():
+        for file in sorted(path.rglob("*")):
+            if file.is_file() and file.suffix.lower() in FILE_SUFFIXES:
+                text = file.read_text(encoding="utf-8", errors="ignore")
+                if len(text.strip()) >= 50:
+                    docs.append({"content": text, "metadata": {"path": str(file), "source": "local_file"}})
+        return docs
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if line.strip():
+            record = json.loads(line)
+            if record.get("content"):
+                docs.append({"content": record["content"], "metadata": record.get("metadata") or {}})
+    return docs
+
+
+def synthetic_queries(n: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    queries: List[str] = []
+    for _ in range(50 * n):
+        if len(queries) >= n:
+            break
+        a, b, c = rng.sample(TOPICS[rng.choice(sorted(TOPICS))], 3)
+        query = rng.choice(QUERY_TEMPLATES).format(a=a, b=b, c=c)
+        if query not in queries:
+            queries.append(query)
+    return queries
+
+
+def suite_queries() -> List[str]:
+    queries: List[str] = []
+    for suite in sorted(EVAL_DIR.glob("test_suite*.json")):
+        data = json.loads(suite.read_text(encoding="utf-8"))
+        queries.extend(t["question"] for t in data.get("tests", []) if t.get("question"))
+    return list(dict.fromkeys(queries))
+
+
+def _take(items: List[str], n: int) -> List[str]:
+    """First ``n`` queries, cycling when there are fewer (repeats hit the
+    query-embedding LRU, so the runner generates enough distinct ones)."""
+    return [items[i % len(items)] for i in range(n)] if items else []
+
+
+def _batches(docs: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    batch: List[Dict] = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ============= Deterministic fakes =============
+
+class HashingEmbedder:
+    """Feature-hashing bi-encoder stand-in (``encode`` like SentenceTransformer)."""
+
+    tokenizer = None
+    max_seq_length = 256
+
+    def __init__(self, dim: int = 384) -> None:
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts, batch_size: Optional[int] = None, convert_to_numpy: bool = True,
+               show_progress_bar: bool = False, **_):
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        out = np.zeros((len(batch), self.dim), dtype=np.float32)
+        for row, text in enumerate(batch):
+            for token in re.findall(r"\w[\w-]*", text.lower()):
+                h = zlib.crc32(token.encode("utf-8"))
+                out[row, h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out[0] if single else out
+
+
+STOPWORDS = {"como", "funciona", "qual", "status", "explique", "onde", "está", "código", "quais",
+             "mudanças", "recentes", "contexto", "afeta", "para", "com", "sobre"}
+
+
+def _terms(text: str) -> List[str]:
+    return [t for t in re.findall(r"[\w-]+", text.lower()) if len(t) > 3 and t not in STOPWORDS]
+
+
+class FakeAnthropic:
+    """``client.messages.create`` answering each pipeline stage's prompt format."""
+
+    def __init__(self, latency_ms: float = 0.0) -> None:
+        self.latency = latency_ms / 1000.0
+        self.messages = self
+        self.calls = 0
+
+    def create(self, model: str, max_tokens: int, messages: List[Dict], **_):
+        prompt = messages[-1]["content"]
+        prompt = prompt if isinstance(prompt, str) else json.dumps(prompt)
+        if self.latency:
+            time.sleep(self.latency)
+        self.calls += 1
+        match = re.search(r'"([^"]+)"', prompt)
+        terms = list(dict.fromkeys(_terms(match.group(1) if match else prompt[:200])))
+        if "Return only JSON" in prompt:
+            half = max(1, len(terms) // 2)
+            groups = [terms[:half], terms[half:]] if len(terms) > 1 else [terms]
+            text = json.dumps({"sub_questions": [
+                {"question": " ".join(g) + "?", "concepts": g[:5], "expansions": [" ".join(reversed(g))]}
+                for g in groups if g
+            ]})
+        elif "Extract key technical concepts" in prompt:
+            text = "\n".join(terms[:5])
+        elif "Generate search variations" in prompt:
+            text = "\n".join(" ".join(terms[i:] + terms[:i]) for i in range(min(3, len(terms))))
+        else:
+            text = ("Resposta sintética (bench). " + " ".join(terms[:20]) + ". ") * 8
+        return SimpleNamespace(
+            model=model,
+            stop_reason="end_turn",
+            content=[SimpleNamespace(type="text", text=text)],
+            usage=SimpleNamespace(input_tokens=len(prompt) // 4, output_tokens=len(text) // 4),
+        )
+
+
+class FakeMCP:
+    """``search(query, limit)`` over a fixed in-memory set of memories."""
+
+    def __init__(self, n_memories: int = 500, seed: int = 7, latency_ms: float = 0.0) -> None:
+        self.latency = latency_ms / 1000.0
+        now = datetime.utcnow().isoformat() + "Z"
+        self.memories = [
+            {
+                "content": doc["content"],
+                "score": 1.0,
+                "metadata": {"entity": f"bench_{doc['metadata']['topic']}", "type": "note",
+                             "createdAt": now, "updatedAt": now},
+                "_terms": set(_terms(doc["content"])),
+            }
+            for doc in synthetic_documents(n_memories, seed)
+        ]
+
+    def search(self, query: str, limit: int = 50) -> List[Dict]:
+        if self.latency:
+            time.sleep(self.latency)
+        terms = set(_terms(query))
+        if terms:
+            scored = [(len(terms & m["_terms"]), i) for i, m in enumerate(self.memories)]
+            ranked = [self.memories[i] for s, i in sorted(scored, key=lambda x: (-x[0], x[1])) if s]
+        else:
+            ranked = self.memories
+        return [{k: v for k, v in m.items() if k != "_terms"} for m in ranked[:limit]]
+
+
+# ============= Measurements =============
+
+@contextlib.contextmanager
+def _quiet(enabled: bool = True):
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def _latency_summary(values_ms: List[float]) -> Dict:
+    if not values_ms:
+        return {"n": 0}
+    arr = np.asarray(values_ms)
+    return {
+        "n": len(values_ms),
+        "mean_ms": round(float(arr.mean()), 2),
+        "p50_ms": round(float(np.percentile(arr, 50)), 2),
+        "p95_ms": round(float(np.percentile(arr, 95)), 2),
+        "p99_ms": round(float(np.percentile(arr, 99)), 2),
+    }
+
+
+def bench_ingestion(store, docs: Iterable[Dict], batch_docs: int) -> Dict:
+    added = n_docs = 0
+    start = time.perf_counter()
+    for batch in _batches(docs, batch_docs):
+        n_docs += len(batch)
+        added += store.add_documents(batch, batch_size=1000)
+    elapsed = time.perf_counter() - start
+    return {
+        "documents": n_docs,
+        "chunks": added,
+        "seconds": round(elapsed, 2),
+        "chunks_per_sec": round(added / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def bench_search(store, queries: List[str], top_k: int) -> Dict:
+    latencies: List[float] = []
+    for query in queries:
+        start = time.perf_counter()
+        store.search(query, n_results=top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return _latency_summary(latencies)
+
+
+def bench_rerank(rag, queries: List[str], pool: int, top_k: int) -> Dict:
+    latencies: List[float] = []
+    pairs = docs = 0
+    total = 0.0
+    for query in queries:
+        candidates = rag.vector_store.search(query, n_results=pool)
+        stats: Dict = {}
+        start = time.perf_counter()
+        rag.rerank_documents(query, candidates, top_k=top_k, candidates=pool, stats=stats)
+        elapsed = time.perf_counter() - start
+        total += elapsed
+        latencies.append(elapsed * 1000)
+        pairs += stats.get("light_ce_pairs", 0) + stats.get("full_ce_pairs", 0)
+        docs += len(candidates)
+    summary = _latency_summary(latencies)
+    summary.update({
+        "docs_per_sec": round(docs / total, 1) if total else 0.0,
+        "pairs_per_sec": round(pairs / total, 1) if total else 0.0,
+        "pairs_per_query": round(pairs / len(queries), 1) if queries else 0.0,
+    })
+    return summary
+
+
+def bench_e2e(rag, queries: List[str], concurrency: int) -> Dict:
+    def timed(query: str) -> Tuple[float, bool]:
+        start = time.perf_counter()
+        try:
+            rag.query(query)
+            ok = True
+        except Exception:
+            ok = False
+        return (time.perf_counter() - start) * 1000, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, queries))
+    wall = time.perf_counter() - start
+    summary = _latency_summary([ms for ms, ok in results if ok])
+    summary.update({
+        "concurrency": concurrency,
+        "errors": sum(1 for _, ok in results if not ok),
+        "qps": round(len(results) / wall, 2) if wall else 0.0,
+        "wall_sec": round(wall, 2),
+    })
+    return summary
+
+
+# ============= Baseline comparison =============
+
+def _metric(report: Dict, path: str) -> Optional[float]:
+    node = report
+    for key in path.split("."):
+        if not isinstance(node, dict) or key not in node:
+            return None
+        node = node[key]
+    return float(node) if isinstance(node, (int, float)) else None
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> Dict:
+    """Relative change per tracked metric; worse than ``tolerance`` = regression."""
+    mismatched = [k for k in CONFIG_KEYS if report["config"].get(k) != baseline.get("config", {}).get(k)]
+    rows = []
+    for path, higher_is_better in TRACKED_METRICS.items():
+        current, base = _metric(report, path), _metric(baseline, path)
+        if current is None or not base:
+            continue
+        change = (current - base) / base
+        worse = -change if higher_is_better else change
+        rows.append({
+            "metric": path,
+            "baseline": base,
+            "current": current,
+            "change": round(change, 4),
+            "regression": worse > tolerance,
+        })
+    return {
+        "baseline_timestamp": baseline.get("timestamp"),
+        "tolerance": tolerance,
+        "config_mismatch": mismatched,
+        "metrics": rows,
+        "regressions": [r["metric"] for r in rows if r["regression"]],
+    }
+
+
+def print_report(report: Dict) -> None:
+    cfg = report["config"]
+    print(f"\n🏁 Bench: {cfg['chunks']} chunks ({cfg['corpus']}), embedder={cfg['embedder']}, "
+          f"backend={cfg['backend']}, concorrência={cfg['concurrency']}")
+    ing = report.get("ingestion")
+    if ing:
+        print(f"  • ingestão       {ing['chunks']} chunks em {ing['seconds']}s → {ing['chunks_per_sec']} chunks/s")
+    else:
+        print("  • ingestão       (índice reutilizado)")
+    for name, label in (("vector_search", "busca vetorial"), ("rerank", "rerank"), ("e2e", "ponta a ponta")):
+        data = report.get(name) or {}
+        if not data.get("n"):
+            continue
+        extra = ""
+        if name == "rerank":
+            extra = f"  {data['pairs_per_sec']} pares/s"
+        elif name == "e2e":
+            extra = f"  {data['qps']} qps, {data['errors']} erros"
+        print(f"  • {label:<14} p50={data['p50_ms']}ms p95={data['p95_ms']}ms p99={data['p99_ms']}ms{extra}")
+
+    comparison = report.get("comparison")
+    if not comparison:
+        return
+    print(f"\n📐 Comparação com baseline ({comparison['baseline_timestamp']}, tolerância {comparison['tolerance']:.0%}):")
+    if comparison["config_mismatch"]:
+        print(f"  ⚠️  Config diferente do baseline: {', '.join(comparison['config_mismatch'])}")
+    for row in comparison["metrics"]:
+        flag = "❌" if row["regression"] else "✅"
+        print(f"  {flag} {row['metric']:<26} {row['baseline']:>10.2f} → {row['current']:>10.2f} ({row['change']:+.1%})")
+
+
+# ============= Runner =============
+
+def run(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="rag bench", description="Benchmark offline do pipeline RAG")
+    parser.add_argument("--chunks", type=int, default=10000, help="tamanho do corpus sintético")
+    parser.add_argument("--corpus", type=Path, default=None, help="diretório ou JSONL fixo em vez do sintético")
+    parser.add_argument("--embedder", choices=("model", "hash"), default="model")
+    parser.add_argument("--index-dir", type=Path, default=None,
+                        help="índice persistente (reutilizado se já populado) em vez de um diretório temporário")
+    parser.add_argument("--ingest-batch", type=int, default=2000, help="documentos por add_documents")
+    parser.add_argument("--search-queries", type=int, default=200)
+    parser.add_argument("--rerank-queries", type=int, default=50)
+    parser.add_argument("--rerank-pool", type=int, default=80)
+    parser.add_argument("--e2e-queries", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--mcp-latency-ms", type=float, default=0.0)
+    parser.add_argument("--cache", action="store_true", help="mantém o cache de respostas ligado no e2e")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", type=Path, default=None)
+    parser.add_argument("--baseline", type=Path, default=BENCH_DIR / "baseline.json")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="piora relativa tolerada (0.10 = 10%%)")
+    parser.add_argument("--verbose", action="store_true", help="mostra a saída do pipeline")
+    args = parser.parse_args(argv)
+
+    # Nothing leaves the benchmark: no auto-save to MCP, cache only on request
+    os.environ["RAG_AUTO_SAVE"] = "0"
+    if not args.cache:
+        os.environ["RAG_DISABLE_CACHE"] = "1"
+
+    from rag_system.core.advanced_rag_v2 import AdvancedRAGv2
+    from rag_system.core.vector_store import VectorStore
+    from rag_system.utils.onnx_backend import inference_backend, load_embedder
+
+    work_dir = args.index_dir or Path(tempfile.mkdtemp(prefix="rag_bench_"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    quiet = not args.verbose
+
+    n_queries = max(args.search_queries, args.rerank_queries, args.e2e_queries) + args.warmup
+    queries = synthetic_queries(n_queries, args.seed)
+    if args.corpus:
+        documents: Iterable[Dict] = fixture_documents(args.corpus)
+        project_root = args.corpus if args.corpus.is_dir() else work_dir / "project"
+        # Test-suite questions first, synthetic ones keep queries distinct
+        queries = list(dict.fromkeys(suite_queries() + queries))[:n_queries]
+        corpus_label = str(args.corpus)
+    else:
+        documents = synthetic_documents(args.chunks, args.seed)
+        project_root = work_dir / "project"
+        corpus_label = f"synthetic(seed={args.seed})"
+    project_root.mkdir(parents=True, exist_ok=True)
+
+    print(f"🏗️  Preparando bench em {work_dir}...")
+    try:
+        with _quiet(quiet):
+            embedder = HashingEmbedder() if args.embedder == "hash" else load_embedder(EMBED_MODEL)
+            store = VectorStore(persist_dir=str(work_dir / "chroma"), collection_name="bench_knowledge",
+                                embedder=embedder)
+        ingestion = None
+        if store.collection.count() == 0:
+            print("📥 Ingestão...")
+            with _quiet(quiet):
+                ingestion = bench_ingestion(store, documents, args.ingest_batch)
+        chunks = store.collection.count()
+
+        with _quiet(quiet):
+            rag = AdvancedRAGv2(
+                project_name="bench",
+                project_root=str(project_root),
+                default_top_k=args.top_k,
+                vector_store=store,
+                mcp_client=FakeMCP(seed=args.seed + 1, latency_ms=args.mcp_latency_ms),
+                llm_client=FakeAnthropic(latency_ms=args.llm_latency_ms),
+                logs_dir=work_dir / "logs",
+            )
+
+        warm, measured = queries[:args.warmup], queries[args.warmup:] or queries
+        print("🔎 Busca vetorial...")
+        with _quiet(quiet):
+            bench_search(store, warm, args.top_k)
+            search = bench_search(store, _take(measured, args.search_queries), args.top_k)
+        print("📊 Rerank...")
+        with _quiet(quiet):
+            bench_rerank(rag, warm[:2], args.rerank_pool, args.top_k)
+            rerank = bench_rerank(rag, _take(measured, args.rerank_queries), args.rerank_pool, args.top_k)
+        print(f"🚀 Ponta a ponta ({args.concurrency} concorrentes)...")
+        with _quiet(quiet):
+            bench_e2e(rag, warm, args.concurrency)
+            e2e = bench_e2e(rag, _take(measured, args.e2e_queries), args.concurrency)
+            rag.tracer.flush()
+    finally:
+        if args.index_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "config": {
+            "corpus": corpus_label,
+            "chunks": chunks,
+            "embedder": args.embedder,
+            "backend": inference_backend(),
+            "concurrency": args.concurrency,
+            "top_k": args.top_k,
+            "rerank_pool": args.rerank_pool,
+            "llm_latency_ms": args.llm_latency_ms,
+            "mcp_latency_ms": args.mcp_latency_ms,
+            "cache": args.cache,
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+        },
+        "ingestion": ingestion,
+        "vector_search": search,
+        "rerank": rerank,
+        "e2e": e2e,
+    }
+    if args.baseline.exists() and not args.save_baseline:
+        report["comparison"] = compare(report, json.loads(args.baseline.read_text(encoding="utf-8")),
+                                       args.tolerance)
+    print_report(report)
+
+    out = args.out or BENCH_DIR / f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n✅ Relatório salvo em {out}")
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"📌 Baseline atualizado: {args.baseline}")
+
+    regressions = (report.get("comparison") or {}).get("regressions") or []
+    if regressions:
+        print(f"❌ Regressões: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Metrics report – resumo das métricas do RAG a partir dos snapshots do registry.
+
+Cada processo grava seu registry em logs/metrics/registry_<pid>_<nonce>.json;
+aqui os snapshots são combinados (histogramas são somáveis), sem reler
+rag_runs.jsonl nem os traces. Snapshots de processos encerrados são compactados no arquivo
+de histórico antes do resumo.
+
+Uso:
+    rag metrics                      # latência por intent/span, custo de LLM
+    rag metrics --prometheus         # texto no formato Prometheus
+    rag metrics --serve [--port N]   # endpoint /metrics (default 9464)
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from rag_system.utils.metrics import MetricsRegistry, SnapshotStore, start_http_server
+
+DEFAULT_DIR = Path(__file__).resolve().parent.parent / "logs" / "metrics"
+
+
+def _fmt(hist, scale: float = 1.0, unit: str = "ms") -> str:
+    return (f"n={hist.count:<6} p50={hist.quantile(0.5) * scale:8.1f}{unit} "
+            f"p95={hist.quantile(0.95) * scale:8.1f}{unit} p99={hist.quantile(0.99) * scale:8.1f}{unit}")
+
+
+def print_report(registry: MetricsRegistry) -> None:
+    runs = registry.counter("rag_runs_total")
+    if not runs and not registry.histogram("rag_query_duration_ms").count:
+        print("ℹ️  Nenhuma métrica registrada ainda.")
+        return
+    hits = registry.counter("rag_runs_total", cache="hit")
+    print(f"\n📊 Queries: {int(runs)} ({int(hits)} cache hits, {hits / runs:.0%})" if runs else "\n📊 Queries: 0")
+
+    print("\n⏱️  Latência por intent (cache miss):")
+    for intent, hist in sorted(registry.histogram_by("rag_run_elapsed_seconds", "intent").items()):
+        miss = registry.histogram("rag_run_elapsed_seconds", intent=intent, cache="miss")
+        if miss.count:
+            print(f"  • {intent:<10} {_fmt(miss, 1.0, 's')}")
+
+    spans = registry.histogram_by("rag_span_duration_ms", "span")
+    if spans:
+        print("\n🧩 Spans:")
+        for name, hist in sorted(spans.items(), key=lambda item: -item[1].quantile(0.95)):
+            print(f"  • {name:<28} {_fmt(hist)}")
+
+    calls = registry.counter_by("rag_llm_calls_total", "stage")
+    if calls:
+        cost = registry.counter_by("rag_llm_cost_usd_total", "stage")
+        latency = registry.histogram_by("rag_llm_call_latency_ms", "stage")
+        total_cost = sum(cost.values())
+        print(f"\n💰 LLM: {int(sum(calls.values()))} chamadas, ${total_cost:.4f}"
+              + (f" (${total_cost / (runs - hits):.4f}/query sem cache)" if runs - hits else ""))
+        for stage in sorted(calls):
+            print(f"  • {stage:<18} {int(calls[stage]):>5} chamadas  ${cost.get(stage, 0.0):.4f}  "
+                  f"{_fmt(latency[stage]) if stage in latency else ''}")
+
+
+def run(metrics_dir: Path = DEFAULT_DIR, argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="rag metrics", description="Resumo das métricas do RAG")
+    parser.add_argument("--prometheus", action="store_true", help="imprime no formato Prometheus")
+    parser.add_argument("--serve", action="store_true", help="serve /metrics via HTTP")
+    parser.add_argument("--port", type=int, default=9464)
+    parser.add_argument("--host", default="127.0.0.1")
+    args = parser.parse_args(argv)
+
+    store = SnapshotStore(metrics_dir)
+    store.compact()
+    if args.serve:
+        # Each scrape re-merges the snapshots of running processes + archive
+        server = start_http_server(args.port, host=args.host,
+                                   render=lambda: store.load_merged().to_prometheus())
+        print(f"📡 /metrics em http://{args.host}:{args.port}/metrics (Ctrl+C para sair)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    registry = store.load_merged()
+    if args.prometheus:
+        print(registry.to_prometheus(), end="")
+    else:
+        print_report(registry)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Strategy optimizer – ajusta a tabela de estratégia por intent a partir dos logs.
+
+Lê rag_runs.jsonl (intent, latência, estratégia base da intent), os traces
+(duração do retrieval) e as avaliações do painel de qualidade
+(rag_eval_runs/*.json), e escolhe para cada intent a configuração com melhor
+relação qualidade × latência:
+
+    utility = quality - latency_weight * p50_latency_sec
+
+Qualidade = nota do painel para o run que a produziu (mesma pergunta, dentro
+da janela de tempo do caso). Runs sem nota não entram: a confiança do pipeline
+cresce com top_k e não mede qualidade. Runs com overrides do painel também
+ficam de fora. Agentes que quase nunca chegam aos documentos finais são
+desligados. O resultado é um JSON carregado pelo pipeline no startup
+(StrategyTable).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from rag_system.utils.log_sink import rotated_files
+from rag_system.utils.strategy_table import TUNABLE_FIELDS
+
+# Agent switches the optimizer may turn off, and the agent name they control
+AGENT_FLAGS = {
+    "use_memory": "memory",
+    "use_keywords": "keyword",
+    "use_graph": "graph",
+    "use_code": "code",
+}
+# Max distance between a run's log timestamp and its trace end (seconds)
+TRACE_MATCH_WINDOW_SEC = 10.0
+# Slack around a panel case's time window when matching its run (seconds)
+EVAL_MATCH_SLACK_SEC = 1.0
+
+
+def _read_jsonl(path: Path) -> Iterable[Dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            for line in fh:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        return
+
+
+def _epoch(ts: Optional[str]) -> Optional[float]:
+    if not ts:
+        return None
+    try:
+        return datetime.fromisoformat(ts.rstrip("Z")).replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None
+
+
+def load_runs(log_file: Path) -> List[Dict]:
+    """Pipeline runs (cache hits excluded: they say nothing about strategy)."""
+
+    return [r for path in rotated_files(log_file) for r in _read_jsonl(path) if not r.get("cache_hit")]
+
+
+def load_traces(traces_dir: Path) -> Dict[str, List[Dict]]:
+    """Full-pipeline rag_query traces grouped by (truncated) query text."""
+
+    by_query: Dict[str, List[Dict]] = {}
+    for trace_file in sorted(Path(traces_dir).glob("traces_*.jsonl")):
+        for trace in _read_jsonl(trace_file):
+            if trace.get("operation") != "rag_query":
+                continue
+            if (trace.get("result") or {}).get("from_cache"):
+                continue
+            by_query.setdefault(trace.get("query", ""), []).append(trace)
+    return by_query
+
+
+def load_eval_scores(eval_dir: Path) -> Dict[str, List[Tuple[float, float, float]]]:
+    """Question -> [(started, finished, quality in [0, 1])] from quality-panel cases.
+
+    Each score belongs only to the run the case produced; configurations
+    with strategy overrides and cases without timing (older panel files)
+    are skipped.
+    """
+
+    scores: Dict[str, List[Tuple[float, float, float]]] = {}
+    for run_file in sorted(Path(eval_dir).glob("run_*.json")):
+        try:
+            data = json.loads(run_file.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            continue
+        for config_run in data.get("runs", []):
+            if (config_run.get("config") or {}).get("strategy"):
+                continue
+            for item in config_run.get("results", []):
+                sc = item.get("scores") or {}
+                values = [sc.get(k) for k in ("precisao", "uso_contexto", "alucinacao", "completude")]
+                window = (item.get("started_at"), item.get("finished_at"))
+                if (item.get("question") and all(isinstance(v, (int, float)) for v in values)
+                        and all(isinstance(t, (int, float)) for t in window)):
+                    quality = sum(values) / (10.0 * len(values))
+                    scores.setdefault(item["question"], []).append((window[0], window[1], quality))
+    return scores
+
+
+def _match_score(run: Dict, eval_scores: Dict[str, List[Tuple[float, float, float]]]) -> Optional[float]:
+    run_ts = _epoch(run.get("ts"))
+    if run_ts is None:
+        return None
+    for started, finished, quality in eval_scores.get(run.get("query", ""), []):
+        if started - EVAL_MATCH_SLACK_SEC <= run_ts <= finished + EVAL_MATCH_SLACK_SEC:
+            return quality
+    return None
+
+
+def _match_trace(run: Dict, traces: Dict[str, List[Dict]]) -> Optional[Dict]:
+    run_ts = _epoch(run.get("ts"))
+    candidates = traces.get(run.get("query", "")[:200], [])
+    if run_ts is None or not candidates:
+        return None
+    best = min(candidates, key=lambda t: abs(t.get("end_time", 0) - run_ts))
+    if abs(best.get("end_time", 0) - run_ts) > TRACE_MATCH_WINDOW_SEC:
+        return None
+    return best
+
+
+def _span(trace: Optional[Dict], name: str) -> Optional[Dict]:
+    for span in (trace or {}).get("spans", []):
+        if span.get("name") == name:
+            return span
+    return None
+
+
+def collect_observations(runs: List[Dict],
+                         traces: Dict[str, List[Dict]],
+                         eval_scores: Dict[str, List[Tuple[float, float, float]]]) -> List[Dict]:
+    """Join scored runs with traces into (intent, base strategy, quality, latency) rows.
+
+    Only runs that log their base strategy (older logs have the adjusted
+    one), were not forced by panel overrides and have a panel score count.
+    """
+
+    observations = []
+    for run in runs:
+        strategy = run.get("base_strategy")
+        if not strategy or run.get("strategy_overrides"):
+            continue
+        quality = _match_score(run, eval_scores)
+        if quality is None:
+            continue
+        retrieval = _span(_match_trace(run, traces), "multi_agent_retrieval")
+        observations.append({
+            "intent": run.get("intent", "general"),
+            "strategy": {name: strategy.get(name) for name in TUNABLE_FIELDS},
+            "quality": quality,
+            "latency_sec": float(run.get("elapsed_sec", 0.0)),
+            "retrieval_ms": (retrieval or {}).get("duration_ms"),
+            "agent_contrib": run.get("agent_contrib") or {},
+        })
+    return observations
+
+
+def _summarize(rows: List[Dict], latency_weight: float) -> Dict[str, Any]:
+    quality = statistics.fmean(r["quality"] for r in rows)
+    latency = statistics.median(r["latency_sec"] for r in rows)
+    retrieval = [r["retrieval_ms"] for r in rows if r["retrieval_ms"] is not None]
+    return {
+        "runs": len(rows),
+        "quality": round(quality, 3),
+        "latency_p50_sec": round(latency, 2),
+        "retrieval_p50_ms": round(statistics.median(retrieval), 1) if retrieval else None,
+        "utility": round(quality - latency_weight * latency, 4),
+    }
+
+
+def fit_strategy_table(observations: List[Dict],
+                       latency_weight: float = 0.01,
+                       min_runs: int = 3,
+                       min_agent_share: float = 0.02) -> Dict[str, Dict[str, Any]]:
+    """Pick the best observed configuration per intent.
+
+    Configurations are grouped by their tunable fields (planning aside);
+    groups with fewer than ``min_runs`` runs are not trusted. Planning is
+    fixed on/off only when both variants have enough runs, otherwise the
+    pipeline keeps its heuristic.
+    """
+
+    by_intent: Dict[str, List[Dict]] = {}
+    for obs in observations:
+        by_intent.setdefault(obs["intent"], []).append(obs)
+
+    table: Dict[str, Dict[str, Any]] = {}
+    for intent, rows in sorted(by_intent.items()):
+        groups: Dict[str, List[Dict]] = {}
+        for row in rows:
+            config = {k: v for k, v in row["strategy"].items() if k != "use_planning"}
+            groups.setdefault(json.dumps(config, sort_keys=True), []).append(row)
+        scored = [
+            (_summarize(group, latency_weight), signature)
+            for signature, group in groups.items()
+            if len(group) >= min_runs
+        ]
+        if not scored:
+            continue
+        scored.sort(key=lambda item: item[0]["utility"], reverse=True)
+        stats, signature = scored[0]
+        entry: Dict[str, Any] = {k: v for k, v in json.loads(signature).items() if v is not None}
+
+        # Drop agents that almost never reach the final documents
+        pruned = []
+        total_final = sum(sum(r["agent_contrib"].values()) for r in rows)
+        for flag, agent in AGENT_FLAGS.items():
+            enabled = [r for r in rows if r["strategy"].get(flag)]
+            if not entry.get(flag) or len(enabled) < min_runs or not total_final:
+                continue
+            share = sum(r["agent_contrib"].get(agent, 0) for r in enabled) / total_final
+            if share < min_agent_share:
+                entry[flag] = False
+                pruned.append(agent)
+
+        # Planning: only decide when both variants were observed enough
+        planned = [r for r in rows if r["strategy"].get("use_planning")]
+        unplanned = [r for r in rows if not r["strategy"].get("use_planning")]
+        if len(planned) >= min_runs and len(unplanned) >= min_runs:
+            entry["use_planning"] = (
+                _summarize(planned, latency_weight)["utility"]
+                > _summarize(unplanned, latency_weight)["utility"]
+            )
+
+        stats.update({
+            "observed_runs": len(rows),
+            "configs_considered": len(scored),
+            "pruned_agents": pruned,
+        })
+        entry["stats"] = stats
+        table[intent] = entry
+    return table
+
+
+def write_table(table: Dict[str, Dict[str, Any]], out_path: Path, params: Dict[str, Any]) -> None:
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        "version": 1,
+        "generated_at": datetime.utcnow().isoformat() + "Z",
+        "params": params,
+        "intents": table,
+    }
+    tmp = out_path.with_suffix(out_path.suffix + ".tmp")
+    tmp.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, out_path)
+
+
+def optimize(logs_dir: Path,
+             out_path: Path,
+             traces_dir: Optional[Path] = None,
+             eval_dir: Optional[Path] = None,
+             latency_weight: float = 0.01,
+             min_runs: int = 3,
+             min_agent_share: float = 0.02) -> Dict[str, Dict[str, Any]]:
+    """Mine logs, fit the table and write it to ``out_path``."""
+
+    logs_dir = Path(logs_dir)
+    runs = load_runs(logs_dir / "rag_runs.jsonl")
+    traces = load_traces(traces_dir or logs_dir / "traces")
+    eval_scores = load_eval_scores(eval_dir) if eval_dir else {}
+    observations = collect_observations(runs, traces, eval_scores)
+    table = fit_strategy_table(observations, latency_weight, min_runs, min_agent_share)
+    write_table(table, out_path, {
+        "latency_weight": latency_weight,
+        "min_runs": min_runs,
+        "min_agent_share": min_agent_share,
+        "observations": len(observations),
+    })
+    return table
+
+
+def print_summary(table: Dict[str, Dict[str, Any]], out_path: Path) -> None:
+    if not table:
+        print("ℹ️  Dados insuficientes: nenhuma intent com runs avaliados suficientes por configuração "
+              "(rode 'rag eval' para gerar notas).")
+    for intent, entry in table.items():
+        s = entry["stats"]
+        print(f"  🎯 {intent}: top_k={entry.get('top_k')} quality={s['quality']} "
+              f"p50={s['latency_p50_sec']}s runs={s['runs']} pruned={s['pruned_agents'] or '-'}")
+    print(f"✅ Tabela de estratégia salva em {out_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--logs-dir", type=Path, default=Path(__file__).resolve().parent.parent / "logs")
+    parser.add_argument("--traces-dir", type=Path, default=None)
+    parser.add_argument("--eval-dir", type=Path, default=None)
+    parser.add_argument("--out", type=Path, required=True)
+    parser.add_argument("--latency-weight", type=float, default=0.01)
+    parser.add_argument("--min-runs", type=int, default=3)
+    parser.add_argument("--min-agent-share", type=float, default=0.02)
+    args = parser.parse_args()
+
+    table = optimize(args.logs_dir, args.out, args.traces_dir, args.eval_dir,
+                     args.latency_weight, args.min_runs, args.min_agent_share)
+    print_summary(table, args.out)
+
+if __name__ == "__main__":
+    main()
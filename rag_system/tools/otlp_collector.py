@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+OTLP collector local – recebe traces/métricas OTLP/HTTP (JSON) do RAG.
+
+Substituto mínimo de um OpenTelemetry Collector para testes: aceita
+POST /v1/traces e /v1/metrics, grava cada request em JSONL e imprime a
+árvore de spans de cada trace com as durações (um "flame graph" em texto).
+Para análise de verdade, aponte RAG_OTLP_ENDPOINT para um Collector/Jaeger.
+
+Uso:
+    python -m rag_system.tools.otlp_collector --port 4318 [--out logs/otlp]
+    RAG_OTLP_ENDPOINT=http://localhost:4318 rag "pergunta"
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List
+
+
+def _attr(span: Dict, key: str):
+    for kv in span.get("attributes", []):
+        if kv.get("key") == key:
+            value = kv.get("value", {})
+            return next(iter(value.values()), None)
+    return None
+
+
+def span_tree(spans: List[Dict]) -> List[str]:
+    """Indented lines ``name  duration`` per trace, children under parents."""
+
+    by_trace: Dict[str, List[Dict]] = {}
+    for span in spans:
+        by_trace.setdefault(span.get("traceId", ""), []).append(span)
+
+    lines: List[str] = []
+    for trace_id, items in by_trace.items():
+        children: Dict[str, List[Dict]] = {}
+        ids = {s.get("spanId") for s in items}
+        roots = []
+        for span in items:
+            parent = span.get("parentSpanId")
+            if parent and parent in ids:
+                children.setdefault(parent, []).append(span)
+            else:
+                roots.append(span)
+
+        def walk(span: Dict, depth: int) -> None:
+            ms = (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+            extra = ""
+            tokens = _attr(span, "gen_ai.usage.input_tokens")
+            if tokens is not None:
+                extra = f"  tokens={tokens}/{_attr(span, 'gen_ai.usage.output_tokens')}"
+            hit = _attr(span, "rag.cache.hit")
+            if hit is not None:
+                extra += f"  cache_hit={hit}"
+            flag = "" if span.get("status", {}).get("code") != 2 else "  ❌"
+            lines.append(f"{'  ' * depth}{span['name']:<{40 - 2 * depth}} {ms:9.1f} ms{extra}{flag}")
+            for child in sorted(children.get(span.get("spanId"), []), key=lambda s: int(s["startTimeUnixNano"])):
+                walk(child, depth + 1)
+
+        lines.append(f"trace {trace_id}")
+        for root in roots:
+            walk(root, 1)
+    return lines
+
+
+class Collector:
+    def __init__(self, out_dir: Path, quiet: bool = False) -> None:
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.quiet = quiet
+        self.counts = {"traces": 0, "metrics": 0}
+        self._lock = threading.Lock()
+
+    def receive(self, signal: str, body: Dict) -> None:
+        with self._lock:
+            self.counts[signal] += 1
+            with open(self.out_dir / f"otlp_{signal}.jsonl", "a", encoding="utf-8") as fh:
+                fh.write(json.dumps(body) + "\n")
+        if self.quiet:
+            return
+        if signal == "traces":
+            spans = [
+                span
+                for rs in body.get("resourceSpans", [])
+                for ss in rs.get("scopeSpans", [])
+                for span in ss.get("spans", [])
+            ]
+            print("\n".join(span_tree(spans)))
+        else:
+            names = [
+                m.get("name")
+                for rm in body.get("resourceMetrics", [])
+                for sm in rm.get("scopeMetrics", [])
+                for m in sm.get("metrics", [])
+            ]
+            print(f"📈 metrics: {', '.join(names)}")
+
+
+def make_handler(collector: Collector):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):  # noqa: N802 (http.server API)
+            signal = self.path.rstrip("/").rsplit("/", 1)[-1]
+            if signal not in ("traces", "metrics"):
+                self.send_response(404)
+                self.end_headers()
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError:
+                self.send_response(400)
+                self.end_headers()
+                return
+            collector.receive(signal, body)
+            payload = b"{}"
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):  # silence per-request logging
+            return
+
+    return Handler
+
+
+def serve(port: int, out_dir: Path, quiet: bool = False) -> ThreadingHTTPServer:
+    collector = Collector(out_dir, quiet=quiet)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(collector))
+    server.collector = collector  # type: ignore[attr-defined]
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OTLP/HTTP JSON collector for RAG traces")
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument("--out", type=Path, default=Path(__file__).resolve().parent.parent / "logs" / "otlp")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.out, args.quiet)
+    print(f"📡 OTLP collector em http://127.0.0.1:{args.port} (gravando em {args.out})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -115,7 +115,51 @@ class ASTChunker:
         
         return chunks
     
-    def _chunk_class(self, class_node: ast.ClassDef, lines: List[str], 
+    def extract_symbols(self, code: str) -> List[Dict]:
+        """Classes, functions/methods (nested too) and module-level names.
+
+        Each entry has ``name``, ``full_name`` (``Outer/inner``), an LSP
+        ``kind`` and 1-based ``line_start``/``line_end`` (decorators included).
+        """
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            return []
+
+        symbols: List[Dict] = []
+
+        def visit(body: List[ast.stmt], parents: List[str], in_class: bool) -> None:
+            for node in body:
+                if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+                    if isinstance(node, ast.ClassDef):
+                        kind = 5  # Class
+                    else:
+                        kind = 6 if in_class else 12  # Method / Function
+                    start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+                    symbols.append({
+                        'name': node.name,
+                        'full_name': '/'.join(parents + [node.name]),
+                        'kind': kind,
+                        'line_start': start,
+                        'line_end': node.end_lineno or node.lineno,
+                    })
+                    visit(node.body, parents + [node.name], isinstance(node, ast.ClassDef))
+                elif not parents and isinstance(node, (ast.Assign, ast.AnnAssign)):
+                    targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                    for target in targets:
+                        if isinstance(target, ast.Name):
+                            symbols.append({
+                                'name': target.id,
+                                'full_name': target.id,
+                                'kind': 14 if target.id.isupper() else 13,  # Constant / Variable
+                                'line_start': node.lineno,
+                                'line_end': node.end_lineno or node.lineno,
+                            })
+
+        visit(tree.body, [], False)
+        return symbols
+
+    def _chunk_class(self, class_node: ast.ClassDef, lines: List[str],
                      metadata: Optional[Dict]) -> List[Dict]:
         """Split large class into chunks by methods"""
         chunks = []
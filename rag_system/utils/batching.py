@@ -0,0 +1,126 @@
+"""Length-bucketed batching for transformer inputs.
+
+A transformer batch is padded to its longest member, so batching inputs in
+arrival order (50-char and 1000-char chunks side by side) spends most of the
+compute on padding. :func:`run_bucketed` sorts inputs by token length, packs
+neighbours into batches under a padded-token budget (short inputs get large
+batches, long ones small), runs each batch and returns outputs in the
+original order, along with stats comparing against fixed-size batches in
+arrival order.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("RAG_BATCH_TOKEN_BUDGET", "8192"))
+DEFAULT_MAX_BATCH = int(os.getenv("RAG_BATCH_MAX_SIZE", "64"))
+# Batch size sentence-transformers uses when none is given (the old path)
+NAIVE_BATCH_SIZE = 32
+
+
+@dataclass
+class BatchStats:
+    items: int = 0
+    batches: int = 0
+    tokens: int = 0
+    padded_tokens: int = 0
+    naive_padded_tokens: int = 0
+    elapsed_sec: float = 0.0
+
+    @property
+    def padding_efficiency(self) -> float:
+        return self.tokens / self.padded_tokens if self.padded_tokens else 1.0
+
+    @property
+    def naive_efficiency(self) -> float:
+        return self.tokens / self.naive_padded_tokens if self.naive_padded_tokens else 1.0
+
+    @property
+    def estimated_speedup(self) -> float:
+        """Padded-token ratio vs arrival-order batches (compute is ~linear in it)."""
+        return self.naive_padded_tokens / self.padded_tokens if self.padded_tokens else 1.0
+
+    def summary(self) -> str:
+        rate = self.items / self.elapsed_sec if self.elapsed_sec else 0.0
+        return (f"{self.items} itens em {self.batches} lotes, {rate:.0f} itens/s, "
+                f"padding útil {self.padding_efficiency:.0%} (antes {self.naive_efficiency:.0%}, "
+                f"~{self.estimated_speedup:.1f}x menos tokens)")
+
+
+def token_lengths(texts: Sequence[Any], tokenizer=None, max_length: Optional[int] = None) -> List[int]:
+    """Token count per input (str or (a, b) pair), capped at ``max_length``.
+
+    Uses the model's (fast) tokenizer when given; otherwise ~4 chars/token.
+    """
+
+    if tokenizer is not None:
+        try:
+            if texts and not isinstance(texts[0], str):
+                enc = tokenizer([a for a, _ in texts], [b for _, b in texts],
+                                truncation=True, max_length=max_length)
+            else:
+                enc = tokenizer(list(texts), truncation=True, max_length=max_length)
+            return [len(ids) for ids in enc["input_ids"]]
+        except Exception:
+            pass
+    lengths = []
+    for t in texts:
+        chars = len(t) if isinstance(t, str) else len(t[0]) + len(t[1])
+        n = chars // 4 + 2
+        lengths.append(min(n, max_length) if max_length else n)
+    return lengths
+
+
+def plan_batches(lengths: Sequence[int],
+                 token_budget: int = DEFAULT_TOKEN_BUDGET,
+                 max_batch: int = DEFAULT_MAX_BATCH) -> List[List[int]]:
+    """Group indices sorted by length so ``len(batch) * longest <= token_budget``."""
+
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches: List[List[int]] = []
+    current: List[int] = []
+    for i in order:
+        # Sorted ascending, so the newcomer is the batch's longest member
+        if current and ((len(current) + 1) * lengths[i] > token_budget or len(current) >= max_batch):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _padded(lengths: Sequence[int], batches: Sequence[Sequence[int]]) -> int:
+    return sum(len(b) * max(lengths[i] for i in b) for b in batches if b)
+
+
+def run_bucketed(items: Sequence[Any],
+                 fn: Callable[[List[Any]], Sequence[Any]],
+                 lengths: Optional[Sequence[int]] = None,
+                 token_budget: int = DEFAULT_TOKEN_BUDGET,
+                 max_batch: int = DEFAULT_MAX_BATCH) -> Tuple[List[Any], BatchStats]:
+    """Run ``fn`` over length-sorted batches; outputs come back in input order."""
+
+    stats = BatchStats(items=len(items))
+    if not items:
+        return [], stats
+    if lengths is None:
+        lengths = token_lengths(items)
+    batches = plan_batches(lengths, token_budget, max_batch)
+    naive = [list(range(i, min(i + NAIVE_BATCH_SIZE, len(items)))) for i in range(0, len(items), NAIVE_BATCH_SIZE)]
+    stats.batches = len(batches)
+    stats.tokens = sum(lengths)
+    stats.padded_tokens = _padded(lengths, batches)
+    stats.naive_padded_tokens = _padded(lengths, naive)
+
+    outputs: List[Any] = [None] * len(items)
+    t0 = time.perf_counter()
+    for batch in batches:
+        for i, out in zip(batch, fn([items[i] for i in batch])):
+            outputs[i] = out
+    stats.elapsed_sec = time.perf_counter() - t0
+    return outputs, stats
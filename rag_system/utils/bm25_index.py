@@ -0,0 +1,391 @@
+"""Persistent BM25 inverted index for keyword retrieval.
+
+Indexes project files (split into line windows) plus ingested chunks
+(e.g. MCP memories). The index is pickled next to the query cache and
+refreshed incrementally by file mtime, so a query is a handful of dict
+lookups instead of a filesystem scan.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import heapq
+import math
+import os
+import pickle
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+
+# Directories that never hold searchable text (vector stores, VCS, envs, caches)
+IGNORED_DIRS = {
+    ".git", ".hg", ".svn", "chroma_db", "venv", ".venv", "env", "node_modules",
+    "__pycache__", ".mypy_cache", ".pytest_cache", ".ruff_cache", ".tox", ".nox",
+    ".rag_cache", ".serena", ".cache", "dist", "build", ".idea", ".vscode",
+}
+
+TEXT_EXTENSIONS = {
+    ".py", ".md", ".txt", ".ts", ".tsx", ".js", ".jsx", ".json", ".yaml", ".yml",
+    ".toml", ".ini", ".cfg", ".sh", ".sql", ".rst", ".log",
+}
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_COMBINING_RE = re.compile(r"[\u0300-\u036f]")
+_HEADING_RE = re.compile(
+    r"^\s*(#{1,6}\s|def\s|async\s+def\s|class\s|function\s|export\s|interface\s|type\s)"
+)
+
+
+def fold(text: str) -> str:
+    """Lowercase and strip accents ("Função" → "funcao")."""
+
+    if text.isascii():
+        return text.lower()
+    return _COMBINING_RE.sub("", unicodedata.normalize("NFKD", text.lower()))
+
+
+def tokenize(text: str, min_len: int = 2) -> List[str]:
+    """Unicode-aware word tokens, accent-folded."""
+
+    return [t for t in _TOKEN_RE.findall(fold(text)) if len(t) >= min_len]
+
+
+def parse_query(query: str) -> Tuple[List[str], List[str]]:
+    """Split a query into free terms and "quoted phrases" (both folded)."""
+
+    phrases = [fold(p).strip() for p in re.findall(r'"([^"]+)"', query)]
+    phrases = [p for p in phrases if p]
+    terms = tokenize(query)
+    return terms, phrases
+
+
+@dataclass
+class Chunk:
+    chunk_id: int
+    doc_key: str  # file path (relative) or "<namespace>::<id>"
+    path: str
+    start_line: int
+    end_line: int
+    text: str
+    length: float
+    terms: Set[str] = field(default_factory=set)
+    metadata: Dict = field(default_factory=dict)
+
+
+class BM25Index:
+    """In-memory BM25F-style inverted index persisted with pickle."""
+
+    VERSION = 2  # 2: content-hash fallback ids for ingested chunks
+
+    def __init__(
+        self,
+        project_root: Path,
+        index_path: Path,
+        *,
+        window_lines: int = 40,
+        max_file_bytes: int = 1_000_000,
+        field_boosts: Optional[Dict[str, float]] = None,
+        k1: float = 1.2,
+        b: float = 0.75,
+        refresh_interval: float = 300.0,
+    ) -> None:
+        self.project_root = Path(project_root)
+        self.index_path = Path(index_path)
+        self.window_lines = window_lines
+        self.max_file_bytes = max_file_bytes
+        self.field_boosts = {"path": 2.0, "heading": 1.5, "body": 1.0}
+        self.field_boosts.update(field_boosts or {})
+        self.k1 = k1
+        self.b = b
+        self.refresh_interval = refresh_interval
+
+        self.postings: Dict[str, Dict[int, float]] = {}
+        self.chunks: Dict[int, Chunk] = {}
+        self.doc_chunks: Dict[str, List[int]] = {}
+        self.file_mtimes: Dict[str, float] = {}
+        self._next_id = 0
+        self._total_length = 0.0
+
+        self._lock = threading.RLock()
+        self._refreshing = threading.Lock()
+        self._saving = threading.Lock()
+        self._last_refresh = 0.0
+        self._dirty = False
+        self._load()
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def ensure_fresh(self) -> None:
+        """Build synchronously on first use, then refresh in the background."""
+
+        if time.time() - self._last_refresh < self.refresh_interval:
+            return
+        if not self.chunks:
+            self.refresh()
+            return
+        if self._refreshing.locked():
+            return
+        threading.Thread(target=self.refresh, name="bm25-refresh", daemon=True).start()
+
+    def refresh(self) -> int:
+        """Re-index files whose mtime changed; drop deleted ones. Returns files updated."""
+
+        if not self._refreshing.acquire(blocking=False):
+            return 0
+        try:
+            seen: Set[str] = set()
+            updated = 0
+            for path, rel, mtime in self._iter_files():
+                seen.add(rel)
+                if self.file_mtimes.get(rel) == mtime:
+                    continue
+                try:
+                    text = path.read_text(encoding="utf-8", errors="ignore")
+                except Exception:
+                    continue
+                with self._lock:
+                    self._remove_doc(rel)
+                    self._add_file(rel, text)
+                    self.file_mtimes[rel] = mtime
+                updated += 1
+
+            with self._lock:
+                for rel in [r for r in self.file_mtimes if r not in seen]:
+                    self._remove_doc(rel)
+                    del self.file_mtimes[rel]
+                    updated += 1
+                if updated:
+                    self._dirty = True
+            self._last_refresh = time.time()
+            self.save()
+            return updated
+        finally:
+            self._refreshing.release()
+
+    def index_documents(self, documents: Iterable[Dict], namespace: str) -> int:
+        """Index ingested chunks (``{'content', 'metadata', 'id'?}``) under a namespace."""
+
+        count = 0
+        with self._lock:
+            for doc in documents:
+                content = doc.get("content") or ""
+                if not content.strip():
+                    continue
+                meta = doc.get("metadata") or {}
+                # Content hash, not batch position: re-ingesting a reordered
+                # batch must replace the same keys instead of leaving stale ones
+                doc_id = doc.get("id") or meta.get("id") or hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+                key = f"{namespace}::{doc_id}"
+                self._remove_doc(key)
+                heading = meta.get("entity") or meta.get("headline") or ""
+                self._add_chunk(key, meta.get("path") or key, 1, content.count("\n") + 1,
+                                content, heading=str(heading), metadata=meta)
+                count += 1
+            if count:
+                self._dirty = True
+        self.save()
+        return count
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[float, Chunk]]:
+        """Rank chunks by BM25; quoted phrases must appear verbatim (folded)."""
+
+        terms, phrases = parse_query(query)
+        for phrase in phrases:
+            terms.extend(t for t in tokenize(phrase) if t not in terms)
+        if not terms:
+            return []
+
+        with self._lock:
+            n_chunks = len(self.chunks)
+            if not n_chunks:
+                return []
+            avg_len = self._total_length / n_chunks or 1.0
+            scores: Dict[int, float] = {}
+            for term in set(terms):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+                for chunk_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.chunks[chunk_id].length / avg_len)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+            if phrases:
+                ranked = (
+                    (score, self.chunks[cid])
+                    for cid, score in sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+                )
+                results = []
+                for score, chunk in ranked:
+                    folded = fold(chunk.text)
+                    if all(p in folded for p in phrases):
+                        results.append((score, chunk))
+                        if len(results) >= limit:
+                            break
+                return results
+
+            best = heapq.nlargest(limit, scores.items(), key=lambda kv: kv[1])
+            return [(score, self.chunks[cid]) for cid, score in best]
+
+    def save(self) -> None:
+        """Atomically persist the index if it changed."""
+
+        # One writer at a time, so an older snapshot never lands after a newer one
+        with self._saving:
+            with self._lock:
+                if not self._dirty:
+                    return
+                # Consistent snapshot: copies of the containers that are
+                # mutated in place (Chunk objects never are), so searches
+                # only wait for the copy, not for the pickling below
+                state = {
+                    "version": self.VERSION,
+                    "window_lines": self.window_lines,
+                    "postings": {term: dict(ids) for term, ids in self.postings.items()},
+                    "chunks": dict(self.chunks),
+                    "doc_chunks": {key: list(ids) for key, ids in self.doc_chunks.items()},
+                    "file_mtimes": dict(self.file_mtimes),
+                    "next_id": self._next_id,
+                    "total_length": self._total_length,
+                }
+                self._dirty = False
+            try:
+                data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+                self.index_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.index_path.with_suffix(f".tmp{os.getpid()}")
+                with tmp.open("wb") as fh:
+                    fh.write(data)
+                os.replace(tmp, self.index_path)
+            except Exception as exc:
+                with self._lock:
+                    self._dirty = True  # not persisted; retry on the next save
+                print(f"⚠️  Failed to save keyword index: {exc}")
+
+    # ------------------------------------------------------------------
+    # Internal helpers
+    # ------------------------------------------------------------------
+    def _load(self) -> None:
+        if not self.index_path.exists():
+            return
+        try:
+            with self.index_path.open("rb") as fh:
+                state = pickle.load(fh)
+        except Exception:
+            return
+        if state.get("version") != self.VERSION or state.get("window_lines") != self.window_lines:
+            return
+        self.postings = state["postings"]
+        self.chunks = state["chunks"]
+        self.doc_chunks = state["doc_chunks"]
+        self.file_mtimes = state["file_mtimes"]
+        self._next_id = state["next_id"]
+        self._total_length = state["total_length"]
+
+    def _iter_files(self) -> Iterable[Tuple[Path, str, float]]:
+        for dirpath, dirnames, filenames in os.walk(self.project_root):
+            dirnames[:] = [d for d in dirnames if d not in IGNORED_DIRS and not d.startswith(".")]
+            for name in filenames:
+                if Path(name).suffix.lower() not in TEXT_EXTENSIONS:
+                    continue
+                path = Path(dirpath) / name
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                if st.st_size > self.max_file_bytes:
+                    continue
+                yield path, str(path.relative_to(self.project_root)), st.st_mtime
+
+    def _add_file(self, rel: str, text: str) -> None:
+        lines = text.splitlines()
+        step = self.window_lines
+        for start in range(0, max(1, len(lines)), step):
+            window = lines[start:start + step]
+            body = "\n".join(window)
+            if not body.strip():
+                continue
+            heading = " ".join(ln.strip() for ln in window if _HEADING_RE.match(ln))
+            self._add_chunk(rel, rel, start + 1, start + len(window), body, heading=heading)
+
+    def _add_chunk(
+        self,
+        doc_key: str,
+        path: str,
+        start_line: int,
+        end_line: int,
+        text: str,
+        *,
+        heading: str = "",
+        metadata: Optional[Dict] = None,
+    ) -> None:
+        body_tokens = tokenize(text)
+        weighted: Counter = Counter()
+        for token in body_tokens:
+            weighted[token] += self.field_boosts["body"]
+        for token in tokenize(heading):
+            weighted[token] += self.field_boosts["heading"]
+        for token in tokenize(path):
+            weighted[token] += self.field_boosts["path"]
+        if not weighted:
+            return
+
+        chunk_id = self._next_id
+        self._next_id += 1
+        length = float(len(body_tokens) or 1)
+        chunk = Chunk(
+            chunk_id=chunk_id,
+            doc_key=doc_key,
+            path=path,
+            start_line=start_line,
+            end_line=end_line,
+            text=text,
+            length=length,
+            terms=set(weighted),
+            metadata=dict(metadata or {}),
+        )
+        self.chunks[chunk_id] = chunk
+        self.doc_chunks.setdefault(doc_key, []).append(chunk_id)
+        self._total_length += length
+        for term, tf in weighted.items():
+            self.postings.setdefault(term, {})[chunk_id] = tf
+
+    def _remove_doc(self, doc_key: str) -> None:
+        for chunk_id in self.doc_chunks.pop(doc_key, []):
+            chunk = self.chunks.pop(chunk_id, None)
+            if chunk is None:
+                continue
+            self._total_length -= chunk.length
+            for term in chunk.terms:
+                postings = self.postings.get(term)
+                if postings is None:
+                    continue
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self.postings[term]
+
+
+def rank_snippet(chunk: Chunk, terms: Sequence[str], context: int = 6) -> Tuple[int, int, str]:
+    """Trim a chunk to the line window with the most query-term hits."""
+
+    lines = chunk.text.splitlines()
+    if len(lines) <= 2 * context + 1:
+        return chunk.start_line, chunk.end_line, chunk.text
+    wanted = set(terms)
+    # fold() keeps line breaks, so folded lines align with the originals
+    hits = [sum(1 for t in wanted if t in ln) for ln in fold(chunk.text).splitlines()]
+    hits += [0] * (len(lines) - len(hits))
+    best = max(range(len(lines)), key=lambda i: sum(hits[max(0, i - context): i + context + 1]))
+    lo = max(0, best - context)
+    hi = min(len(lines), best + context + 1)
+    return chunk.start_line + lo, chunk.start_line + hi - 1, "\n".join(lines[lo:hi])
@@ -1,16 +1,51 @@
-"""Simple on-disk cache for Advanced RAG queries."""
+"""Caching and request coalescing for the Advanced RAG pipeline.
+
+- :class:`QueryCache`: answers in one SQLite file (WAL mode, indexed
+  expiry/LRU columns), safe to share between processes; expired entries
+  can still be served as stale within a grace period;
+- :class:`TieredQueryCache`: an in-process LRU in front of it;
+- :class:`SingleFlight`: one computation per key, concurrent callers wait
+  (``do_async`` refreshes stale entries in the background);
+- :class:`SearchMemo`: per-request memo of backend lookups;
+- :class:`CorpusVersions`: per-partition corpus counters that invalidate
+  cached answers built from changed partitions.
+"""
 
 from __future__ import annotations
 
 import hashlib
 import json
+import sqlite3
+import threading
 import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+@dataclass
+class CacheEntry:
+    """Cached payload plus its expiry; ``stale`` marks entries served past TTL."""
+
+    payload: Dict[str, Any]
+    expires_at: Optional[float]
+    stale: bool = False
 
 
 class QueryCache:
-    """Small JSON-based cache for RAG query responses."""
+    """SQLite-backed cache for RAG query responses.
+
+    A single ``query_cache.sqlite3`` file (WAL mode) lives in ``cache_dir``:
+    expiry and LRU order are indexed columns, writes are transactional and
+    several processes can share the same directory safely. An entry counter
+    kept by triggers makes the capacity check O(1) per write.
+    """
+
+    DB_NAME = "query_cache.sqlite3"
+    # Reads refresh the LRU timestamp at most once per this many seconds,
+    # so hot keys don't turn every get() into a write.
+    TOUCH_RESOLUTION_SEC = 1.0
 
     def __init__(
         self,
@@ -22,6 +57,9 @@ class QueryCache:
         self.cache_dir.mkdir(parents=True, exist_ok=True)
         self.default_ttl = max(0, int(ttl_seconds))
         self.max_entries = max(0, int(max_entries))
+        self.db_path = self.cache_dir / self.DB_NAME
+        self._local = threading.local()
+        self._init_db()
 
     # ------------------------------------------------------------------
     # Public helpers
@@ -35,51 +73,439 @@ class QueryCache:
     def get(self, key: str) -> Optional[Dict[str, Any]]:
         """Retrieve cached payload if not expired."""
 
-        path = self._entry_path(key)
-        if not path.exists():
+        entry = self.get_entry(key)
+        return entry.payload if entry else None
+
+    def get_entry(self, key: str, stale_grace: float = 0.0) -> Optional[CacheEntry]:
+        """Retrieve an entry; expired ones are still returned (``stale=True``)
+        while within ``stale_grace`` seconds past their TTL."""
+
+        now = time.time()
+        try:
+            row = self._conn().execute(
+                "SELECT payload, expires_at FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+
+        payload_raw, expires_at = row
+        stale = expires_at is not None and expires_at <= now
+        if stale and expires_at + stale_grace <= now:
+            self.delete(key)
             return None
 
         try:
-            raw = json.loads(path.read_text(encoding="utf-8"))
+            payload = json.loads(payload_raw)
         except Exception:
-            path.unlink(missing_ok=True)
+            self.delete(key)
             return None
 
-        ts = raw.get("ts", 0)
-        ttl = raw.get("ttl", self.default_ttl)
-        if ttl and (time.time() - ts) > ttl:
-            path.unlink(missing_ok=True)
-            return None
+        self._touch(key, now)
+        return CacheEntry(payload=payload, expires_at=expires_at, stale=stale)
 
-        return raw.get("payload")
+    def set(self, key: str, payload: Dict[str, Any], ttl: Optional[int] = None) -> Optional[float]:
+        """Persist payload under key with timestamp and evict old entries.
 
-    def set(self, key: str, payload: Dict[str, Any], ttl: Optional[int] = None) -> None:
-        """Persist payload under key with timestamp and prune old entries."""
+        Returns the absolute expiry timestamp (None = never expires).
+        """
 
+        now = time.time()
+        ttl = ttl if ttl is not None else self.default_ttl
+        expires_at = now + ttl if ttl else None
         if not self.max_entries:
-            return
+            return expires_at
+
+        data = json.dumps(payload, ensure_ascii=False)
 
-        record = {
-            "ts": time.time(),
-            "ttl": ttl if ttl is not None else self.default_ttl,
-            "payload": payload,
-        }
+        try:
+            with self._write() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO entries (key, payload, created_at, expires_at, last_access)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        payload = excluded.payload,
+                        created_at = excluded.created_at,
+                        expires_at = excluded.expires_at,
+                        last_access = excluded.last_access
+                    """,
+                    (key, data, now, expires_at, now),
+                )
+                self._evict(conn, now)
+        except sqlite3.Error as exc:
+            print(f"⚠️  Cache write failed: {exc}")
+        return expires_at
+
+    def delete(self, key: str) -> None:
+        """Drop a single entry (no-op if absent)."""
 
-        path = self._entry_path(key)
-        path.write_text(json.dumps(record, ensure_ascii=False), encoding="utf-8")
-        self._prune()
+        try:
+            with self._write() as conn:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        except sqlite3.Error:
+            pass
+
+    def clear(self) -> None:
+        """Remove every entry."""
+
+        with self._write() as conn:
+            conn.execute("DELETE FROM entries")
+
+    def __len__(self) -> int:
+        row = self._conn().execute("SELECT entries FROM stats WHERE id = 1").fetchone()
+        return int(row[0]) if row else 0
 
     # ------------------------------------------------------------------
     # Internal helpers
     # ------------------------------------------------------------------
-    def _entry_path(self, key: str) -> Path:
-        return self.cache_dir / f"{key}.json"
-
-    def _prune(self) -> None:
-        files = sorted(
-            self.cache_dir.glob("*.json"),
-            key=lambda p: p.stat().st_mtime,
-            reverse=True,
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; SQLite handles cross-process locking.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.db_path)
+        return conn
+
+    def _write(self) -> "_WriteTxn":
+        return _WriteTxn(self._conn())
+
+    def _init_db(self) -> None:
+        self._conn().executescript(
+            """
+            BEGIN IMMEDIATE;
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_expires ON entries(expires_at);
+            CREATE INDEX IF NOT EXISTS idx_entries_lru ON entries(last_access);
+
+            CREATE TABLE IF NOT EXISTS stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                entries INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO stats (id, entries)
+                VALUES (1, (SELECT COUNT(*) FROM entries));
+
+            CREATE TRIGGER IF NOT EXISTS trg_entries_ins AFTER INSERT ON entries
+            BEGIN UPDATE stats SET entries = entries + 1 WHERE id = 1; END;
+            CREATE TRIGGER IF NOT EXISTS trg_entries_del AFTER DELETE ON entries
+            BEGIN UPDATE stats SET entries = entries - 1 WHERE id = 1; END;
+            COMMIT;
+            """
+        )
+
+    def _touch(self, key: str, now: float) -> None:
+        try:
+            with self._write() as conn:
+                conn.execute(
+                    "UPDATE entries SET last_access = ? WHERE key = ? AND last_access < ?",
+                    (now, key, now - self.TOUCH_RESOLUTION_SEC),
+                )
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        count = conn.execute("SELECT entries FROM stats WHERE id = 1").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow <= 0:
+            return
+        # Expired entries go first (indexed range scan), then least recently used.
+        conn.execute(
+            """
+            DELETE FROM entries WHERE key IN (
+                SELECT key FROM entries
+                WHERE expires_at IS NOT NULL AND expires_at <= ?
+                ORDER BY expires_at LIMIT ?
+            )
+            """,
+            (now, overflow),
+        )
+        overflow = conn.execute("SELECT entries FROM stats WHERE id = 1").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                """
+                DELETE FROM entries WHERE key IN (
+                    SELECT key FROM entries ORDER BY last_access LIMIT ?
+                )
+                """,
+                (overflow,),
+            )
+
+
+def _connect(db_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        str(db_path),
+        timeout=10.0,
+        isolation_level=None,
+        check_same_thread=False,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=10000")
+    return conn
+
+
+class _WriteTxn:
+    """``BEGIN IMMEDIATE`` transaction: takes the write lock up front so
+    concurrent writers queue on busy_timeout instead of failing mid-way."""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+
+
+class TieredQueryCache:
+    """In-process LRU in front of a shared :class:`QueryCache`.
+
+    Hot keys are served from memory without touching SQLite; misses fall
+    through to disk and are promoted. ``inflight`` coalesces concurrent
+    computations of the same key (see :class:`SingleFlight`).
+    """
+
+    def __init__(self, disk: QueryCache, memory_entries: int = 128) -> None:
+        self.disk = disk
+        self.memory_entries = max(0, int(memory_entries))
+        self._memory: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.inflight = SingleFlight()
+
+    @property
+    def default_ttl(self) -> int:
+        return self.disk.default_ttl
+
+    @property
+    def max_entries(self) -> int:
+        return self.disk.max_entries
+
+    def make_key(self, **parts: Any) -> str:
+        return self.disk.make_key(**parts)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.get_entry(key)
+        return entry.payload if entry else None
+
+    def get_entry(self, key: str, stale_grace: float = 0.0) -> Optional[CacheEntry]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expired = entry.expires_at is not None and entry.expires_at <= now
+                if not expired or entry.expires_at + stale_grace > now:
+                    self._memory.move_to_end(key)
+                    return CacheEntry(entry.payload, entry.expires_at, stale=expired)
+                del self._memory[key]
+
+        entry = self.disk.get_entry(key, stale_grace=stale_grace)
+        if entry is not None:
+            self._remember(key, CacheEntry(entry.payload, entry.expires_at))
+        return entry
+
+    def set(self, key: str, payload: Dict[str, Any], ttl: Optional[int] = None) -> Optional[float]:
+        expires_at = self.disk.set(key, payload, ttl=ttl)
+        self._remember(key, CacheEntry(payload, expires_at))
+        return expires_at
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._memory.pop(key, None)
+        self.disk.delete(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        self.disk.clear()
+
+    def _remember(self, key: str, entry: CacheEntry) -> None:
+        if not self.memory_entries:
+            return
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Run at most one computation per key; concurrent callers wait for it."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def in_flight(self, key: str) -> bool:
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Return ``(result, shared)``; ``shared`` is True for callers that
+        waited on another thread's computation instead of running ``fn``."""
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def do_async(self, key: str, fn: Callable[[], Any]) -> bool:
+        """Start ``fn`` in a daemon thread unless ``key`` is already in flight.
+
+        Used for stale-while-revalidate refreshes. Returns True if started.
+        """
+
+        if self.in_flight(key):
+            return False
+
+        def _run() -> None:
+            try:
+                self.do(key, fn)
+            except Exception as exc:
+                print(f"⚠️  Background refresh failed: {exc}")
+
+        threading.Thread(target=_run, name=f"cache-refresh-{key[:8]}", daemon=True).start()
+        return True
+
+
+class SearchMemo:
+    """Per-request memo for backend lookups (vector store, MCP search).
+
+    Planned sub-questions and sibling agents often issue the same lookup
+    (the original question, shared concepts). Identical concurrent lookups
+    run once via :class:`SingleFlight`; results are shallow-copied on the
+    way out because agents annotate documents in place.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._results: Dict[Tuple, List[Dict]] = {}
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_search(self, key: Tuple, fn: Callable[[], List[Dict]]) -> List[Dict]:
+        with self._lock:
+            cached = self._results.get(key)
+        if cached is None:
+            cached, shared = self._flight.do(repr(key), lambda: self._compute(key, fn))
+            with self._lock:
+                if shared:
+                    self.hits += 1
+        else:
+            with self._lock:
+                self.hits += 1
+        return [dict(doc) for doc in cached]
+
+    def _compute(self, key: Tuple, fn: Callable[[], List[Dict]]) -> List[Dict]:
+        result = list(fn() or [])
+        with self._lock:
+            self._results[key] = result
+            self.misses += 1
+        return result
+
+
+class CorpusVersions:
+    """Per-partition version counters for the ingested corpus.
+
+    Partitions are ``doc_type:<x>`` and ``component:<y>`` (from chunk
+    metadata) plus the global ``*`` counter. Ingestion bumps the partitions
+    it touched; cached answers store a snapshot of the partitions they were
+    built from and are dropped as soon as any of them moves.
+    """
+
+    GLOBAL = "*"
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS versions (partition TEXT PRIMARY KEY, version INTEGER NOT NULL)"
         )
-        for stale in files[self.max_entries :]:
-            stale.unlink(missing_ok=True)
+
+    @staticmethod
+    def partitions_for(metadata: Optional[Dict[str, Any]]) -> List[str]:
+        metadata = metadata or {}
+        parts = [f"doc_type:{metadata.get('doc_type') or 'unknown'}"]
+        if metadata.get("component"):
+            parts.append(f"component:{metadata['component']}")
+        return parts
+
+    def bump(self, partitions: Iterable[str]) -> None:
+        """Increment the given partitions (and the global counter)."""
+
+        names = sorted(set(partitions) | {self.GLOBAL})
+        with _WriteTxn(self._conn()) as conn:
+            conn.executemany(
+                """
+                INSERT INTO versions (partition, version) VALUES (?, 1)
+                ON CONFLICT(partition) DO UPDATE SET version = version + 1
+                """,
+                [(name,) for name in names],
+            )
+
+    def bump_all(self) -> None:
+        """Invalidate everything (e.g. after clearing the collection)."""
+
+        with _WriteTxn(self._conn()) as conn:
+            conn.execute("UPDATE versions SET version = version + 1")
+            conn.execute(
+                "INSERT OR IGNORE INTO versions (partition, version) VALUES (?, 1)",
+                (self.GLOBAL,),
+            )
+
+    def snapshot(self) -> Dict[str, int]:
+        """Current version of every known partition."""
+
+        return dict(self._conn().execute("SELECT partition, version FROM versions").fetchall())
+
+    def is_current(self, recorded: Dict[str, int]) -> bool:
+        """True if none of the recorded partitions changed since the snapshot."""
+
+        if not recorded:
+            return True
+        current = self.snapshot()
+        return all(current.get(name, 0) == version for name, version in recorded.items())
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.db_path)
+        return conn
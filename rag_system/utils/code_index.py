@@ -0,0 +1,500 @@
+"""Native, incrementally maintained code index (no Serena required).
+
+Symbols and their line spans are extracted per file:
+
+- Python through :meth:`ASTChunker.extract_symbols` (classes, functions and
+  methods, nested ones included, plus module-level names);
+- TypeScript with a lightweight tokenizer: comments and string literals are
+  skipped, brace depth is tracked, and declarations (``function``, ``class``,
+  ``interface``, ``type``, ``enum``, ``namespace``, ``const``/``let``/``var``,
+  class members) span up to their matching closing brace;
+- Markdown headings, each covering its section.
+
+Files also get a file-level entry (their first lines, unless a symbol starts
+on the first line), so files without symbols can still be found by path.
+The records are kept per file with their mtimes (``index_path``, pickled)
+and compiled into the same memory-mapped
+:class:`~rag_system.utils.symbol_store.SymbolStore` that
+:class:`SerenaCodeIndex` searches (``<index_path>.bin``).
+
+A background thread keeps it current: changed paths reported by ``watchdog``
+(inotify on Linux) when that package is installed, otherwise an mtime walk
+every ``refresh_interval`` seconds. Only files whose mtime moved are
+re-parsed. Queries never touch the filesystem beyond reading the snippet
+files.
+"""
+
+from __future__ import annotations
+
+import os
+import pickle
+import re
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from rag_system.utils.ast_chunker import ASTChunker
+from rag_system.utils.bm25_index import IGNORED_DIRS
+from rag_system.utils.serena_code_index import SerenaCodeIndex
+from rag_system.utils.symbol_store import SerenaSymbol, SymbolStore, build_store
+
+CODE_EXTENSIONS = {".py", ".ts", ".tsx", ".md"}
+FILE_HEAD_LINES = 40
+
+# (name, full_name, LSP kind, start_line, end_line), lines 0-based
+Record = Tuple[str, str, int, int, int]
+
+# ----------------------------------------------------------------------
+# TypeScript
+# ----------------------------------------------------------------------
+_TS_TOKEN_RE = re.compile(
+    r"//[^\n]*|/\*.*?\*/"
+    r"|'(?:\\.|[^'\\\n])*'|\"(?:\\.|[^\"\\\n])*\"|`(?:\\.|[^`\\])*`"
+    r"|[{};\n]",
+    re.S,
+)
+_TS_DECL_RE = re.compile(
+    r"^\s*(?:export\s+)?(?:default\s+)?(?:declare\s+)?(?:abstract\s+)?(?:async\s+)?"
+    r"(function\*?|class|interface|type|enum|namespace|const|let|var)\s+([A-Za-z_$][\w$]*)"
+)
+_TS_MEMBER_RE = re.compile(
+    r"^\s*(?:(?:public|private|protected|static|readonly|abstract|override|async|get|set)\s+)*"
+    r"\*?\s*([A-Za-z_$][\w$]*)\??\s*(?:<[^>()]*>)?\s*\("
+)
+_TS_NOT_MEMBERS = {"if", "for", "while", "switch", "catch", "return", "new", "await", "typeof", "super", "do", "else"}
+_TS_KINDS = {
+    "function": 12, "function*": 12, "class": 5, "interface": 11, "type": 26,
+    "enum": 10, "namespace": 3, "const": 14, "let": 13, "var": 13,
+}
+_TS_CONTAINERS = {5, 11}  # members are collected inside classes and interfaces
+
+
+def _ts_events(text: str) -> List[list]:
+    """Structural tokens outside comments/strings as
+    ``[offset, char, depth before it, line, closing line ('{' only)]``."""
+    events: List[list] = []
+    opens: List[int] = []
+    depth = line = 0
+    for match in _TS_TOKEN_RE.finditer(text):
+        token = match.group()
+        if token == "\n":
+            line += 1
+        elif token == "{":
+            opens.append(len(events))
+            events.append([match.start(), "{", depth, line, -1])
+            depth += 1
+        elif token == "}":
+            if opens:
+                events[opens.pop()][4] = line
+            events.append([match.start(), "}", depth, line, line])
+            depth = max(0, depth - 1)
+        elif token == ";":
+            events.append([match.start(), ";", depth, line, line])
+        else:
+            line += token.count("\n")
+    return events
+
+
+def _ts_extent(events: List[list], first: int, depth: int, line: int, last_line: int) -> int:
+    """Last line of a declaration starting at ``line``: its body's closing
+    brace, its terminating ``;``, or the line itself."""
+    for k in range(first, len(events)):
+        _, char, level, at, close = events[k]
+        if char == "}" and level <= depth:
+            return line
+        if char == ";" and level == depth:
+            return at
+        if char == "{" and level == depth:
+            # Prefer the widest brace opened on that line (body over a type literal)
+            end = close if close >= 0 else last_line
+            for _, c2, l2, at2, close2 in events[k + 1:]:
+                if at2 != at:
+                    break
+                if c2 == "{" and l2 == depth:
+                    end = max(end, close2 if close2 >= 0 else last_line)
+            return end
+    return line
+
+
+def typescript_symbols(text: str) -> List[Record]:
+    lines = text.split("\n")
+    events = _ts_events(text)
+    offsets = [e[0] for e in events]
+    candidates: List[Tuple[int, int, str, str, int, int]] = []  # line, depth, name, full, kind, end
+    containers: List[Tuple[str, int, int, int]] = []  # full name, inner depth, end line, kind
+    position = 0
+    for i, text_line in enumerate(lines):
+        line_start, position = position, position + len(text_line) + 1
+        first = bisect_left(offsets, line_start)
+        depth = events[first][2] if first < len(events) else (events[-1][2] if events else 0)
+        while containers and containers[-1][2] < i:
+            containers.pop()
+        parent = containers[-1] if containers and containers[-1][1] == depth else None
+        if parent is None and depth:
+            continue
+        decl = _TS_DECL_RE.match(text_line)
+        if decl and (parent is None or parent[3] == 3):
+            name, kind = decl.group(2), _TS_KINDS[decl.group(1)]
+        elif parent is not None and parent[3] in _TS_CONTAINERS:
+            member = _TS_MEMBER_RE.match(text_line)
+            if not member or member.group(1) in _TS_NOT_MEMBERS:
+                continue
+            name, kind = member.group(1), 6
+        else:
+            continue
+        end = _ts_extent(events, first, depth, i, len(lines) - 1)
+        full_name = f"{parent[0]}/{name}" if parent else name
+        candidates.append((i, depth, name, full_name, kind, end))
+        if kind in _TS_CONTAINERS or kind == 3:
+            containers.append((full_name, depth + 1, end, kind))
+
+    records: List[Record] = []
+    for n, (i, depth, name, full_name, kind, end) in enumerate(candidates):
+        # Brace-less statements (no ';') end before the next declaration
+        for j, other_depth, *_ in candidates[n + 1:]:
+            if j > end:
+                break
+            if other_depth <= depth:
+                end = max(i, j - 1)
+                break
+        records.append((name, full_name, kind, i, end))
+    return records
+
+
+# ----------------------------------------------------------------------
+# Markdown
+# ----------------------------------------------------------------------
+_MD_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_MD_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+
+
+def markdown_symbols(text: str) -> List[Record]:
+    lines = text.split("\n")
+    headings: List[Tuple[int, int, str]] = []
+    fence: Optional[str] = None
+    for i, line in enumerate(lines):
+        fence_match = _MD_FENCE_RE.match(line)
+        if fence_match:
+            marker = fence_match.group(1)
+            fence = None if fence == marker else (fence or marker)
+            continue
+        heading = None if fence else _MD_HEADING_RE.match(line)
+        if heading:
+            headings.append((i, len(heading.group(1)), heading.group(2)))
+
+    records: List[Record] = []
+    stack: List[Tuple[int, str]] = []
+    for n, (i, level, title) in enumerate(headings):
+        end = len(lines) - 1
+        for j, other_level, _ in headings[n + 1:]:
+            if other_level <= level:
+                end = j - 1
+                break
+        while stack and stack[-1][0] >= level:
+            stack.pop()
+        records.append((title, "/".join([t for _, t in stack] + [title]), 15, i, end))
+        stack.append((level, title))
+    return records
+
+
+# ----------------------------------------------------------------------
+class CodeIndex(SerenaCodeIndex):
+    """Symbol index over the project's own files, refreshed incrementally."""
+
+    source = "code_index"
+    id_prefix = "code"
+    VERSION = 1
+    DEBOUNCE_SEC = 0.5
+
+    def __init__(
+        self,
+        project_root: Path,
+        index_path: Optional[Path] = None,
+        *,
+        refresh_interval: float = 300.0,
+        watch: bool = True,
+        max_file_bytes: int = 1_000_000,
+        extensions: Optional[Iterable[str]] = None,
+    ) -> None:
+        self.refresh_interval = refresh_interval
+        self.watch = watch
+        self.max_file_bytes = max_file_bytes
+        self.extensions = set(extensions or CODE_EXTENSIONS)
+        self.chunker = ASTChunker()
+        self.file_mtimes: Dict[str, int] = {}
+        self.file_records: Dict[str, List[Record]] = {}
+        self.last_refresh: Dict[str, float] = {}
+        self._state_loaded = False
+        self._lock = threading.RLock()
+        self._refreshing = threading.Lock()
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._pending: Set[str] = set()
+        self._thread: Optional[threading.Thread] = None
+        self._observer = None
+        super().__init__(project_root, index_path=index_path)
+
+    # ------------------------------------------------------------------
+    def start(self) -> "CodeIndex":
+        """Refresh in a background thread, then keep the index current."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="code-index", daemon=True)
+                self._thread.start()
+        return self
+
+    def search(self, queries: Sequence[str], limit: int = 20) -> List[Dict]:
+        if self.store is None:
+            # First run without a persisted store: wait for the initial build
+            self.start()
+            self._ready.wait(float(os.getenv("RAG_CODE_INDEX_WAIT_SEC", "30")))
+        return super().search(queries, limit=limit)
+
+    def refresh(self, paths: Optional[Iterable[str]] = None) -> int:
+        """Re-parse files whose mtime changed (all files, or only ``paths``)
+        and drop deleted ones. Returns the number of files updated."""
+        if not self._refreshing.acquire(blocking=False):
+            if paths is not None:
+                self._queue(paths)
+            return 0
+        try:
+            started = time.perf_counter()
+            self._load_state()
+            files, removed = self._scan(None if paths is None else set(paths))
+            updated = 0
+            for path, rel, mtime in files:
+                if self.file_mtimes.get(rel) == mtime:
+                    continue
+                records = self._extract(path)
+                if records is None:
+                    continue
+                with self._lock:
+                    self.file_records[rel] = records
+                    self.file_mtimes[rel] = mtime
+                updated += 1
+            with self._lock:
+                for rel in removed:
+                    if self.file_mtimes.pop(rel, None) is not None:
+                        self.file_records.pop(rel, None)
+                        updated += 1
+            if updated or self.store is None:
+                self._rebuild()
+            self.last_refresh = {
+                "files": len(self.file_mtimes),
+                "updated": updated,
+                "symbols": len(self.symbols),
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+            return updated
+        finally:
+            self._refreshing.release()
+
+    # ------------------------------------------------------------------
+    @property
+    def _store_path(self) -> Optional[Path]:
+        return self.index_path.with_suffix(".bin") if self.index_path else None
+
+    def _load(self) -> None:
+        # Only the compiled store is mapped here; per-file records are read
+        # by the first refresh (they are only needed to rebuild it)
+        self._loaded = True
+        if self._store_path is None or not self._store_path.exists():
+            return
+        try:
+            store = SymbolStore.open(self._store_path)
+        except Exception:
+            return
+        if store.meta.get("version") == self.VERSION:
+            self._swap(store)
+
+    def _load_state(self) -> None:
+        if self._state_loaded:
+            return
+        self._state_loaded = True
+        if self.index_path is None or not self.index_path.exists():
+            return
+        try:
+            with self.index_path.open("rb") as fh:
+                state = pickle.load(fh)
+        except Exception:
+            return
+        if state.get("version") != self.VERSION:
+            return
+        with self._lock:
+            self.file_mtimes = state["file_mtimes"]
+            self.file_records = state["file_records"]
+
+    def _swap(self, store: SymbolStore) -> None:
+        self.store = store
+        self.symbols = store.symbols
+        self._ready.set()
+
+    def _rebuild(self) -> None:
+        with self._lock:
+            symbols = [
+                SerenaSymbol(name, full_name, kind, self.project_root / rel, rel, start, end)
+                for rel in sorted(self.file_records)
+                for name, full_name, kind, start, end in self.file_records[rel]
+            ]
+            state = {
+                "version": self.VERSION,
+                "file_mtimes": dict(self.file_mtimes),
+                "file_records": dict(self.file_records),
+            }
+        data = build_store(symbols, {"version": self.VERSION, "files": len(state["file_mtimes"])})
+        self._swap(self._save(data, state) or SymbolStore(data))
+
+    def _save(self, data: bytes, state: Dict) -> Optional[SymbolStore]:
+        if self.index_path is None:
+            return None
+        try:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            for target, write in (
+                (self._store_path, lambda fh: fh.write(data)),
+                (self.index_path, lambda fh: pickle.dump(state, fh, protocol=pickle.HIGHEST_PROTOCOL)),
+            ):
+                tmp = target.with_name(f"{target.name}.tmp{os.getpid()}")
+                with tmp.open("wb") as fh:
+                    write(fh)
+                os.replace(tmp, target)
+            return SymbolStore.open(self._store_path)
+        except Exception as exc:
+            print(f"⚠️  Failed to save code index: {exc}")
+            return None
+
+    # ------------------------------------------------------------------
+    def _run(self) -> None:
+        try:
+            self.refresh()
+        except Exception as exc:
+            print(f"⚠️  Code index refresh failed: {exc}")
+        finally:
+            self._ready.set()
+        if self.watch:
+            self._observer = self._start_observer()
+        while True:
+            woke = self._wake.wait(None if self._observer is not None else self.refresh_interval)
+            try:
+                if woke:
+                    time.sleep(self.DEBOUNCE_SEC)  # let editors finish writing
+                    self._wake.clear()
+                    with self._lock:
+                        paths, self._pending = self._pending, set()
+                    self.refresh(paths)
+                else:
+                    self.refresh()
+            except Exception as exc:
+                print(f"⚠️  Code index refresh failed: {exc}")
+
+    def _start_observer(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return None
+
+        index = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event) -> None:
+                index._on_event(event)
+
+        try:
+            observer = Observer()
+            observer.schedule(_Handler(), str(self.project_root), recursive=True)
+            observer.daemon = True
+            observer.start()
+        except Exception as exc:
+            print(f"⚠️  Code index watcher unavailable ({exc}); polling every {self.refresh_interval:.0f}s")
+            return None
+        return observer
+
+    def _on_event(self, event) -> None:
+        if event.event_type not in ("created", "modified", "deleted", "moved"):
+            return
+        if event.is_directory and event.event_type == "modified":
+            return  # a child changed; it reports its own event
+        paths = [event.src_path, getattr(event, "dest_path", "")]
+        relevant = [os.fsdecode(p) for p in paths if p and self._relevant(Path(os.fsdecode(p)), event.is_directory)]
+        if relevant:
+            self._queue(relevant)
+
+    def _queue(self, paths: Iterable[str]) -> None:
+        with self._lock:
+            self._pending.update(paths)
+        self._wake.set()
+
+    def _relevant(self, path: Path, is_directory: bool) -> bool:
+        try:
+            parts = path.relative_to(self.project_root).parts
+        except ValueError:
+            return False
+        dirs = parts if is_directory else parts[:-1]
+        if any(d in IGNORED_DIRS or d.startswith(".") for d in dirs):
+            return False
+        return is_directory or path.suffix.lower() in self.extensions
+
+    def _scan(self, paths: Optional[Set[str]]) -> Tuple[List[Tuple[Path, str, int]], List[str]]:
+        """(existing files to check, relative paths to drop)."""
+        if paths is None:
+            files = list(self._iter_files(self.project_root))
+            seen = {rel for _, rel, _ in files}
+            return files, [rel for rel in self.file_mtimes if rel not in seen]
+        files: List[Tuple[Path, str, int]] = []
+        removed: List[str] = []
+        for raw in paths:
+            path = Path(raw)
+            if path.is_dir():
+                files.extend(self._iter_files(path))
+                continue
+            try:
+                rel = str(path.relative_to(self.project_root))
+            except ValueError:
+                continue
+            try:
+                st = path.stat()
+            except OSError:
+                # Deleted file, or a deleted/moved directory: drop everything under it
+                prefix = rel + os.sep
+                removed.extend(r for r in self.file_mtimes if r == rel or r.startswith(prefix))
+                continue
+            if st.st_size <= self.max_file_bytes and self._relevant(path, False):
+                files.append((path, rel, st.st_mtime_ns))
+        return files, removed
+
+    def _iter_files(self, root: Path) -> Iterable[Tuple[Path, str, int]]:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if d not in IGNORED_DIRS and not d.startswith(".")]
+            for name in filenames:
+                if Path(name).suffix.lower() not in self.extensions:
+                    continue
+                path = Path(dirpath) / name
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                if st.st_size > self.max_file_bytes:
+                    continue
+                yield path, str(path.relative_to(self.project_root)), st.st_mtime_ns
+
+    def _extract(self, path: Path) -> Optional[List[Record]]:
+        try:
+            text = path.read_text(encoding="utf-8", errors="ignore")
+        except Exception:
+            return None
+        suffix = path.suffix.lower()
+        if suffix == ".py":
+            records = [
+                (s["name"], s["full_name"], s["kind"], s["line_start"] - 1, s["line_end"] - 1)
+                for s in self.chunker.extract_symbols(text)
+            ]
+        elif suffix == ".md":
+            records = markdown_symbols(text)
+        else:
+            records = typescript_symbols(text)
+        if any(start == 0 for _, _, _, start, _ in records):
+            return records  # a symbol already covers the top (and owns its id)
+        head = min(text.count("\n") + 1, FILE_HEAD_LINES) - 1
+        return [(path.stem, path.stem, 1, 0, head)] + records  # 1 = File
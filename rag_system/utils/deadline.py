@@ -0,0 +1,62 @@
+"""Cooperative cancellation for work its caller has stopped waiting for.
+
+A :class:`CancelScope` carries a deadline and a cancel flag. Code running
+under :func:`cancel_scope` (a contextvar, so it follows ``propagate``d
+callables into worker threads) checks it between blocking steps with
+:func:`check_cancelled` and caps blocking calls (subprocesses, sockets) with
+:func:`time_left`. Outside a scope both are no-ops.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class Cancelled(Exception):
+    """Raised inside a scope that was cancelled or ran past its deadline."""
+
+
+class CancelScope:
+    """Deadline (``time.time()`` seconds) plus a flag set by :meth:`cancel`."""
+
+    def __init__(self, deadline: Optional[float] = None) -> None:
+        self.deadline = deadline
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set() or (self.deadline is not None and time.time() >= self.deadline)
+
+
+_current: contextvars.ContextVar[Optional[CancelScope]] = contextvars.ContextVar("rag_cancel_scope", default=None)
+
+
+@contextmanager
+def cancel_scope(scope: CancelScope) -> Iterator[CancelScope]:
+    token = _current.set(scope)
+    try:
+        yield scope
+    finally:
+        _current.reset(token)
+
+
+def check_cancelled() -> None:
+    scope = _current.get()
+    if scope is not None and scope.cancelled:
+        raise Cancelled()
+
+
+def time_left(default: float) -> float:
+    """``default`` capped by the current scope's deadline; raises :class:`Cancelled` if none is left."""
+    check_cancelled()
+    scope = _current.get()
+    if scope is None or scope.deadline is None:
+        return default
+    return max(0.0, min(default, scope.deadline - time.time()))
@@ -0,0 +1,94 @@
+"""Near-duplicate detection for retrieved and ingested text.
+
+Uses bottom-k MinHash sketches over word shingles: one hash per shingle,
+keep the ``k`` smallest. Jaccard similarity between two texts is
+estimated from their sketches, and an inverted index from sketch values to
+kept documents limits comparisons to documents that share hashes, so
+filtering ``n`` documents is roughly O(n * k) instead of O(n²).
+"""
+
+from __future__ import annotations
+
+import heapq
+import re
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class NearDuplicateFilter:
+    """Drop documents whose estimated Jaccard similarity to an earlier
+    (higher-ranked) document is at least ``threshold``."""
+
+    def __init__(self, threshold: float = 0.8, sketch_size: int = 64, shingle_words: int = 3) -> None:
+        self.threshold = float(threshold)
+        self.sketch_size = int(sketch_size)
+        self.shingle_words = int(shingle_words)
+
+    def sketch(self, text: str) -> Tuple[int, ...]:
+        """Bottom-k MinHash sketch (sorted) of the text's word shingles."""
+
+        words = _WORD_RE.findall(text.lower())
+        n = self.shingle_words
+        if len(words) < n:
+            shingles = set(words)
+        else:
+            shingles = {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+        # Built-in str hash: fast and stable within a process, which is all
+        # we need since sketches are never persisted
+        hashes = {hash(s) for s in shingles}
+        return tuple(heapq.nsmallest(self.sketch_size, hashes))
+
+    def similarity(self, a: Sequence[int], b: Sequence[int]) -> float:
+        """Estimated Jaccard similarity from two bottom-k sketches."""
+
+        if not a or not b:
+            return 0.0
+        set_a, set_b = set(a), set(b)
+        union_bottom = heapq.nsmallest(self.sketch_size, set_a | set_b)
+        shared = sum(1 for h in union_bottom if h in set_a and h in set_b)
+        return shared / len(union_bottom)
+
+    def filter(
+        self,
+        docs: List[Dict],
+        text: Callable[[Dict], str] = lambda d: d.get("content", ""),
+        on_duplicate: Optional[Callable[[Dict, Dict], None]] = None,
+    ) -> Tuple[List[Dict], int]:
+        """Keep the first of each near-duplicate group (input order = priority).
+
+        ``on_duplicate(kept, dropped)`` lets callers merge signals from the
+        dropped document. Returns ``(kept_docs, removed_count)``.
+        """
+
+        kept: List[Dict] = []
+        sketches: List[Tuple[int, ...]] = []
+        postings: Dict[int, List[int]] = {}
+        removed = 0
+        # A pair at the threshold shares at least this many sketch values
+        min_shared = max(1, int(self.threshold * self.sketch_size * 0.5))
+
+        for doc in docs:
+            sk = self.sketch(text(doc))
+            duplicate_of = None
+            if sk:
+                counts = Counter(idx for h in sk for idx in postings.get(h, ()))
+                for idx, shared in counts.most_common():
+                    if shared < min_shared:
+                        break
+                    if self.similarity(sk, sketches[idx]) >= self.threshold:
+                        duplicate_of = idx
+                        break
+            if duplicate_of is not None:
+                removed += 1
+                if on_duplicate:
+                    on_duplicate(kept[duplicate_of], doc)
+                continue
+            idx = len(kept)
+            kept.append(doc)
+            sketches.append(sk)
+            for h in sk:
+                postings.setdefault(h, []).append(idx)
+
+        return kept, removed
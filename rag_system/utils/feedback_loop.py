@@ -13,6 +13,8 @@ import pandas as pd
 import sqlite3
 import logging
 
+from rag_system.utils.log_sink import get_log_sink
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -497,9 +499,7 @@ class BotScalpBrain:
             "feedback": feedback
         }
         
-        with open(self.feedback_file, "a") as f:
-            json.dump(entry, f)
-            f.write("\n")
+        get_log_sink().write(self.feedback_file, entry)
         
         # Adicionar APENAS RESUMO ao short-term memory (evita memory leak)
         import hashlib
@@ -0,0 +1,125 @@
+"""Rank fusion for multi-agent retrieval.
+
+Agents score documents on incompatible scales (cosine similarity, constant
+1.0 for memory, BM25, graph counts), so their raw scores can't be summed.
+Reciprocal Rank Fusion only looks at each document's rank inside each
+agent's list: ``rrf(d) = sum_a w_a / (k + rank_a(d))``.
+"""
+
+from __future__ import annotations
+
+from typing import Callable, Dict, List, Optional
+
+# Per-source signals kept on the fused document whichever occurrence wins
+_CARRIED_FIELDS = ("temporal_boost", "vector_score", "embedding")
+
+
+def content_key(doc: Dict) -> int:
+    """Identity used to merge the same document coming from several agents."""
+
+    return hash(doc.get("content", "")[:200])
+
+
+def rank_within_agent(docs: List[Dict], by: str = "score") -> List[Dict]:
+    """Order one agent's output by its own score field (stable, so agents
+    that return pre-sorted lists or constant scores keep their order)."""
+
+    return sorted(docs, key=lambda d: d.get(by, 0) or 0, reverse=True)
+
+
+def reciprocal_rank_fusion(
+    ranked_lists: Dict[str, List[Dict]],
+    k: int = 60,
+    weights: Optional[Dict[str, float]] = None,
+    key: Callable[[Dict], int] = content_key,
+) -> List[Dict]:
+    """Merge per-agent ranked lists into a single list sorted by RRF score.
+
+    Each fused document keeps the fields of its best-ranked occurrence plus
+    ``rrf_score`` and ``agents`` (``{agent: rank}``, 1-based).
+    """
+
+    weights = weights or {}
+    fused: Dict[int, Dict] = {}
+    best_rank: Dict[int, int] = {}
+
+    for agent, docs in ranked_lists.items():
+        weight = float(weights.get(agent, 1.0))
+        seen_in_agent = set()
+        for rank, doc in enumerate(docs, start=1):
+            doc_key = key(doc)
+            # An agent that returned the same doc twice only votes once (best rank)
+            if doc_key in seen_in_agent:
+                continue
+            seen_in_agent.add(doc_key)
+
+            entry = fused.get(doc_key)
+            if entry is None:
+                entry = fused[doc_key] = dict(doc)
+                entry["rrf_score"] = 0.0
+                entry["agents"] = {}
+                best_rank[doc_key] = rank
+            elif rank < best_rank[doc_key]:
+                merged = dict(doc)
+                merged["rrf_score"] = entry["rrf_score"]
+                merged["agents"] = entry["agents"]
+                # Keep signals other agents attached (e.g. temporal_boost)
+                for field in _CARRIED_FIELDS:
+                    if field in entry and field not in merged:
+                        merged[field] = entry[field]
+                entry = fused[doc_key] = merged
+                best_rank[doc_key] = rank
+            else:
+                for field in _CARRIED_FIELDS:
+                    if field in doc and field not in entry:
+                        entry[field] = doc[field]
+
+            entry["rrf_score"] += weight / (k + rank)
+            entry["agents"][agent] = rank
+
+    return sorted(fused.values(), key=lambda d: d["rrf_score"], reverse=True)
+
+
+def reciprocal_rank_fusion_groups(
+    groups: List[Dict[str, List[Dict]]],
+    k: int = 60,
+    weights: Optional[Dict[str, float]] = None,
+    key: Callable[[Dict], int] = content_key,
+) -> List[Dict]:
+    """RRF over the per-agent lists of several queries (planned sub-questions).
+
+    Every (query, agent) list votes separately, so a document two
+    sub-questions agree on outranks one only a single sub-question found.
+    ``agents`` is collapsed back to ``{agent: best rank}``.
+    """
+
+    weights = weights or {}
+    flat: Dict[str, List[Dict]] = {}
+    flat_weights: Dict[str, float] = {}
+    for i, ranked_lists in enumerate(groups):
+        for agent, docs in ranked_lists.items():
+            label = f"{agent}#{i}"
+            flat[label] = docs
+            flat_weights[label] = float(weights.get(agent, 1.0))
+
+    fused = reciprocal_rank_fusion(flat, k=k, weights=flat_weights, key=key)
+    for doc in fused:
+        agents: Dict[str, int] = {}
+        for label, rank in doc["agents"].items():
+            agent = label.rsplit("#", 1)[0]
+            agents[agent] = min(rank, agents.get(agent, rank))
+        doc["agents"] = agents
+    return fused
+
+
+def merge_fused(kept: Dict, dropped: Dict) -> None:
+    """Fold a near-duplicate's fusion evidence into the document that stays."""
+
+    kept["rrf_score"] = kept.get("rrf_score", 0.0) + dropped.get("rrf_score", 0.0)
+    agents = kept.setdefault("agents", {})
+    for agent, rank in (dropped.get("agents") or {}).items():
+        agents[agent] = min(rank, agents.get(agent, rank))
+    for field in _CARRIED_FIELDS:
+        if field in dropped and field not in kept:
+            kept[field] = dropped[field]
+    kept["near_duplicates"] = kept.get("near_duplicates", 0) + 1
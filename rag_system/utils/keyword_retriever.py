@@ -1,4 +1,4 @@
-"""Very small keyword retriever that shells out to ripgrep."""
+"""Keyword retriever: persistent BM25 index, with ripgrep as fallback."""
 
 from __future__ import annotations
 
@@ -6,63 +6,197 @@ import json
 import re
 import subprocess
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterable, List, Optional
+
+from rag_system.utils.bm25_index import IGNORED_DIRS, BM25Index, fold, parse_query, rank_snippet
 
 
 class KeywordRetriever:
-    def __init__(self, project_root: Path) -> None:
+    # ripgrep fallback (used when the BM25 index is disabled)
+    RG_CONTEXT_LINES = 3
+    RG_MAX_MATCHES_PER_FILE = 20
+    RG_MAX_WINDOWS = 3
+    RG_MAX_TOKENS = 4
+
+    _STOPWORDS = {
+        "como", "qual", "quais", "onde", "quando", "porque", "para", "com", "sem",
+        "uma", "umas", "uns", "dos", "das", "nos", "nas", "que", "isso", "este",
+        "esta", "esse", "essa", "pelo", "pela", "sobre", "entre", "mais", "menos",
+        "the", "and", "for", "with", "what", "where", "when", "how", "does", "this",
+        "that", "from", "into", "explique", "funciona",
+    }
+
+    def __init__(
+        self,
+        project_root: Path,
+        index_path: Optional[Path] = None,
+        refresh_interval: float = 300.0,
+    ) -> None:
         self.project_root = Path(project_root)
+        self.index: Optional[BM25Index] = None
+        if index_path is not None:
+            try:
+                self.index = BM25Index(
+                    self.project_root,
+                    index_path,
+                    refresh_interval=refresh_interval,
+                )
+            except Exception as exc:
+                print(f"  ⚠️  Keyword index unavailable, using ripgrep: {exc}")
+                self.index = None
 
     def search(self, query: str, limit: int = 10) -> List[Dict]:
-        token = self._select_token(query)
-        if not token:
+        if self.index is not None:
+            return self._search_index(query, limit)
+        return self._search_rg(query, limit)
+
+    def refresh(self) -> int:
+        """Incrementally re-index changed project files (no-op for ripgrep)."""
+        return self.index.refresh() if self.index is not None else 0
+
+    def index_documents(self, documents: Iterable[Dict], namespace: str) -> int:
+        """Add ingested chunks (e.g. MCP memories) to the keyword index."""
+        if self.index is None:
+            return 0
+        return self.index.index_documents(documents, namespace=namespace)
+
+    # ------------------------------------------------------------------
+    def _search_index(self, query: str, limit: int) -> List[Dict]:
+        self.index.ensure_fresh()
+        hits = self.index.search(query, limit=limit)
+        if not hits:
+            return []
+        terms, _ = parse_query(query)
+        top = hits[0][0] or 1.0
+        results: List[Dict] = []
+        for score, chunk in hits:
+            start, end, snippet = rank_snippet(chunk, terms)
+            metadata = dict(chunk.metadata)
+            metadata.update({
+                "path": chunk.path,
+                "line": start,
+                "end_line": end,
+                "source": "keyword",
+                "bm25": round(score, 3),
+            })
+            results.append(
+                {
+                    "id": f"keyword::{chunk.path}:{start}",
+                    "content": f"# File: {chunk.path}:{start}-{end}\n{snippet}",
+                    "metadata": metadata,
+                    "score": round(score / top, 3),
+                }
+            )
+        return results
+
+    def _search_rg(self, query: str, limit: int) -> List[Dict]:
+        """One ``rg`` run over the top informative tokens, grouped per file."""
+        tokens = self._select_tokens(query)
+        if not tokens:
             return []
+        patterns: List[str] = []
+        for token in tokens:
+            for variant in (token, fold(token)):
+                if variant not in patterns:
+                    patterns.append(variant)
+        cmd = [
+            "rg",
+            "--json",
+            "-n",
+            "-i",
+            "-F",
+            "-C",
+            str(self.RG_CONTEXT_LINES),
+            "-m",
+            str(self.RG_MAX_MATCHES_PER_FILE),
+            "--max-filesize",
+            "1M",
+        ]
+        for name in sorted(IGNORED_DIRS):
+            cmd.extend(["--glob", f"!{name}/"])
+        for pattern in patterns:
+            cmd.extend(["-e", pattern])
+        cmd.append(str(self.project_root))
         try:
-            cmd = [
-                "rg",
-                "--json",
-                "-n",
-                "-m",
-                str(limit * 3),
-                "--no-heading",
-                token,
-                str(self.project_root),
-            ]
-            proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
-        except FileNotFoundError:
+            proc = subprocess.run(cmd, capture_output=True, text=True, check=False, timeout=20)
+        except (FileNotFoundError, subprocess.TimeoutExpired):
             return []
-        results: List[Dict] = []
+
+        # path -> {line_number: text}, plus the set of matched line numbers
+        files: Dict[str, Dict[int, str]] = {}
+        matched: Dict[str, List[int]] = {}
         for line in proc.stdout.splitlines():
             try:
                 payload = json.loads(line)
             except json.JSONDecodeError:
                 continue
-            if payload.get("type") != "match":
+            kind = payload.get("type")
+            if kind not in ("match", "context"):
                 continue
             data = payload.get("data", {})
             path = data.get("path", {}).get("text")
             line_number = data.get("line_number")
-            line_text = data.get("lines", {}).get("text", "").strip()
-            if not path or not line_text:
+            if not path or line_number is None:
                 continue
-            snippet = f"# File: {Path(path).relative_to(self.project_root)}:{line_number}\n{line_text}"
+            files.setdefault(path, {})[line_number] = data.get("lines", {}).get("text", "").rstrip("\n")
+            if kind == "match":
+                matched.setdefault(path, []).append(line_number)
+
+        folded_tokens = [fold(t) for t in tokens]
+        scored = []
+        for path, hits in matched.items():
+            lines = files[path]
+            covered = {t for t in folded_tokens if any(t in fold(lines[n]) for n in hits)}
+            coverage = len(covered) / len(folded_tokens)
+            # Coverage dominates; match count only breaks ties (saturating)
+            score = coverage + 0.1 * min(1.0, len(hits) / 10)
+            scored.append((score, path, hits, lines))
+        scored.sort(key=lambda item: item[0], reverse=True)
+
+        results: List[Dict] = []
+        for score, path, hits, lines in scored[:limit]:
+            rel = str(Path(path).relative_to(self.project_root))
+            windows = self._merge_windows(sorted(hits), self.RG_CONTEXT_LINES)
+            parts = []
+            for lo, hi in windows[: self.RG_MAX_WINDOWS]:
+                present = [n for n in range(lo, hi + 1) if n in lines]
+                body = "\n".join(lines[n] for n in present)
+                parts.append(f"# File: {rel}:{present[0]}-{present[-1]}\n{body}")
             results.append(
                 {
-                    "id": f"keyword::{path}:{line_number}",
-                    "content": snippet,
+                    "id": f"keyword::{path}:{hits[0]}",
+                    "content": "\n...\n".join(parts),
                     "metadata": {
-                        "path": str(Path(path).relative_to(self.project_root)),
-                        "line": line_number,
+                        "path": rel,
+                        "line": hits[0],
+                        "matches": len(hits),
                         "source": "keyword",
                     },
-                    "score": 0.6,
+                    "score": round(min(1.0, score), 3),
                 }
             )
-            if len(results) >= limit:
-                break
         return results
 
-    def _select_token(self, query: str) -> str | None:
-        tokens = [t for t in re.split(r"[^A-Za-z0-9_]+", query) if len(t) > 3]
+    def _select_tokens(self, query: str) -> List[str]:
+        """Top-N informative tokens (Unicode-aware, stopwords dropped, longest first)."""
+        seen = set()
+        tokens: List[str] = []
+        for token in re.findall(r"\w+", query, re.UNICODE):
+            key = fold(token)
+            if len(token) <= 3 or key in self._STOPWORDS or key in seen:
+                continue
+            seen.add(key)
+            tokens.append(token)
         tokens.sort(key=len, reverse=True)
-        return tokens[0] if tokens else None
+        return tokens[: self.RG_MAX_TOKENS]
+
+    @staticmethod
+    def _merge_windows(lines: List[int], context: int) -> List[tuple]:
+        windows: List[list] = []
+        for n in lines:
+            lo, hi = max(1, n - context), n + context
+            if windows and lo <= windows[-1][1] + 1:
+                windows[-1][1] = max(windows[-1][1], hi)
+            else:
+                windows.append([lo, hi])
+        return [tuple(w) for w in windows]
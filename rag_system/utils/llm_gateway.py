@@ -0,0 +1,360 @@
+"""Thin gateway for every LLM call the pipeline makes.
+
+Wraps ``client.messages.create`` so each call records, per pipeline stage:
+
+- input, output and cached (prompt-cache read/write) tokens;
+- latency, model, attempts and an estimated cost in USD.
+
+Transient failures (429, 5xx, overloaded, connection errors) are retried
+with full-jitter exponential backoff, honouring ``retry-after``. A circuit
+breaker stops calling the API for ``RAG_LLM_BREAKER_RESET_SEC`` after
+``RAG_LLM_BREAKER_FAILURES`` consecutive failures, so stages that degrade
+gracefully (concepts, expansions, planning) fail fast instead of each
+burning its own retry budget.
+
+Each call becomes an ``llm.<stage>`` span in the tracer. Calls made inside
+``with gateway.track() as usage`` are also added to that per-query ledger;
+the pipeline logs it with the run. Counters and a latency histogram per
+stage go to the process-wide metrics registry.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+from rag_system.utils.metrics import get_registry
+
+# USD per million tokens (input, output), matched by substring of the model
+# id; override with RAG_LLM_PRICES='{"haiku": [0.8, 4.0], ...}'
+DEFAULT_PRICES: Dict[str, List[float]] = {
+    "haiku-4": [1.0, 5.0],
+    "haiku": [0.8, 4.0],
+    "sonnet": [3.0, 15.0],
+    "opus-4-5": [5.0, 25.0],
+    "opus": [15.0, 75.0],
+}
+# Prompt-cache multipliers on the input price
+CACHE_READ_FACTOR = 0.1
+CACHE_WRITE_FACTOR = 1.25
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the API while the breaker is open."""
+
+
+@dataclass
+class LLMCall:
+    stage: str
+    model: str
+    start_time: float
+    end_time: float = 0.0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+    attempts: int = 0
+    cost_usd: float = 0.0
+    status: str = "ok"
+    error: Optional[str] = None
+
+    @property
+    def latency_ms(self) -> float:
+        return round((self.end_time - self.start_time) * 1000, 2)
+
+    @property
+    def retries(self) -> int:
+        return max(0, self.attempts - 1)
+
+
+@dataclass
+class LLMUsage:
+    """Per-query ledger: totals plus a breakdown by stage."""
+
+    calls: int = 0
+    errors: int = 0
+    retries: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    cost_usd: float = 0.0
+    latency_ms: float = 0.0
+    by_stage: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, call: LLMCall) -> None:
+        with self._lock:
+            self.calls += 1
+            self.errors += 1 if call.status != "ok" else 0
+            self.retries += call.retries
+            self.input_tokens += call.input_tokens
+            self.output_tokens += call.output_tokens
+            self.cached_tokens += call.cache_read_tokens
+            self.cost_usd += call.cost_usd
+            self.latency_ms += call.latency_ms
+            stage = self.by_stage.setdefault(call.stage, {
+                "calls": 0, "input_tokens": 0, "output_tokens": 0,
+                "cached_tokens": 0, "cost_usd": 0.0, "latency_ms": 0.0,
+            })
+            stage["calls"] += 1
+            stage["input_tokens"] += call.input_tokens
+            stage["output_tokens"] += call.output_tokens
+            stage["cached_tokens"] += call.cache_read_tokens
+            stage["cost_usd"] += call.cost_usd
+            stage["latency_ms"] += call.latency_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "retries": self.retries,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "cached_tokens": self.cached_tokens,
+                "cost_usd": round(self.cost_usd, 6),
+                "latency_ms": round(self.latency_ms, 2),
+                "by_stage": {
+                    name: dict(s, cost_usd=round(s["cost_usd"], 6), latency_ms=round(s["latency_ms"], 2))
+                    for name, s in self.by_stage.items()
+                },
+            }
+
+
+class CircuitBreaker:
+    """Closed → open after N consecutive failures → half-open after a cool-down."""
+
+    def __init__(self, failure_threshold: int = 5, reset_after_sec: float = 30.0) -> None:
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_after_sec = reset_after_sec
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after_sec:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Closed: always; half-open: a single probe call at a time."""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._probing:
+                    self.trips += 1
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self) -> None:
+        """End a probe that proved nothing about the upstream (e.g. a bad request)."""
+        with self._lock:
+            self._probing = False
+
+
+def _load_prices() -> Dict[str, List[float]]:
+    raw = os.getenv("RAG_LLM_PRICES")
+    if not raw:
+        return dict(DEFAULT_PRICES)
+    try:
+        return {str(k): [float(v[0]), float(v[1])] for k, v in json.loads(raw).items()}
+    except (ValueError, TypeError, IndexError, AttributeError):
+        print("  ⚠️  RAG_LLM_PRICES inválido; usando preços padrão")
+        return dict(DEFAULT_PRICES)
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Rate limits, overload, 5xx and connection/timeouts are worth retrying."""
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return int(status) in RETRYABLE_STATUS or int(status) >= 500
+    return type(exc).__name__ in {"APIConnectionError", "APITimeoutError", "ConnectionError", "TimeoutError"}
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        value = headers.get("retry-after")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMGateway:
+    """Accounting, retries and a circuit breaker around ``messages.create``."""
+
+    def __init__(self,
+                 client,
+                 tracer=None,
+                 max_retries: Optional[int] = None,
+                 base_delay: Optional[float] = None,
+                 max_delay: Optional[float] = None,
+                 breaker: Optional[CircuitBreaker] = None) -> None:
+        self.client = client
+        self.tracer = tracer
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("RAG_LLM_MAX_RETRIES", "3"))
+        self.base_delay = base_delay if base_delay is not None else float(os.getenv("RAG_LLM_BACKOFF_BASE_SEC", "0.5"))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv("RAG_LLM_BACKOFF_MAX_SEC", "8"))
+        self.breaker = breaker or CircuitBreaker(
+            failure_threshold=int(os.getenv("RAG_LLM_BREAKER_FAILURES", "5")),
+            reset_after_sec=float(os.getenv("RAG_LLM_BREAKER_RESET_SEC", "30")),
+        )
+        self.prices = _load_prices()
+        self.totals = LLMUsage()  # process lifetime
+        self.registry = get_registry()
+        self._usage: contextvars.ContextVar[Optional[LLMUsage]] = contextvars.ContextVar("llm_usage", default=None)
+
+    # ------------------------------------------------------------------
+    @contextmanager
+    def track(self) -> Iterator[LLMUsage]:
+        """Collect the calls made in this context (and contexts copied from it)."""
+        usage = LLMUsage()
+        token = self._usage.set(usage)
+        try:
+            yield usage
+        finally:
+            self._usage.reset(token)
+
+    def create(self, stage: str, **kwargs) -> Any:
+        """``messages.create(**kwargs)`` with retries, accounting and tracing."""
+        call = LLMCall(stage=stage, model=str(kwargs.get("model", "")), start_time=time.time())
+        try:
+            response = self._create_with_retries(call, kwargs)
+        except Exception as exc:
+            call.status = "open_circuit" if isinstance(exc, CircuitOpenError) else "error"
+            call.error = f"{type(exc).__name__}: {exc}"[:300]
+            self._record(call)
+            raise
+        self._account(call, response)
+        self._record(call)
+        return response
+
+    def cost(self, model: str, input_tokens: int, output_tokens: int,
+             cache_read_tokens: int = 0, cache_write_tokens: int = 0) -> float:
+        price_in, price_out = self._price(model)
+        return (
+            input_tokens * price_in
+            + cache_read_tokens * price_in * CACHE_READ_FACTOR
+            + cache_write_tokens * price_in * CACHE_WRITE_FACTOR
+            + output_tokens * price_out
+        ) / 1_000_000
+
+    def stats(self) -> Dict[str, Any]:
+        data = self.totals.to_dict()
+        data["breaker_state"] = self.breaker.state
+        data["breaker_trips"] = self.breaker.trips
+        return data
+
+    # ------------------------------------------------------------------
+    def _create_with_retries(self, call: LLMCall, kwargs: Dict[str, Any]) -> Any:
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"LLM circuit open (stage {call.stage})")
+            attempt += 1
+            call.attempts = attempt
+            settled = False  # whether the breaker saw this attempt's outcome
+            try:
+                response = self.client.messages.create(**kwargs)
+                self.breaker.record_success()
+                settled = True
+                return response
+            except Exception as exc:
+                if not is_retryable(exc):
+                    raise
+                self.breaker.record_failure()
+                settled = True
+                if attempt > self.max_retries:
+                    raise
+                # Full jitter; a server-provided retry-after wins when longer
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                delay = max(delay, min(self.max_delay, _retry_after(exc) or 0.0))
+                print(f"  🔁 LLM {call.stage}: {type(exc).__name__}, retry {attempt}/{self.max_retries} em {delay:.1f}s")
+            finally:
+                # Non-transient errors (bad request, auth) and interrupts say
+                # nothing about upstream health, but must not leave a
+                # half-open probe slot taken forever
+                if not settled:
+                    self.breaker.release()
+            time.sleep(delay)
+
+    def _account(self, call: LLMCall, response: Any) -> None:
+        usage = getattr(response, "usage", None)
+        call.input_tokens = int(getattr(usage, "input_tokens", 0) or 0)
+        call.output_tokens = int(getattr(usage, "output_tokens", 0) or 0)
+        call.cache_read_tokens = int(getattr(usage, "cache_read_input_tokens", 0) or 0)
+        call.cache_write_tokens = int(getattr(usage, "cache_creation_input_tokens", 0) or 0)
+        call.model = str(getattr(response, "model", None) or call.model)
+        call.cost_usd = self.cost(call.model, call.input_tokens, call.output_tokens,
+                                  call.cache_read_tokens, call.cache_write_tokens)
+
+    def _record(self, call: LLMCall) -> None:
+        call.end_time = call.end_time or time.time()
+        self.totals.add(call)
+        self._observe(call)
+        usage = self._usage.get()
+        if usage is not None:
+            usage.add(call)
+        if self.tracer is not None:
+            attributes = {k: v for k, v in asdict(call).items()
+                          if k not in ("stage", "start_time", "end_time", "status", "error")}
+            attributes["cost_usd"] = round(call.cost_usd, 6)
+            attributes["retries"] = call.retries
+            self.tracer.record_span(f"llm.{call.stage}", call.start_time, call.end_time,
+                                    attributes=attributes, status=call.status, error=call.error)
+
+    def _observe(self, call: LLMCall) -> None:
+        registry = self.registry
+        registry.inc("rag_llm_calls_total", stage=call.stage, model=call.model, status=call.status)
+        registry.observe("rag_llm_call_latency_ms", call.latency_ms, stage=call.stage, model=call.model)
+        if call.status != "ok":
+            registry.inc("rag_llm_errors_total", stage=call.stage)
+        if call.retries:
+            registry.inc("rag_llm_retries_total", call.retries, stage=call.stage)
+        for kind, n in (("input", call.input_tokens), ("output", call.output_tokens), ("cached", call.cache_read_tokens)):
+            if n:
+                registry.inc("rag_llm_tokens_total", n, stage=call.stage, model=call.model, type=kind)
+        if call.cost_usd:
+            registry.inc("rag_llm_cost_usd_total", call.cost_usd, stage=call.stage, model=call.model)
+
+    def _price(self, model: str) -> List[float]:
+        model = (model or "").lower()
+        # Longest key first so "haiku-4" wins over "haiku"
+        for key in sorted(self.prices, key=len, reverse=True):
+            if key in model:
+                return self.prices[key]
+        return [0.0, 0.0]
@@ -0,0 +1,162 @@
+"""Background, batched JSONL writer shared by the pipeline's loggers.
+
+Run logs, Brain feedback, session auto-saves and traces used to open and
+append to their files synchronously on the query path. They now hand
+records to one :class:`LogSink`: a daemon thread groups queued records per
+file and appends each group with a single write, every ``flush_interval``
+seconds, when ``batch_size`` records are pending, on :meth:`flush` and at
+interpreter exit. No fsync is issued; queries never wait on the disk.
+
+Files are rotated by size (``RAG_LOG_MAX_BYTES``, default 50 MB; 0 turns it
+off) keeping ``RAG_LOG_BACKUPS`` generations named ``<stem>.<n><suffix>``
+(``rag_runs.1.jsonl``), so globs like ``traces_*.jsonl`` still match them.
+When the queue is full, records are dropped and counted rather than
+blocking a query.
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import queue
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+Record = Union[str, Dict[str, Any]]
+
+
+class LogSink:
+    """Queue + writer thread; ``write(path, record)`` returns immediately."""
+
+    def __init__(self,
+                 flush_interval: float = 1.0,
+                 batch_size: int = 256,
+                 max_queue: int = 50000,
+                 max_bytes: int = 50 * 1024 * 1024,
+                 backups: int = 5) -> None:
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.max_bytes = max_bytes
+        self.backups = max(1, backups)
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self._dirs: Set[Path] = set()
+        self._warned = False
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._loop, name="rag-log-sink", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def write(self, path: Path, record: Record) -> None:
+        """Queue one JSONL record (dict or pre-serialized line) for ``path``."""
+        self.write_many(path, [record])
+
+    def write_many(self, path: Path, records: Iterable[Record]) -> None:
+        lines = [r if isinstance(r, str) else json.dumps(r, ensure_ascii=False) for r in records]
+        if not lines:
+            return
+        try:
+            self._queue.put_nowait((Path(path), lines))
+        except queue.Full:
+            self.dropped += len(lines)
+            if not self._warned:
+                print("⚠️  Log sink queue full; dropping log records")
+                self._warned = True
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Block until everything queued so far has been appended."""
+        if not self._thread.is_alive():
+            return
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    # ------------------------------------------------------------------
+    def _loop(self) -> None:
+        pending: Dict[Path, List[str]] = {}
+        count = 0
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            if isinstance(item, tuple):
+                path, lines = item
+                pending.setdefault(path, []).extend(lines)
+                count += len(lines)
+                if count < self.batch_size:
+                    continue
+            self._drain(pending)
+            pending, count = {}, 0
+            if isinstance(item, threading.Event):
+                item.set()
+
+    def _drain(self, pending: Dict[Path, List[str]]) -> None:
+        for path, lines in pending.items():
+            try:
+                self._append(path, lines)
+                self.written += len(lines)
+            except Exception as exc:
+                print(f"⚠️  Failed to write {path.name}: {exc}")
+
+    def _append(self, path: Path, lines: List[str]) -> None:
+        if path.parent not in self._dirs:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._dirs.add(path.parent)
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        if self.max_bytes:
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                size = 0
+            if size and size + len(data) > self.max_bytes:
+                self._rotate(path)
+        with open(path, "ab") as fh:
+            fh.write(data)
+
+    def _rotate(self, path: Path) -> None:
+        def backup(n: int) -> Path:
+            return path.with_name(f"{path.stem}.{n}{path.suffix}")
+
+        backup(self.backups).unlink(missing_ok=True)
+        for n in range(self.backups - 1, 0, -1):
+            if backup(n).exists():
+                os.replace(backup(n), backup(n + 1))
+        os.replace(path, backup(1))
+        self.rotations += 1
+
+
+def rotated_files(path: Path) -> List[Path]:
+    """``path`` and its rotated backups, oldest first (for readers)."""
+    path = Path(path)
+    backups: List[Tuple[int, Path]] = []
+    for candidate in path.parent.glob(f"{path.stem}.*{path.suffix}"):
+        middle = candidate.name[len(path.stem) + 1:len(candidate.name) - len(path.suffix)]
+        if middle.isdigit():
+            backups.append((int(middle), candidate))
+    ordered = [p for _, p in sorted(backups, reverse=True)]
+    return ordered + ([path] if path.exists() else [])
+
+
+_global_sink: Optional[LogSink] = None
+_global_lock = threading.Lock()
+
+
+def get_log_sink() -> LogSink:
+    """Process-wide sink (settings from RAG_LOG_* env vars)."""
+    global _global_sink
+    with _global_lock:
+        if _global_sink is None:
+            _global_sink = LogSink(
+                flush_interval=float(os.getenv("RAG_LOG_FLUSH_SEC", "1.0")),
+                batch_size=int(os.getenv("RAG_LOG_BATCH", "256")),
+                max_bytes=int(os.getenv("RAG_LOG_MAX_BYTES", str(50 * 1024 * 1024))),
+                backups=int(os.getenv("RAG_LOG_BACKUPS", "5")),
+            )
+        return _global_sink
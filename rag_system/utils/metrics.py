@@ -0,0 +1,426 @@
+"""In-process metrics registry: counters and streaming latency histograms.
+
+Histograms are log-bucketed sketches (DDSketch-style, the same idea as HDR
+histograms): every value lands in bucket ``ceil(log_gamma(v))``, so any
+quantile is answered from the buckets with a bounded relative error
+(``RAG_METRICS_RELATIVE_ACCURACY``, default 1%) and memory that depends on
+the value range, not on the number of observations. Sketches merge by
+adding bucket counts, which is what makes per-process snapshots cheap to
+combine.
+
+Each process periodically writes its registry to
+``<metrics_dir>/registry_<pid>_<nonce>.json`` (atomic replace, never
+read-modify-write; the nonce keeps a recycled PID from overwriting a dead
+process's file); readers merge the files. Snapshots of processes that
+are gone are folded into ``registry_archive.json`` by :meth:`SnapshotStore.compact`.
+
+Exposed as Prometheus text (``/metrics`` via :func:`start_http_server`, the
+API server, ``rag metrics --prometheus``).
+"""
+
+from __future__ import annotations
+
+import atexit
+import contextlib
+import fcntl
+import json
+import math
+import os
+import secrets
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+DEFAULT_RELATIVE_ACCURACY = float(os.getenv("RAG_METRICS_RELATIVE_ACCURACY", "0.01"))
+SUMMARY_QUANTILES = (0.5, 0.95, 0.99)
+# Per-process nonce for snapshot file names, keyed by PID (forks get their own)
+_PROCESS_NONCES: Dict[int, str] = {}
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((str(k), str(v)) for k, v in labels.items() if v is not None))
+
+
+class LogHistogram:
+    """Mergeable quantile sketch with relative accuracy ``alpha``."""
+
+    def __init__(self, alpha: float = DEFAULT_RELATIVE_ACCURACY) -> None:
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float) -> None:
+        value = float(value)
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if value <= 0:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return max(0.0, self.min)
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                estimate = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def merge(self, other: "LogHistogram") -> None:
+        for index, n in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + n
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "alpha": self.alpha,
+            "buckets": {str(k): v for k, v in self.buckets.items()},
+            "zero": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LogHistogram":
+        hist = cls(float(data.get("alpha", DEFAULT_RELATIVE_ACCURACY)))
+        hist.buckets = {int(k): int(v) for k, v in (data.get("buckets") or {}).items()}
+        hist.zero_count = int(data.get("zero", 0))
+        hist.count = int(data.get("count", 0))
+        hist.sum = float(data.get("sum", 0.0))
+        hist.min = float(data["min"]) if data.get("min") is not None else math.inf
+        hist.max = float(data["max"]) if data.get("max") is not None else -math.inf
+        return hist
+
+
+class MetricsRegistry:
+    """Labelled counters and histograms behind a single lock."""
+
+    def __init__(self, alpha: float = DEFAULT_RELATIVE_ACCURACY) -> None:
+        self.alpha = alpha
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, LogHistogram]] = {}
+        self._help: Dict[str, str] = {}
+
+    # -- recording -------------------------------------------------------
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1.0, **labels: object) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: object) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = LogHistogram(self.alpha)
+            hist.observe(value)
+
+    # -- reading ---------------------------------------------------------
+    def counter(self, name: str, **match: object) -> float:
+        """Sum of a counter over the series whose labels include ``match``."""
+        want = set(_labels(match))
+        with self._lock:
+            return sum(v for k, v in self._counters.get(name, {}).items() if want <= set(k))
+
+    def counter_by(self, name: str, label: str) -> Dict[str, float]:
+        out: Dict[str, float] = {}
+        with self._lock:
+            for key, value in self._counters.get(name, {}).items():
+                group = dict(key).get(label, "")
+                out[group] = out.get(group, 0.0) + value
+        return out
+
+    def histogram(self, name: str, **match: object) -> LogHistogram:
+        """Merged sketch over the series whose labels include ``match``."""
+        want = set(_labels(match))
+        merged = LogHistogram(self.alpha)
+        with self._lock:
+            for key, hist in self._histograms.get(name, {}).items():
+                if want <= set(key):
+                    merged.merge(hist)
+        return merged
+
+    def histogram_by(self, name: str, label: str) -> Dict[str, LogHistogram]:
+        out: Dict[str, LogHistogram] = {}
+        with self._lock:
+            for key, hist in self._histograms.get(name, {}).items():
+                group = dict(key).get(label, "")
+                out.setdefault(group, LogHistogram(self.alpha)).merge(hist)
+        return out
+
+    # -- snapshots -------------------------------------------------------
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "started_at": self.started_at,
+                "updated_at": time.time(),
+                "counters": {
+                    name: [[dict(k), v] for k, v in series.items()]
+                    for name, series in self._counters.items()
+                },
+                "histograms": {
+                    name: [[dict(k), h.to_dict()] for k, h in series.items()]
+                    for name, series in self._histograms.items()
+                },
+            }
+
+    def merge_snapshot(self, data: Dict) -> None:
+        with self._lock:
+            for name, series in (data.get("counters") or {}).items():
+                target = self._counters.setdefault(name, {})
+                for labels, value in series:
+                    key = _labels(labels)
+                    target[key] = target.get(key, 0.0) + float(value)
+            for name, series in (data.get("histograms") or {}).items():
+                target_h = self._histograms.setdefault(name, {})
+                for labels, hist_data in series:
+                    key = _labels(labels)
+                    hist = LogHistogram.from_dict(hist_data)
+                    if key in target_h:
+                        target_h[key].merge(hist)
+                    else:
+                        target_h[key] = hist
+
+    def merge(self, other: "MetricsRegistry") -> None:
+        self.merge_snapshot(other.snapshot())
+
+    # -- exposition ------------------------------------------------------
+    def to_prometheus(self, prefix: str = "") -> str:
+        """Prometheus text format: counters, histograms as summaries."""
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted(self._counters):
+                metric = _prom_name(prefix + name)
+                if name in self._help:
+                    lines.append(f"# HELP {metric} {self._help[name]}")
+                lines.append(f"# TYPE {metric} counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{metric}{_prom_labels(key)} {_prom_value(value)}")
+            for name in sorted(self._histograms):
+                metric = _prom_name(prefix + name)
+                if name in self._help:
+                    lines.append(f"# HELP {metric} {self._help[name]}")
+                lines.append(f"# TYPE {metric} summary")
+                for key, hist in sorted(self._histograms[name].items()):
+                    for q in SUMMARY_QUANTILES:
+                        lines.append(f"{metric}{_prom_labels(key + (('quantile', str(q)),))} "
+                                     f"{_prom_value(hist.quantile(q))}")
+                    lines.append(f"{metric}_sum{_prom_labels(key)} {_prom_value(hist.sum)}")
+                    lines.append(f"{metric}_count{_prom_labels(key)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _prom_name(name: str) -> str:
+    return "".join(c if c.isalnum() or c in "_:" else "_" for c in name)
+
+
+def _prom_labels(key: Iterable[Tuple[str, str]]) -> str:
+    items = list(key)
+    if not items:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{_prom_name(k)}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def _prom_value(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class SnapshotStore:
+    """Per-process registry files under one directory, merged on read."""
+
+    ARCHIVE = "registry_archive.json"
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        pid = os.getpid()
+        nonce = _PROCESS_NONCES.setdefault(pid, secrets.token_hex(4))
+        self.path = self.directory / f"registry_{pid}_{nonce}.json"
+
+    def save(self, registry: MetricsRegistry) -> None:
+        atomic_write(self.path, json.dumps(registry.snapshot()))
+
+    def load_merged(self, include_self: bool = True) -> MetricsRegistry:
+        merged = MetricsRegistry()
+        for path in sorted(self.directory.glob("registry_*.json")):
+            if not include_self and path == self.path:
+                continue
+            data = _read_json(path)
+            if data:
+                merged.merge_snapshot(data)
+        return merged
+
+    def compact(self, extra: Optional[Dict] = None) -> int:
+        """Fold snapshots of dead processes (and an ``extra`` snapshot, e.g.
+        imported history) into the archive; returns #folded."""
+        lock_path = self.directory / ".compact.lock"
+        with open(lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = self.directory / self.ARCHIVE
+            archive = MetricsRegistry()
+            archived = _read_json(archive_path)
+            if archived:
+                archive.merge_snapshot(archived)
+            if extra:
+                archive.merge_snapshot(extra)
+            folded: List[Path] = []
+            for path in self.directory.glob("registry_*.json"):
+                if path.name == self.ARCHIVE:
+                    continue
+                try:
+                    pid = int(path.stem.split("_")[1])
+                except ValueError:
+                    continue
+                # Another file with our PID was left by a dead process whose
+                # PID got recycled: fold it like any other dead snapshot
+                if path == self.path or (pid != os.getpid() and _pid_alive(pid)):
+                    continue
+                data = _read_json(path)
+                if data:
+                    archive.merge_snapshot(data)
+                folded.append(path)
+            if folded or extra:
+                atomic_write(archive_path, json.dumps(archive.snapshot()))
+                for path in folded:
+                    path.unlink(missing_ok=True)
+            return len(folded)
+
+
+def atomic_write(path: Path, text: str) -> None:
+    """Replace ``path`` via a uniquely named temp file in the same directory,
+    so concurrent writers (threads or processes) never share a temp file."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
+
+
+def _read_json(path: Path) -> Optional[Dict]:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SnapshotFlusher:
+    """Save the registry every ``interval`` seconds and at exit (daemon thread)."""
+
+    def __init__(self, registry: MetricsRegistry, store: SnapshotStore,
+                 interval: float = 10.0, on_flush=None) -> None:
+        self.registry = registry
+        self.store = store
+        self.interval = interval
+        self.on_flush = on_flush
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="rag-metrics-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def flush(self) -> None:
+        try:
+            self.store.save(self.registry)
+            if self.on_flush is not None:
+                self.on_flush()
+        except Exception as exc:
+            print(f"⚠️  Failed to save metrics snapshot: {exc}")
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+
+def start_http_server(port: int, registry: Optional[MetricsRegistry] = None,
+                      host: str = "127.0.0.1", render=None) -> ThreadingHTTPServer:
+    """Serve ``/metrics`` (Prometheus text) from a daemon thread."""
+
+    registry = registry or get_registry()
+    render = render or registry.to_prometheus
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):  # noqa: N802 (http.server API)
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            return
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="rag-metrics-http", daemon=True).start()
+    return server
+
+
+_global_registry: Optional[MetricsRegistry] = None
+_global_lock = threading.Lock()
+
+
+def get_registry() -> MetricsRegistry:
+    """Process-wide registry shared by the tracer, monitor and LLM gateway."""
+    global _global_registry
+    with _global_lock:
+        if _global_registry is None:
+            _global_registry = MetricsRegistry()
+        return _global_registry
@@ -3,13 +3,24 @@
 from __future__ import annotations
 
 import json
+import os
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional
+
+from rag_system.utils.log_sink import get_log_sink
+from rag_system.utils.metrics import (
+    LogHistogram,
+    MetricsRegistry,
+    SnapshotFlusher,
+    SnapshotStore,
+    atomic_write,
+    get_registry,
+)
 
 
 class RAGMonitor:
-    """Append query runs to jsonl logs and maintain aggregated metrics."""
+    """Append query runs to jsonl logs and feed the aggregated metrics registry."""
 
     def __init__(self, project_name: str, logs_dir: Path) -> None:
         self.project_name = project_name
@@ -17,6 +28,24 @@ class RAGMonitor:
         self.logs_dir.mkdir(parents=True, exist_ok=True)
         self.log_file = self.logs_dir / "rag_runs.jsonl"
         self.metrics_file = self.logs_dir / "rag_metrics.json"
+        self.sink = get_log_sink()
+        # Aggregates live in the process-wide registry; each process snapshots
+        # its own file and rag_metrics.json is rebuilt from all of them, so
+        # concurrent processes never lose each other's updates
+        self.registry = get_registry()
+        self.store = SnapshotStore(self.logs_dir / "metrics")
+        try:
+            # Fold snapshots of finished processes (and, once, the totals of a
+            # pre-registry rag_metrics.json) into the archive
+            self.store.compact(extra=self._claim_legacy_metrics())
+        except OSError:
+            pass
+        self.flusher = SnapshotFlusher(
+            self.registry,
+            self.store,
+            interval=float(os.getenv("RAG_METRICS_FLUSH_SEC", "10")),
+            on_flush=self._write_metrics_view,
+        )
 
     def log_run(self, run_data: Dict[str, Any]) -> None:
         """Append a run entry and update aggregate metrics."""
@@ -32,63 +61,160 @@ class RAGMonitor:
             "confidence": float(run_data.get("confidence", 0.0)),
             "elapsed_sec": float(run_data.get("elapsed_sec", 0.0)),
             "cache_hit": bool(run_data.get("from_cache", False)),
+            "near_duplicates_removed": int(run_data.get("near_duplicates_removed", 0)),
         }
+        # Inputs for the offline strategy fit (rag optimize)
+        for key in ("base_strategy", "strategy_overrides", "agent_contrib"):
+            if run_data.get(key):
+                entry[key] = run_data[key]
+        # LLM accounting from the gateway (tokens, cost, latency per stage)
+        if run_data.get("llm"):
+            entry["llm"] = run_data["llm"]
 
-        with self.log_file.open("a", encoding="utf-8") as fh:
-            fh.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        # Appended by the background sink (batched, rotated by size)
+        self.sink.write(self.log_file, entry)
 
         self._update_metrics(entry)
 
+    def load_metrics(self) -> Dict[str, Any]:
+        """Aggregated metrics across processes (persisted snapshots + this one)."""
+
+        merged = self.store.load_merged(include_self=False)
+        merged.merge(self.registry)
+        return metrics_view(merged)
+
     # ------------------------------------------------------------------
     def _update_metrics(self, entry: Dict[str, Any]) -> None:
-        metrics = self._load_metrics()
-        metrics["total_runs"] += 1
-        metrics["cache_hits"] += 1 if entry["cache_hit"] else 0
-        metrics["sum_confidence"] += entry["confidence"]
-        metrics["sum_elapsed_sec"] += entry["elapsed_sec"]
-        metrics["sum_context_chars"] += entry["context_chars"]
-
-        total = metrics["total_runs"] or 1
-        metrics["avg_confidence"] = round(metrics["sum_confidence"] / total, 2)
-        metrics["avg_elapsed_sec"] = round(metrics["sum_elapsed_sec"] / total, 2)
-        metrics["avg_context_chars"] = int(metrics["sum_context_chars"] / total)
-        metrics["cache_hit_rate"] = round(
-            metrics["cache_hits"] / total, 2
-        )
-        metrics["updated_at"] = datetime.utcnow().isoformat() + "Z"
+        # O(1) in-memory update; snapshots are written by the flusher thread
+        cache = "hit" if entry["cache_hit"] else "miss"
+        intent = entry["intent"]
+        self.registry.inc("rag_runs_total", intent=intent, cache=cache)
+        self.registry.observe("rag_run_elapsed_seconds", entry["elapsed_sec"], intent=intent, cache=cache)
+        self.registry.observe("rag_run_confidence", entry["confidence"], intent=intent)
+        self.registry.inc("rag_context_chars_total", entry["context_chars"], intent=intent)
 
-        self.metrics_file.write_text(
-            json.dumps(metrics, ensure_ascii=False, indent=2),
-            encoding="utf-8",
-        )
+    def _write_metrics_view(self) -> None:
+        """Rewrite rag_metrics.json from the merged snapshots (atomic replace)."""
+
+        metrics = metrics_view(self.store.load_merged())
+        atomic_write(self.metrics_file, json.dumps(metrics, ensure_ascii=False, indent=2))
+
+    def _claim_legacy_metrics(self) -> Optional[Dict[str, Any]]:
+        """Registry snapshot of an old cumulative rag_metrics.json, or None.
+
+        The file is renamed to ``rag_metrics.legacy.json`` first; the rename
+        is atomic, so exactly one process imports it.
+        """
+        try:
+            data = json.loads(self.metrics_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or "sum_confidence" not in data:
+            return None  # already the merged view
+        claimed = self.metrics_file.with_name("rag_metrics.legacy.json")
+        try:
+            os.rename(self.metrics_file, claimed)
+            data = json.loads(claimed.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if "sum_confidence" not in data:
+            return None
+        return legacy_snapshot(data, self.registry.alpha)
 
-    def _load_metrics(self) -> Dict[str, Any]:
-        if self.metrics_file.exists():
-            try:
-                data = json.loads(self.metrics_file.read_text(encoding="utf-8"))
-                # Ensure required keys exist
-                for key in (
-                    "total_runs",
-                    "cache_hits",
-                    "sum_confidence",
-                    "sum_elapsed_sec",
-                    "sum_context_chars",
-                ):
-                    data.setdefault(key, 0)
-                return data
-            except Exception:
-                pass
-
-        return {
-            "total_runs": 0,
-            "cache_hits": 0,
-            "sum_confidence": 0.0,
-            "sum_elapsed_sec": 0.0,
-            "sum_context_chars": 0,
-            "avg_confidence": 0.0,
-            "avg_elapsed_sec": 0.0,
-            "avg_context_chars": 0,
-            "cache_hit_rate": 0.0,
-            "updated_at": datetime.utcnow().isoformat() + "Z",
+
+def metrics_view(registry: MetricsRegistry) -> Dict[str, Any]:
+    """Aggregate dict in the rag_metrics.json shape, computed from a registry."""
+
+    total = int(registry.counter("rag_runs_total"))
+    hits = int(registry.counter("rag_runs_total", cache="hit"))
+    misses = total - hits
+    elapsed = registry.histogram("rag_run_elapsed_seconds")
+    hit_elapsed = registry.histogram("rag_run_elapsed_seconds", cache="hit")
+    miss_elapsed = registry.histogram("rag_run_elapsed_seconds", cache="miss")
+    confidence = registry.histogram("rag_run_confidence")
+    llm_cost = registry.counter("rag_llm_cost_usd_total")
+
+    by_stage: Dict[str, Dict[str, Any]] = {}
+    calls = registry.counter_by("rag_llm_calls_total", "stage")
+    cost = registry.counter_by("rag_llm_cost_usd_total", "stage")
+    latency = registry.histogram_by("rag_llm_call_latency_ms", "stage")
+    for stage in sorted(calls):
+        hist = latency.get(stage)
+        by_stage[stage] = {
+            "calls": int(calls[stage]),
+            "input_tokens": int(registry.counter("rag_llm_tokens_total", stage=stage, type="input")),
+            "output_tokens": int(registry.counter("rag_llm_tokens_total", stage=stage, type="output")),
+            "cost_usd": round(cost.get(stage, 0.0), 6),
+            "avg_latency_ms": round(hist.mean, 2) if hist else 0.0,
+            "p95_latency_ms": round(hist.quantile(0.95), 2) if hist else 0.0,
         }
 
+    return {
+        "total_runs": total,
+        "cache_hits": hits,
+        "cache_hit_rate": round(hits / total, 2) if total else 0.0,
+        "avg_confidence": round(confidence.mean, 2),
+        "avg_elapsed_sec": round(elapsed.mean, 2),
+        "avg_context_chars": int(registry.counter("rag_context_chars_total") / total) if total else 0,
+        "avg_cache_hit_ms": round(hit_elapsed.mean * 1000, 2),
+        "avg_miss_elapsed_sec": round(miss_elapsed.mean, 2),
+        "p50_miss_elapsed_sec": round(miss_elapsed.quantile(0.5), 2),
+        "p95_miss_elapsed_sec": round(miss_elapsed.quantile(0.95), 2),
+        "llm_calls": int(registry.counter("rag_llm_calls_total")),
+        "llm_errors": int(registry.counter("rag_llm_errors_total")),
+        "llm_retries": int(registry.counter("rag_llm_retries_total")),
+        "sum_llm_input_tokens": int(registry.counter("rag_llm_tokens_total", type="input")),
+        "sum_llm_output_tokens": int(registry.counter("rag_llm_tokens_total", type="output")),
+        "sum_llm_cached_tokens": int(registry.counter("rag_llm_tokens_total", type="cached")),
+        "sum_llm_cost_usd": round(llm_cost, 6),
+        "avg_llm_cost_usd": round(llm_cost / misses, 6) if misses else 0.0,
+        "llm_by_stage": by_stage,
+        "updated_at": datetime.utcnow().isoformat() + "Z",
+    }
+
+
+def _bulk_histogram(count: int, total: float, alpha: float) -> LogHistogram:
+    """``count`` observations summing to ``total``, all at their mean (the
+    old file kept sums only, so there is no distribution to restore)."""
+    hist = LogHistogram(alpha)
+    if count <= 0:
+        return hist
+    hist.observe(total / count)
+    for index in hist.buckets:
+        hist.buckets[index] = count
+    hist.zero_count *= count
+    hist.count, hist.sum = count, float(total)
+    return hist
+
+
+def legacy_snapshot(data: Dict[str, Any], alpha: float) -> Dict[str, Any]:
+    """Registry snapshot carrying the totals of a pre-registry rag_metrics.json.
+
+    That file kept run and cache-hit counts plus sums of confidence, elapsed
+    time and context size. Counters are exact; the elapsed/confidence
+    histograms keep count and mean (quantiles of that history collapse onto
+    the mean). The elapsed sum covered hits and misses alike, so it is
+    labelled ``cache="unknown"``. Series are labelled ``intent="legacy"``.
+    """
+    registry = MetricsRegistry(alpha)
+    total = int(data.get("total_runs", 0))
+    hits = min(int(data.get("cache_hits", 0)), total)
+    registry.inc("rag_runs_total", hits, intent="legacy", cache="hit")
+    registry.inc("rag_runs_total", total - hits, intent="legacy", cache="miss")
+    registry.inc("rag_context_chars_total", float(data.get("sum_context_chars", 0)), intent="legacy")
+    histograms = {
+        ("rag_run_elapsed_seconds", (("cache", "unknown"), ("intent", "legacy"))):
+            _bulk_histogram(total, float(data.get("sum_elapsed_sec", 0.0)), alpha),
+        ("rag_run_confidence", (("intent", "legacy"),)):
+            _bulk_histogram(total, float(data.get("sum_confidence", 0.0)), alpha),
+    }
+
+    snapshot = registry.snapshot()
+    snapshot["counters"] = {
+        name: [[labels, value] for labels, value in series if value]
+        for name, series in snapshot["counters"].items()
+    }
+    for (name, labels), hist in histograms.items():
+        if hist.count:
+            snapshot["histograms"].setdefault(name, []).append([dict(labels), hist.to_dict()])
+    return snapshot
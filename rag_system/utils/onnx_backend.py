@@ -0,0 +1,231 @@
+"""Optional ONNX Runtime backend for the embedder and the cross-encoder.
+
+``RAG_INFERENCE_BACKEND=onnx`` swaps the PyTorch ``SentenceTransformer`` /
+``CrossEncoder`` for ONNX Runtime sessions over the same Hugging Face
+checkpoints. The model is exported once, quantized to int8 (dynamic,
+``RAG_ONNX_QUANTIZE=0`` keeps fp32) and cached under
+``~/.rag_cache/onnx/<model>/``. Sessions use a fixed intra-op thread count
+(``RAG_ONNX_THREADS``) and inputs go through the shared length-bucketed
+batching, so each batch is padded only to its own longest sequence.
+
+The wrappers expose the subset of the sentence-transformers API the
+pipeline uses (``encode`` / ``predict``), so callers don't change. Any
+failure (missing ``onnxruntime``, export error) falls back to PyTorch.
+"""
+
+from __future__ import annotations
+
+import abc
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+
+from rag_system.config.settings import settings
+from rag_system.utils.batching import run_bucketed, token_lengths
+
+DEFAULT_BATCH_SIZE = 32
+
+
+def inference_backend() -> str:
+    return os.getenv("RAG_INFERENCE_BACKEND", "torch").lower()
+
+
+def default_threads() -> int:
+    return int(os.getenv("RAG_ONNX_THREADS", str(min(4, os.cpu_count() or 1))))
+
+
+def _model_dir(model_name: str) -> Path:
+    return settings.CACHE_DIR / "onnx" / model_name.replace("/", "__")
+
+
+def _export(model_name: str, kind: str, quantize: bool) -> Path:
+    """Export ``model_name`` to ONNX (and int8) once; returns the model path."""
+
+    out_dir = _model_dir(model_name)
+    fp32_path = out_dir / "model.onnx"
+    int8_path = out_dir / "model.int8.onnx"
+    target = int8_path if quantize else fp32_path
+    if target.exists():
+        return target
+
+    import torch
+    from transformers import AutoModel, AutoModelForSequenceClassification, AutoTokenizer
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if not fp32_path.exists():
+        print(f"  📦 Exporting {model_name} to ONNX...")
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        loader = AutoModelForSequenceClassification if kind == "cross-encoder" else AutoModel
+        model = loader.from_pretrained(model_name).eval()
+        sample = tokenizer(["query", "document text"], padding=True, return_tensors="pt")
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+        output_name = "logits" if kind == "cross-encoder" else "last_hidden_state"
+        dynamic = {name: {0: "batch", 1: "seq"} for name in input_names}
+        dynamic[output_name] = {0: "batch", 1: "seq"} if kind != "cross-encoder" else {0: "batch"}
+        tmp = fp32_path.with_suffix(".onnx.tmp")
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(sample[name] for name in input_names),
+                str(tmp),
+                input_names=input_names,
+                output_names=[output_name],
+                dynamic_axes=dynamic,
+                opset_version=14,
+            )
+        os.replace(tmp, fp32_path)
+        tokenizer.save_pretrained(str(out_dir))
+        model.config.save_pretrained(str(out_dir))
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        print("  🔢 Quantizing to int8 (dynamic)...")
+        tmp = int8_path.with_suffix(".onnx.tmp")
+        quantize_dynamic(str(fp32_path), str(tmp), weight_type=QuantType.QInt8)
+        os.replace(tmp, int8_path)
+    return target
+
+
+class _OnnxModel(abc.ABC):
+    """Tokenizer + InferenceSession with length-bucketed batching."""
+
+    kind = ""
+    max_length = 256
+
+    def __init__(self,
+                 model_name: str,
+                 threads: Optional[int] = None,
+                 quantize: Optional[bool] = None,
+                 max_length: Optional[int] = None) -> None:
+        import onnxruntime as ort
+        from transformers import AutoConfig, AutoTokenizer
+
+        if quantize is None:
+            quantize = os.getenv("RAG_ONNX_QUANTIZE", "1") == "1"
+        self.model_name = model_name
+        self.quantized = quantize
+        self.threads = threads or default_threads()
+        self.max_length = max_length or self.max_length
+        path = _export(model_name, self.kind, quantize)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(str(path.parent))
+        self.config = AutoConfig.from_pretrained(str(path.parent))
+
+    def _run_batches(self, texts, batch_size: int) -> List[np.ndarray]:
+        """Run ``texts`` (str or (a, b) pairs) in length buckets; outputs in input order."""
+
+        lengths = token_lengths(texts, self.tokenizer, self.max_length)
+        outputs, _ = run_bucketed(texts, self._run_batch, lengths, max_batch=batch_size)
+        return outputs
+
+    def _run_batch(self, batch) -> np.ndarray:
+        if isinstance(batch[0], str):
+            enc = self.tokenizer(batch, padding="longest", truncation=True,
+                                 max_length=self.max_length, return_tensors="np")
+        else:
+            enc = self.tokenizer([a for a, _ in batch], [b for _, b in batch],
+                                 padding="longest", truncation="longest_first",
+                                 max_length=self.max_length, return_tensors="np")
+        feeds = {name: enc[name].astype(np.int64) for name in self.input_names if name in enc}
+        return self._postprocess(self.session.run(None, feeds)[0], enc["attention_mask"])
+
+    @abc.abstractmethod
+    def _postprocess(self, output: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """Turn the raw session output into embeddings/scores."""
+
+
+class OnnxEncoder(_OnnxModel):
+    """Drop-in for ``SentenceTransformer.encode`` (mean pooling + L2 norm)."""
+
+    kind = "embedder"
+    max_length = 256  # all-MiniLM-L6-v2 max_seq_length
+
+    def encode(self,
+               sentences: Union[str, Sequence[str]],
+               batch_size: int = DEFAULT_BATCH_SIZE,
+               convert_to_numpy: bool = True,
+               show_progress_bar: bool = False,
+               normalize_embeddings: bool = True) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        vectors = np.stack(self._run_batches(texts, batch_size))
+        if normalize_embeddings:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.clip(norms, 1e-12, None)
+        return vectors[0] if single else vectors
+
+    def _postprocess(self, output: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        mask = attention_mask[..., None].astype(np.float32)
+        return (output * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+
+class OnnxCrossEncoder(_OnnxModel):
+    """Drop-in for ``CrossEncoder.predict`` (same activation as the checkpoint)."""
+
+    kind = "cross-encoder"
+    max_length = 512
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        activation = getattr(self.config, "sbert_ce_default_activation_function", None) or ""
+        # sentence-transformers applies a sigmoid to single-label heads unless
+        # the checkpoint declares another activation (MS MARCO ones: Identity)
+        self.sigmoid = self.config.num_labels == 1 and "Identity" not in activation
+
+    def predict(self,
+                sentences: Sequence[Sequence[str]],
+                batch_size: int = DEFAULT_BATCH_SIZE,
+                show_progress_bar: bool = False,
+                convert_to_numpy: bool = True) -> np.ndarray:
+        pairs = [(str(a), str(b)) for a, b in sentences]
+        if not pairs:
+            return np.zeros((0,), dtype=np.float32)
+        scores = np.stack(self._run_batches(pairs, batch_size))
+        if self.sigmoid:
+            scores = 1.0 / (1.0 + np.exp(-scores))
+        return scores[:, 0] if scores.shape[1] == 1 else scores
+
+    def _postprocess(self, output: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        return output
+
+
+def load_embedder(model_name: str, backend: Optional[str] = None):
+    """SentenceTransformer or OnnxEncoder depending on RAG_INFERENCE_BACKEND."""
+
+    if (backend or inference_backend()) == "onnx":
+        try:
+            model = OnnxEncoder(model_name)
+            print(f"  ⚙️  ONNX embedder ({'int8' if model.quantized else 'fp32'}, {model.threads} threads)")
+            return model
+        except Exception as exc:
+            print(f"  ⚠️  ONNX embedder unavailable ({exc}); using PyTorch")
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_name)
+
+
+def load_cross_encoder(model_name: str, backend: Optional[str] = None):
+    """CrossEncoder or OnnxCrossEncoder depending on RAG_INFERENCE_BACKEND."""
+
+    if (backend or inference_backend()) == "onnx":
+        try:
+            model = OnnxCrossEncoder(model_name)
+            print(f"  ⚙️  ONNX cross-encoder ({'int8' if model.quantized else 'fp32'}, {model.threads} threads)")
+            return model
+        except Exception as exc:
+            print(f"  ⚠️  ONNX cross-encoder unavailable ({exc}); using PyTorch")
+    from sentence_transformers import CrossEncoder
+
+    return CrossEncoder(model_name)
@@ -0,0 +1,311 @@
+"""OTLP/JSON export for RAG traces and metrics.
+
+Converts the tracer's finished traces into OpenTelemetry protocol payloads
+(``ExportTraceServiceRequest`` / ``ExportMetricsServiceRequest``, JSON
+encoding) so query latency can be inspected as flame graphs in standard
+tooling (Jaeger, Tempo, an OpenTelemetry Collector...). No SDK needed:
+payloads are plain dicts, posted with urllib or appended to a file.
+
+Configuration (read by :func:`exporter_from_env`):
+
+- ``RAG_OTLP_ENDPOINT``: collector base URL, e.g. ``http://localhost:4318``
+  (``/v1/traces`` and ``/v1/metrics`` are appended);
+- ``RAG_OTLP_FILE``: JSONL file, one request per line (metrics go to the
+  same path with ``.metrics`` before the suffix);
+- ``RAG_OTLP_TIMEOUT_SEC``: HTTP timeout (default 2).
+
+Span names and attributes follow the pipeline: ``cache_lookup``,
+``agent.<name>``, ``rerank``, ``compression``, ``llm.<stage>``. LLM spans
+use the ``gen_ai.*`` semantic conventions; everything else is ``rag.*``.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+SCOPE_NAME = "rag_system"
+SCOPE_VERSION = "2.0"
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+AGGREGATION_TEMPORALITY_DELTA = 1
+# Query duration histogram bounds (ms)
+DURATION_BOUNDS_MS = [5, 25, 100, 250, 500, 1000, 2500, 5000, 10000, 20000, 40000]
+
+# Tracer attribute -> OTel semantic convention (LLM spans)
+GEN_AI_ATTRIBUTES = {
+    "model": "gen_ai.response.model",
+    "input_tokens": "gen_ai.usage.input_tokens",
+    "output_tokens": "gen_ai.usage.output_tokens",
+    "cache_read_tokens": "gen_ai.usage.cache_read_input_tokens",
+    "cache_write_tokens": "gen_ai.usage.cache_creation_input_tokens",
+}
+
+
+def _nanos(seconds: Optional[float]) -> str:
+    # int64 fields are strings in the OTLP JSON encoding
+    return str(int((seconds or 0.0) * 1e9))
+
+
+def any_value(value: Any) -> Dict[str, Any]:
+    """Python value -> OTLP AnyValue."""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, str):
+        return {"stringValue": value}
+    if isinstance(value, (list, tuple)) and all(isinstance(v, (str, int, float, bool)) for v in value):
+        return {"arrayValue": {"values": [any_value(v) for v in value]}}
+    return {"stringValue": json.dumps(value, ensure_ascii=False, default=str)}
+
+
+def key_values(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": k, "value": any_value(v)} for k, v in attributes.items() if v is not None]
+
+
+def _span_attributes(name: str, attributes: Dict[str, Any]) -> Dict[str, Any]:
+    if name.startswith("llm."):
+        out: Dict[str, Any] = {
+            "gen_ai.system": "anthropic",
+            "gen_ai.operation.name": "chat",
+            "rag.llm.stage": name[4:],
+        }
+        for key, value in attributes.items():
+            out[GEN_AI_ATTRIBUTES.get(key, f"rag.llm.{key}")] = value
+        if "model" in attributes:
+            out["gen_ai.request.model"] = attributes["model"]
+        return out
+    return {f"rag.{key}": value for key, value in attributes.items()}
+
+
+def _status(status: Optional[str], error: Optional[str]) -> Dict[str, Any]:
+    if status == "error" or (error and status not in ("ok", "cancelled")):
+        return {"code": STATUS_ERROR, "message": (error or "")[:500]}
+    if status == "cancelled":
+        return {"code": STATUS_UNSET, "message": "cancelled"}
+    return {"code": STATUS_OK}
+
+
+def trace_to_spans(trace: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One root span for the query plus one span per recorded stage."""
+    trace_id = trace.get("trace_id", "")
+    root_id = trace.get("span_id", "")
+    result = trace.get("result") or {}
+    root_attrs = {
+        "rag.query": trace.get("query", ""),
+        "rag.intent": result.get("intent"),
+        "rag.cache.hit": result.get("from_cache"),
+        "rag.shared": result.get("shared"),
+        "rag.docs.retrieved": result.get("retrieved_docs"),
+        "rag.docs.reranked": result.get("reranked_docs"),
+        "rag.context_chars": result.get("context_chars"),
+        "rag.confidence": result.get("confidence"),
+    }
+    root_attrs.update({f"rag.{k}": v for k, v in (trace.get("metadata") or {}).items()})
+    spans = [{
+        "traceId": trace_id,
+        "spanId": root_id,
+        "name": trace.get("operation", "rag_query"),
+        "kind": SPAN_KIND_SERVER,
+        "startTimeUnixNano": _nanos(trace.get("start_time")),
+        "endTimeUnixNano": _nanos(trace.get("end_time")),
+        "attributes": key_values(root_attrs),
+        "status": _status(trace.get("status"), trace.get("error")),
+    }]
+    for span in trace.get("spans", []):
+        name = span.get("name", "span")
+        item = {
+            "traceId": trace_id,
+            "spanId": span.get("span_id", ""),
+            "parentSpanId": span.get("parent_span_id") or root_id,
+            "name": name,
+            "kind": SPAN_KIND_CLIENT if name.startswith("llm.") else SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": _nanos(span.get("start_time")),
+            "endTimeUnixNano": _nanos(span.get("end_time")),
+            "attributes": key_values(_span_attributes(name, span.get("attributes") or {})),
+            "status": _status(span.get("status"), span.get("error")),
+        }
+        spans.append(item)
+    return spans
+
+
+def _resource(project: str) -> Dict[str, Any]:
+    return {"attributes": key_values({
+        "service.name": os.getenv("OTEL_SERVICE_NAME", "rag_system"),
+        "service.namespace": project,
+    })}
+
+
+def build_trace_request(traces: List[Dict[str, Any]], project: str) -> Dict[str, Any]:
+    spans = [span for trace in traces for span in trace_to_spans(trace)]
+    return {"resourceSpans": [{
+        "resource": _resource(project),
+        "scopeSpans": [{"scope": {"name": SCOPE_NAME, "version": SCOPE_VERSION}, "spans": spans}],
+    }]}
+
+
+def build_metrics_request(traces: List[Dict[str, Any]], project: str) -> Dict[str, Any]:
+    """Delta counters and a duration histogram over one batch of traces."""
+    if not traces:
+        return {"resourceMetrics": []}
+    start = _nanos(min(t.get("start_time", time.time()) for t in traces))
+    now = _nanos(time.time())
+
+    counters: Dict[str, Dict[tuple, float]] = {}
+
+    def add(metric: str, amount: float, **attrs: Any) -> None:
+        key = tuple(sorted((k, v) for k, v in attrs.items() if v is not None))
+        bucket = counters.setdefault(metric, {})
+        bucket[key] = bucket.get(key, 0) + amount
+
+    durations: Dict[tuple, List[float]] = {}
+    for trace in traces:
+        result = trace.get("result") or {}
+        intent = result.get("intent") or (trace.get("metadata") or {}).get("intent")
+        cache = "hit" if result.get("from_cache") else "miss"
+        add("rag.queries", 1, intent=intent, cache=cache, status=trace.get("status", "ok"))
+        durations.setdefault((("cache", cache), ("intent", intent)), []).append(trace.get("duration_ms", 0.0))
+        for span in trace.get("spans", []):
+            name = span.get("name", "")
+            attrs = span.get("attributes") or {}
+            if name.startswith("llm."):
+                stage, model = name[4:], attrs.get("model")
+                add("gen_ai.client.token.usage", attrs.get("input_tokens", 0), stage=stage, model=model, type="input")
+                add("gen_ai.client.token.usage", attrs.get("output_tokens", 0), stage=stage, model=model, type="output")
+                add("rag.llm.cost_usd", attrs.get("cost_usd", 0.0), stage=stage, model=model)
+                add("rag.llm.retries", attrs.get("retries", 0), stage=stage)
+            elif name.startswith("agent."):
+                add("rag.agent.docs", attrs.get("docs", 0), agent=attrs.get("agent"), status=span.get("status"))
+
+    metrics = []
+    for name, points in sorted(counters.items()):
+        is_int = name not in ("rag.llm.cost_usd",)
+        metrics.append({
+            "name": name,
+            "sum": {
+                "aggregationTemporality": AGGREGATION_TEMPORALITY_DELTA,
+                "isMonotonic": True,
+                "dataPoints": [
+                    dict({"attributes": key_values(dict(key)), "startTimeUnixNano": start, "timeUnixNano": now},
+                         **({"asInt": str(int(value))} if is_int else {"asDouble": float(value)}))
+                    for key, value in points.items()
+                ],
+            },
+        })
+    histogram_points = []
+    for key, values in durations.items():
+        counts = [0] * (len(DURATION_BOUNDS_MS) + 1)
+        for v in values:
+            counts[sum(1 for b in DURATION_BOUNDS_MS if v > b)] += 1
+        histogram_points.append({
+            "attributes": key_values(dict(key)),
+            "startTimeUnixNano": start,
+            "timeUnixNano": now,
+            "count": str(len(values)),
+            "sum": float(sum(values)),
+            "min": float(min(values)),
+            "max": float(max(values)),
+            "bucketCounts": [str(c) for c in counts],
+            "explicitBounds": [float(b) for b in DURATION_BOUNDS_MS],
+        })
+    metrics.append({
+        "name": "rag.query.duration",
+        "unit": "ms",
+        "histogram": {"aggregationTemporality": AGGREGATION_TEMPORALITY_DELTA, "dataPoints": histogram_points},
+    })
+    return {"resourceMetrics": [{
+        "resource": _resource(project),
+        "scopeMetrics": [{"scope": {"name": SCOPE_NAME, "version": SCOPE_VERSION}, "metrics": metrics}],
+    }]}
+
+
+class OTLPExporter:
+    """Send trace batches to an OTLP/HTTP collector and/or a JSONL file."""
+
+    def __init__(self,
+                 project: str,
+                 endpoint: Optional[str] = None,
+                 file_path: Optional[Path] = None,
+                 timeout: float = 2.0) -> None:
+        self.project = project
+        self.endpoint = endpoint.rstrip("/") if endpoint else None
+        self.file_path = Path(file_path) if file_path else None
+        self.timeout = timeout
+        self.exported = 0
+        self.failures = 0
+        self._warned = False
+
+    def export(self, traces: List[Dict[str, Any]]) -> None:
+        if not traces:
+            return
+        payloads = {
+            "traces": build_trace_request(traces, self.project),
+            "metrics": build_metrics_request(traces, self.project),
+        }
+        ok = True
+        if self.endpoint:
+            for signal, body in payloads.items():
+                ok = self._post(f"{self.endpoint}/v1/{signal}", body) and ok
+        if self.file_path:
+            ok = self._append(payloads) and ok
+        if ok:
+            self.exported += len(traces)
+
+    def _post(self, url: str, body: Dict[str, Any]) -> bool:
+        request = urllib.request.Request(
+            url,
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+            return True
+        except Exception as exc:
+            self._fail(f"{url}: {exc}")
+            return False
+
+    def _append(self, payloads: Dict[str, Dict[str, Any]]) -> bool:
+        metrics_path = self.file_path.with_name(f"{self.file_path.stem}.metrics{self.file_path.suffix or '.jsonl'}")
+        try:
+            self.file_path.parent.mkdir(parents=True, exist_ok=True)
+            for path, body in ((self.file_path, payloads["traces"]), (metrics_path, payloads["metrics"])):
+                with open(path, "a", encoding="utf-8") as fh:
+                    fh.write(json.dumps(body) + "\n")
+            return True
+        except OSError as exc:
+            self._fail(str(exc))
+            return False
+
+    def _fail(self, message: str) -> None:
+        self.failures += 1
+        if not self._warned:
+            print(f"⚠️  OTLP export failed ({message}); continuing without it")
+            self._warned = True
+
+
+def exporter_from_env(project: str) -> Optional[OTLPExporter]:
+    endpoint = os.getenv("RAG_OTLP_ENDPOINT")
+    file_path = os.getenv("RAG_OTLP_FILE")
+    if not endpoint and not file_path:
+        return None
+    return OTLPExporter(
+        project,
+        endpoint=endpoint,
+        file_path=Path(file_path) if file_path else None,
+        timeout=float(os.getenv("RAG_OTLP_TIMEOUT_SEC", "2")),
+    )
@@ -0,0 +1,304 @@
+"""Opt-in per-stage profiler for ``AdvancedRAGv2.query``.
+
+Enabled with ``RAG_PROFILE=1`` or ``rag profile "<query>"``. While a query
+runs under :func:`profiling`, every pipeline stage (each ``tracer.span``)
+records:
+
+- wall time and process CPU time (CPU/wall < 1 means the stage mostly
+  waited: network, disk, locks);
+- allocations via tracemalloc: net and peak bytes above the stage start.
+  It slows allocation-heavy Python code several-fold and inflates wall/CPU
+  accordingly; profile timings with ``RAG_PROFILE_TRACEMALLOC=0``;
+- optionally, a stack-sampling profile (``RAG_PROFILE_SAMPLE_MS``, default
+  5 ms, 0 = off): a thread samples every thread's stack, prefixes it with
+  the active stage and classifies it as ``inference`` (torch, ONNX
+  Runtime, sentence-transformers), ``io`` (sockets, HTTP, SQLite, Chroma,
+  subprocess), ``wait`` (blocked on locks/futures of other threads) or
+  ``python`` (our own code and pure-Python libraries).
+
+CPU time is process-wide for stages on the query's thread (so native
+intra-op threads of torch/ONNX count) and per-thread for stages opened in
+worker threads (agents), which would otherwise double count each other.
+
+Each profiled query writes ``profile_<ts>.json`` (per-stage table, top
+allocation sites, sample breakdown) and, with sampling, a
+``profile_<ts>.folded`` collapsed-stack file for flamegraph.pl/speedscope.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+_active: contextvars.ContextVar[Optional["StageProfiler"]] = contextvars.ContextVar("rag_profiler", default=None)
+
+# Module prefixes that classify a sampled stack (first match from the leaf)
+INFERENCE_MODULES = ("torch", "onnxruntime", "sentence_transformers", "transformers", "numpy", "tokenizers")
+IO_MODULES = ("socket", "ssl", "http", "httpx", "httpcore", "urllib3", "requests", "anthropic",
+              "sqlite3", "chromadb", "subprocess", "selectors", "asyncio")
+WAIT_MODULES = ("threading", "queue", "concurrent")
+CATEGORIES = ("python", "inference", "io", "wait")
+_STDLIB = frozenset(getattr(sys, "stdlib_module_names", ()))
+
+
+def profile_enabled() -> bool:
+    return os.getenv("RAG_PROFILE", "0") == "1"
+
+
+def _classify(modules: List[str]) -> str:
+    # Walk from the leaf: generic stdlib frames (json, re, ...) defer to
+    # their caller, the first known or third-party/project module decides
+    for module in reversed(modules):
+        root = module.split(".", 1)[0]
+        if root in INFERENCE_MODULES:
+            return "inference"
+        if root in IO_MODULES:
+            return "io"
+        if root in WAIT_MODULES:
+            return "wait"
+        if root and root not in _STDLIB:
+            return "python"
+    return "python"
+
+
+class _StackSampler:
+    """Samples all threads' stacks every ``interval`` seconds."""
+
+    def __init__(self, profiler: "StageProfiler", interval: float) -> None:
+        self.profiler = profiler
+        self.interval = interval
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="rag-profiler-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+
+    def _loop(self) -> None:
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            stage = self.profiler.current_stage_path() or "(outside stages)"
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack: List[str] = []
+                modules: List[str] = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{Path(code.co_filename).name}:{code.co_name}")
+                    modules.append(frame.f_globals.get("__name__", ""))
+                    frame = frame.f_back
+                stack.reverse()
+                modules.reverse()
+                # Idle pool workers only add noise
+                if stack and stack[-1].endswith(("threading.py:wait", "queue.py:get", "thread.py:_worker")):
+                    continue
+                category = _classify(modules)
+                key = ";".join([*stage.split("/"), f"[{names.get(ident, ident)}]", *stack])
+                self.profiler.add_sample(stage, key, category)
+                self.samples += 1
+
+
+class StageProfiler:
+    """Collects per-stage timings/allocations for one query."""
+
+    def __init__(self, sample_ms: Optional[float] = None, trace_memory: Optional[bool] = None) -> None:
+        if sample_ms is None:
+            sample_ms = float(os.getenv("RAG_PROFILE_SAMPLE_MS", "5"))
+        if trace_memory is None:
+            trace_memory = os.getenv("RAG_PROFILE_TRACEMALLOC", "1") == "1"
+        self.sample_ms = sample_ms
+        self.trace_memory = trace_memory
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.folded: Dict[str, int] = {}
+        self.categories: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._stack: List[str] = []
+        self._owner: Optional[int] = None
+        self._sampler: Optional[_StackSampler] = None
+        self._started_tracemalloc = False
+        self._snapshot_start = None
+        self.wall_start = self.cpu_start = 0.0
+        self.wall_sec = self.cpu_sec = 0.0
+        self.top_allocations: List[Dict] = []
+
+    # -- lifecycle -------------------------------------------------------
+    def start(self) -> None:
+        self._owner = threading.get_ident()
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(1)  # deeper tracebacks multiply the overhead
+                self._started_tracemalloc = True
+            self._snapshot_start = tracemalloc.take_snapshot()
+        if self.sample_ms > 0:
+            self._sampler = _StackSampler(self, self.sample_ms / 1000.0)
+            self._sampler.start()
+        self.wall_start, self.cpu_start = time.perf_counter(), time.process_time()
+
+    def stop(self) -> None:
+        self.wall_sec = time.perf_counter() - self.wall_start
+        self.cpu_sec = time.process_time() - self.cpu_start
+        if self._sampler is not None:
+            self._sampler.stop()
+        if self.trace_memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ])
+            if self._snapshot_start is not None:
+                stats = snapshot.compare_to(self._snapshot_start, "lineno")
+                self.top_allocations = [
+                    {
+                        "site": f"{s.traceback[0].filename}:{s.traceback[0].lineno}",
+                        "size_diff_kb": round(s.size_diff / 1024, 1),
+                        "count_diff": s.count_diff,
+                    }
+                    for s in stats[:15]
+                ]
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+
+    # -- stages ----------------------------------------------------------
+    def current_stage_path(self) -> str:
+        return "/".join(self._stack)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        # Nesting is tracked for the query's own thread; worker-thread
+        # stages are recorded flat under their own name
+        owner = threading.get_ident() == self._owner
+        if owner:
+            self._stack.append(name)
+            path = self.current_stage_path()
+        else:
+            path = name
+        mem_start = 0
+        if self.trace_memory and tracemalloc.is_tracing():
+            mem_start = tracemalloc.get_traced_memory()[0]
+            if owner:
+                tracemalloc.reset_peak()
+        cpu_clock = time.process_time if owner else time.thread_time
+        wall0, cpu0 = time.perf_counter(), cpu_clock()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall0
+            cpu = cpu_clock() - cpu0
+            net = peak = 0
+            if self.trace_memory and tracemalloc.is_tracing():
+                current, peak_now = tracemalloc.get_traced_memory()
+                net = current - mem_start
+                peak = max(0, peak_now - mem_start) if owner else max(0, net)
+            if owner:
+                self._stack.pop()
+            with self._lock:
+                rec = self.stages.setdefault(path, {
+                    "calls": 0, "wall_ms": 0.0, "cpu_ms": 0.0, "alloc_net_kb": 0.0, "alloc_peak_kb": 0.0,
+                })
+                rec["calls"] += 1
+                rec["wall_ms"] += wall * 1000
+                rec["cpu_ms"] += cpu * 1000
+                rec["alloc_net_kb"] += net / 1024
+                rec["alloc_peak_kb"] = max(rec["alloc_peak_kb"], peak / 1024)
+
+    def add_sample(self, stage: str, key: str, category: str) -> None:
+        with self._lock:
+            self.folded[key] = self.folded.get(key, 0) + 1
+            bucket = self.categories.setdefault(stage, dict.fromkeys(CATEGORIES, 0))
+            bucket[category] += 1
+
+    # -- reporting -------------------------------------------------------
+    def report(self, query: str) -> Dict:
+        stages = {}
+        for path, rec in self.stages.items():
+            samples = self.categories.get(path, {})
+            total = sum(samples.values())
+            stages[path] = {
+                "calls": int(rec["calls"]),
+                "wall_ms": round(rec["wall_ms"], 2),
+                "cpu_ms": round(rec["cpu_ms"], 2),
+                "cpu_ratio": round(rec["cpu_ms"] / rec["wall_ms"], 2) if rec["wall_ms"] else 0.0,
+                "alloc_net_kb": round(rec["alloc_net_kb"], 1),
+                "alloc_peak_kb": round(rec["alloc_peak_kb"], 1),
+                "samples": {k: round(v / total, 3) for k, v in samples.items()} if total else {},
+            }
+        return {
+            "query": query[:200],
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "wall_ms": round(self.wall_sec * 1000, 2),
+            "cpu_ms": round(self.cpu_sec * 1000, 2),
+            "sample_interval_ms": self.sample_ms,
+            "samples": self._sampler.samples if self._sampler else 0,
+            "tracemalloc": self.trace_memory,
+            "stages": stages,
+            "top_allocations": self.top_allocations,
+        }
+
+    def write(self, out_dir: Path, query: str) -> Tuple[Path, Optional[Path]]:
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+        report_path = out_dir / f"{stem}.json"
+        report_path.write_text(json.dumps(self.report(query), ensure_ascii=False, indent=2), encoding="utf-8")
+        folded_path = None
+        if self.folded:
+            folded_path = out_dir / f"{stem}.folded"
+            folded_path.write_text(
+                "".join(f"{stack} {count}\n" for stack, count in sorted(self.folded.items())),
+                encoding="utf-8",
+            )
+        return report_path, folded_path
+
+
+def print_report(report: Dict) -> None:
+    print(f"\n🔬 Profile: wall {report['wall_ms']:.0f} ms, CPU {report['cpu_ms']:.0f} ms"
+          f" ({report['samples']} samples)")
+    print(f"  {'stage':<36} {'wall ms':>9} {'cpu ms':>9} {'cpu/wall':>8} {'net KB':>9} {'peak KB':>9}  "
+          + "/".join(CATEGORIES))
+    for path, rec in sorted(report["stages"].items(), key=lambda item: -item[1]["wall_ms"]):
+        s = rec["samples"]
+        mix = "/".join(f"{s.get(c, 0):.0%}" for c in CATEGORIES) if s else "-"
+        print(f"  {path:<36} {rec['wall_ms']:>9.1f} {rec['cpu_ms']:>9.1f} {rec['cpu_ratio']:>8.2f} "
+              f"{rec['alloc_net_kb']:>9.1f} {rec['alloc_peak_kb']:>9.1f}  {mix}")
+
+
+@contextmanager
+def profiling(profiler: Optional[StageProfiler]) -> Iterator[Optional[StageProfiler]]:
+    """Activate ``profiler`` for the current context (no-op when None)."""
+    if profiler is None:
+        yield None
+        return
+    token = _active.set(profiler)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        _active.reset(token)
+
+
+@contextmanager
+def profile_stage(name: str) -> Iterator[None]:
+    """Stage hook used by ``RAGTracer.span``; free when not profiling."""
+    profiler = _active.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
@@ -1,54 +1,72 @@
-"""Lightweight reader for Serena's symbol caches (code navigation)."""
+"""Lightweight reader for Serena's symbol caches (code navigation).
 
-from __future__ import annotations
+Serena's ``document_symbols_cache_*.pkl`` files are compiled once into a
+:class:`~rag_system.utils.symbol_store.SymbolStore` (``index_path``): interned
+strings, ``uint32`` symbol columns and trigram/sub-token postings in one
+memory-mapped file. Later starts only stat the pickles and map the file; it
+is recompiled when their paths, mtimes or sizes change. Without
+``index_path`` the store is built in memory.
 
-import pickle
-import re
-from dataclasses import dataclass
-from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+Search is index-driven rather than a scan of every symbol per query:
+
+- a trigram index over symbol full names (``parent/child``) and one over
+  file paths (per file, not per symbol) yield exact candidates for
+  substring matches of tokens with 3+ characters, verified afterwards;
+- an inverted index of camelCase/snake_case sub-tokens of symbol names and
+  paths answers shorter tokens (``id``, ``db``).
 
+Scoring per token is 3 for a name match, 2 for a parent (full name), 1 for
+the path, as with the old full scan, with two ranking changes:
 
-@dataclass
-class SerenaSymbol:
-    """Convenience container for a Serena symbol entry."""
+- tokens shorter than 3 characters match whole sub-tokens only, not any
+  substring (``id`` matches ``getUserId`` and ``user_id`` but no longer
+  ``userid`` or ``rowid``; ``db`` no longer matches ``dbg``);
+- a name match that is a whole sub-token gets +0.5 (``SUBTOKEN_BONUS``)
+  over a plain substring match.
 
-    name: str
-    full_name: str
-    kind: int
-    file_path: Path
-    relative_path: str
-    start_line: int
-    end_line: int
+Snippets come from an LRU of file line arrays (validated by mtime) instead
+of re-reading the file for every result.
+"""
 
-    @property
-    def name_lower(self) -> str:
-        return self.name.lower()
+from __future__ import annotations
 
-    @property
-    def full_name_lower(self) -> str:
-        return self.full_name.lower()
+import os
+import pickle
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
-    @property
-    def path_lower(self) -> str:
-        return self.relative_path.lower()
+from rag_system.utils.symbol_store import SerenaSymbol, SymbolStore, build_store
 
 
 class SerenaCodeIndex:
     """Loads Serena's cached LSP symbols for fast code retrieval."""
 
+    # Result labels (subclasses with their own symbol source override these)
+    source = "serena_code"
+    id_prefix = "serena"
+
     def __init__(
         self,
         project_root: Path,
         cache_root: Optional[Path] = None,
         max_symbols: Optional[int] = None,
+        index_path: Optional[Path] = None,
     ) -> None:
         self.project_root = Path(project_root)
         self.cache_root = cache_root or Path.home() / ".serena" / "cache"
-        self.symbols: List[SerenaSymbol] = []
+        self.index_path = Path(index_path) if index_path else None
+        self.store: Optional[SymbolStore] = None
+        self.symbols: Sequence[SerenaSymbol] = []
         self._loaded = False
         self.max_symbols = max_symbols
-        self._load_caches()
+        self._load()
+        # LRU of source files as line arrays: path -> (mtime_ns, lines)
+        self._lines_lock = threading.Lock()
+        self._lines_cache: "OrderedDict[Path, Tuple[int, List[str]]]" = OrderedDict()
+        self._lines_capacity = int(os.getenv("RAG_SERENA_FILE_CACHE", "256"))
 
     # ------------------------------------------------------------------
     def available(self) -> bool:
@@ -62,24 +80,16 @@ class SerenaCodeIndex:
         if not tokens:
             return []
 
-        scored: List[Tuple[float, SerenaSymbol]] = []
-        for sym in self.symbols:
-            score = self._score_symbol(sym, tokens)
-            if score > 0:
-                scored.append((score, sym))
-
-        scored.sort(key=lambda item: item[0], reverse=True)
-
         results: List[Dict] = []
-        for score, sym in scored[:limit]:
+        for score, sym in self._top_symbols(tokens, limit):
             snippet = self._read_snippet(sym)
             if not snippet:
                 continue
             results.append(
                 {
-                    "id": f"serena::{sym.relative_path}:{sym.start_line + 1}",
+                    "id": f"{self.id_prefix}::{sym.relative_path}:{sym.start_line + 1}",
                     "content": snippet,
-                    "source": "serena_code",
+                    "source": self.source,
                     "metadata": {
                         "path": sym.relative_path,
                         "start_line": sym.start_line + 1,
@@ -93,16 +103,57 @@ class SerenaCodeIndex:
         return results
 
     # ------------------------------------------------------------------
-    def _load_caches(self) -> None:
-        if not self.cache_root.exists():
-            self._loaded = True
-            return
-
-        cache_files = sorted(self.cache_root.rglob("document_symbols_cache_*.pkl"))
+    def _load(self) -> None:
+        cache_files = sorted(self.cache_root.rglob("document_symbols_cache_*.pkl")) if self.cache_root.exists() else []
         if not cache_files:
             self._loaded = True
             return
 
+        meta = self._manifest(cache_files)
+        store = self._open_compiled(meta)
+        if store is None:
+            data = build_store(self._load_caches(cache_files), meta)
+            store = self._save_compiled(data) or SymbolStore(data)
+        self.store = store
+        self.symbols = store.symbols
+        self._loaded = True
+
+    def _manifest(self, cache_files: List[Path]) -> Dict[str, Any]:
+        """What the compiled store was built from (compared on every start)."""
+        sources = []
+        for path in cache_files:
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            sources.append([str(path), st.st_mtime_ns, st.st_size])
+        return {"sources": sources, "max_symbols": self.max_symbols}
+
+    def _open_compiled(self, meta: Dict[str, Any]) -> Optional[SymbolStore]:
+        if self.index_path is None or not self.index_path.exists():
+            return None
+        try:
+            store = SymbolStore.open(self.index_path)
+        except Exception:
+            return None
+        return store if store.meta == meta else None
+
+    def _save_compiled(self, data: bytes) -> Optional[SymbolStore]:
+        if self.index_path is None:
+            return None
+        try:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.index_path.with_suffix(f".tmp{os.getpid()}")
+            with tmp.open("wb") as fh:
+                fh.write(data)
+            os.replace(tmp, self.index_path)
+            return SymbolStore.open(self.index_path)
+        except Exception as exc:
+            print(f"⚠️  Failed to save Serena symbol store: {exc}")
+            return None
+
+    def _load_caches(self, cache_files: List[Path]) -> List[SerenaSymbol]:
+        collected: List[SerenaSymbol] = []
         for cache_path in cache_files:
             try:
                 with cache_path.open("rb") as fh:
@@ -115,14 +166,13 @@ class SerenaCodeIndex:
                     continue
                 symbols = payload[1]
                 for symbol in symbols:
-                    self._collect_symbol(symbol, parent_stack=[])
-                    if self.max_symbols and len(self.symbols) >= self.max_symbols:
-                        self._loaded = True
-                        return
+                    self._collect_symbol(symbol, parent_stack=[], out=collected)
+                    if self.max_symbols and len(collected) >= self.max_symbols:
+                        return collected
 
-        self._loaded = True
+        return collected
 
-    def _collect_symbol(self, symbol: Dict, parent_stack: List[str]) -> None:
+    def _collect_symbol(self, symbol: Dict, parent_stack: List[str], out: List[SerenaSymbol]) -> None:
         name = symbol.get("name")
         loc = symbol.get("location") or {}
         rel_path = loc.get("relativePath")
@@ -144,10 +194,17 @@ class SerenaCodeIndex:
                 start_line=int(start.get("line", 0)),
                 end_line=int(end.get("line", start.get("line", 0))),
             )
-            self.symbols.append(entry)
+            out.append(entry)
 
         for child in symbol.get("children", []) or []:
-            self._collect_symbol(child, parent_stack + [name] if name else parent_stack)
+            self._collect_symbol(child, parent_stack + [name] if name else parent_stack, out)
+
+    def _top_symbols(self, tokens: Sequence[str], limit: int) -> List[Tuple[float, SerenaSymbol]]:
+        """Best ``limit`` symbols by score (ties in load order), index-only."""
+        store = self.store  # may be swapped by a refresh; ids belong to one store
+        if store is None:
+            return []
+        return [(score, store.symbol(sid)) for score, sid in store.top(tokens, limit)]
 
     # ------------------------------------------------------------------
     def _tokenize(self, queries: Sequence[str]) -> List[str]:
@@ -167,24 +224,32 @@ class SerenaCodeIndex:
                 unique.append(token)
         return unique
 
-    def _score_symbol(self, symbol: SerenaSymbol, tokens: Iterable[str]) -> float:
-        score = 0.0
-        for token in tokens:
-            if token in symbol.name_lower:
-                score += 3.0
-            elif token in symbol.full_name_lower:
-                score += 2.0
-            elif token in symbol.path_lower:
-                score += 1.0
-        return score
-
-    def _read_snippet(self, symbol: SerenaSymbol, context_lines: int = 8) -> Optional[str]:
+    def _file_lines(self, path: Path) -> Optional[List[str]]:
         try:
-            text = symbol.file_path.read_text(encoding="utf-8", errors="ignore")
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            return None
+        with self._lines_lock:
+            cached = self._lines_cache.get(path)
+            if cached is not None and cached[0] == mtime:
+                self._lines_cache.move_to_end(path)
+                return cached[1]
+        try:
+            lines = path.read_text(encoding="utf-8", errors="ignore").splitlines()
         except Exception:
             return None
+        with self._lines_lock:
+            self._lines_cache[path] = (mtime, lines)
+            self._lines_cache.move_to_end(path)
+            while len(self._lines_cache) > self._lines_capacity:
+                self._lines_cache.popitem(last=False)
+        return lines
+
+    def _read_snippet(self, symbol: SerenaSymbol, context_lines: int = 8) -> Optional[str]:
+        lines = self._file_lines(symbol.file_path)
+        if lines is None:
+            return None
 
-        lines = text.splitlines()
         start = max(0, symbol.start_line - context_lines)
         end = min(len(lines), symbol.end_line + context_lines + 1)
 
@@ -0,0 +1,103 @@
+"""Per-intent retrieval strategy table.
+
+The defaults below are the hand-tuned values the pipeline always used. An
+offline fit (``rag_system.tools.optimize_strategy``) can write a learned
+table to JSON; entries found there override the defaults for their intent.
+Query-level adjustments (objective questions, long questions, temporal
+signals) are still applied on top by the pipeline.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# Fields a learned table may set, with the type each must have.
+# ``use_planning`` may also be ``None`` = keep the keyword/length heuristic.
+TUNABLE_FIELDS: Dict[str, type] = {
+    "use_memory": bool,
+    "use_code": bool,
+    "use_keywords": bool,
+    "use_graph": bool,
+    "top_k": int,
+    "vector_n_results": int,
+    "memory_limit": int,
+    "memory_concepts": int,
+    "use_planning": bool,
+}
+
+_BASE: Dict[str, Any] = {
+    "use_memory": True,
+    "use_code": False,
+    "use_keywords": True,
+    "use_graph": True,
+    "top_k": 20,
+    "vector_n_results": 10,
+    "memory_limit": 20,
+    "memory_concepts": 3,
+    "use_planning": None,
+}
+
+DEFAULT_STRATEGY_TABLE: Dict[str, Dict[str, Any]] = {
+    "general": dict(_BASE),
+    "code": dict(_BASE, use_code=True, use_keywords=False, use_graph=False,
+                 top_k=15, vector_n_results=15, memory_limit=10),
+    "status": dict(_BASE, top_k=15, vector_n_results=8, memory_limit=15),
+    "config": dict(_BASE, use_graph=False, top_k=15, vector_n_results=8, memory_limit=15),
+    "explain": dict(_BASE, top_k=50, vector_n_results=15, memory_limit=30),
+}
+
+
+def default_table_path(cache_dir: Path) -> Path:
+    """Where the learned table lives: ``$RAG_STRATEGY_TABLE`` or the project cache."""
+
+    return Path(os.getenv("RAG_STRATEGY_TABLE", str(Path(cache_dir) / "strategy_table.json")))
+
+
+class StrategyTable:
+    """Defaults merged with an optional learned table loaded once at startup."""
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = Path(path) if path else None
+        self.learned: Dict[str, Dict[str, Any]] = {}
+        self.generated_at: Optional[str] = None
+        if self.path is not None and self.path.exists():
+            self.load(self.path)
+
+    def load(self, path: Path) -> int:
+        """Load learned entries; invalid fields are ignored. Returns #intents."""
+
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        learned: Dict[str, Dict[str, Any]] = {}
+        for intent, entry in (data.get("intents") or {}).items():
+            clean = {
+                name: value
+                for name, value in (entry or {}).items()
+                if name in TUNABLE_FIELDS and _valid(name, value)
+            }
+            if clean:
+                learned[intent] = clean
+        self.learned = learned
+        self.generated_at = data.get("generated_at")
+        return len(learned)
+
+    def is_learned(self, intent: str) -> bool:
+        return intent in self.learned
+
+    def for_intent(self, intent: str) -> Dict[str, Any]:
+        """Base strategy for an intent (copy, safe to mutate)."""
+
+        entry = dict(DEFAULT_STRATEGY_TABLE.get(intent, DEFAULT_STRATEGY_TABLE["general"]))
+        entry.update(self.learned.get(intent, {}))
+        return entry
+
+
+def _valid(name: str, value: Any) -> bool:
+    expected = TUNABLE_FIELDS[name]
+    if name == "use_planning" and value is None:
+        return True
+    if expected is int:
+        return isinstance(value, int) and not isinstance(value, bool) and value > 0
+    return isinstance(value, expected)
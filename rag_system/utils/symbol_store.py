@@ -0,0 +1,379 @@
+"""Compact, memory-mapped symbol table with trigram/sub-token postings.
+
+Code symbols (Serena's LSP caches, the native code index) are compiled into
+one binary file instead of being rebuilt as Python objects on every start:
+
+- an interned string table (UTF-8 blob + ``uint32`` offsets) holding names,
+  qualified names, paths and index keys;
+- ``uint32`` columns per symbol (name, full name, kind, file, start/end line)
+  and per file (relative/absolute path, CSR list of its symbols);
+- four CSR inverted indexes: trigrams of qualified names, camelCase/
+  snake_case sub-tokens of names, and the same two over file paths. Keys are
+  string ids sorted by their UTF-8 bytes, so lookups are a binary search.
+
+The file is opened with ``mmap`` and read through ``memoryview`` casts: opening
+costs a header parse, pages are loaded on demand and shared between
+processes, and :class:`~rag_system.utils.serena_code_index.SerenaSymbol`
+objects are only created for returned results. ``meta`` (stored in the JSON
+header) lets the owner decide whether the file is still fresh.
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import json
+import mmap
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from collections.abc import Sequence as SequenceABC
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+STORE_VERSION = 1
+_MAGIC = b"RAGSYM\x00\x01"
+# magic, header offset, header length (header is JSON at the end of the file)
+_PREFIX = struct.Struct("<8sQI4x")
+_INDEXES = ("name_grams", "name_tokens", "path_grams", "path_tokens")
+
+_SUBTOKEN_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z]|\b|[0-9_]|$)|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+SUBTOKEN_BONUS = 0.5
+
+
+def split_identifier(text: str) -> List[str]:
+    """camelCase/snake_case/path sub-tokens, lowercased (``HTTPServer_v2`` ->
+    ``http, server, v, 2``)."""
+    return [t.lower() for t in _SUBTOKEN_RE.findall(text)]
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _contains(postings: Sequence[int], item: int) -> bool:
+    i = bisect_left(postings, item)
+    return i < len(postings) and postings[i] == item
+
+
+def _intersect(lists: List[Sequence[int]]) -> Set[int]:
+    """Ids present in every (sorted) posting list, smallest list first."""
+    if not lists:
+        return set()
+    lists = sorted(lists, key=len)
+    result = set(lists[0])
+    for postings in lists[1:]:
+        if not result:
+            break
+        if len(result) * 16 < len(postings):
+            result = {i for i in result if _contains(postings, i)}
+        else:
+            result.intersection_update(postings)
+    return result
+
+
+@dataclass
+class SerenaSymbol:
+    """Convenience container for a Serena symbol entry."""
+
+    name: str
+    full_name: str
+    kind: int
+    file_path: Path
+    relative_path: str
+    start_line: int
+    end_line: int
+
+    @property
+    def name_lower(self) -> str:
+        return self.name.lower()
+
+    @property
+    def full_name_lower(self) -> str:
+        return self.full_name.lower()
+
+    @property
+    def path_lower(self) -> str:
+        return self.relative_path.lower()
+
+
+# ----------------------------------------------------------------------
+# Writer
+# ----------------------------------------------------------------------
+class _StringTable:
+    def __init__(self) -> None:
+        self.ids: Dict[str, int] = {}
+        self.parts: List[bytes] = []
+
+    def intern(self, text: str) -> int:
+        sid = self.ids.get(text)
+        if sid is None:
+            sid = self.ids[text] = len(self.parts)
+            self.parts.append(text.encode("utf-8"))
+        return sid
+
+
+def _csr(strings: _StringTable, index: Dict[str, List[int]]) -> Tuple[array, array, array]:
+    keys = sorted(index, key=lambda k: k.encode("utf-8"))
+    key_ids, offsets, ids = array("I"), array("I", [0]), array("I")
+    for key in keys:
+        key_ids.append(strings.intern(key))
+        ids.extend(index[key])
+        offsets.append(len(ids))
+    return key_ids, offsets, ids
+
+
+def build_store(symbols: Sequence[SerenaSymbol], meta: Optional[Dict[str, Any]] = None) -> bytes:
+    """Serialize ``symbols`` (plus their indexes) into the store format."""
+    strings = _StringTable()
+    file_ids: Dict[Tuple[str, str], int] = {}
+    file_rel, file_abs = array("I"), array("I")
+    file_symbols: List[List[int]] = []
+    cols = {name: array("I") for name in ("sym_name", "sym_full", "sym_kind", "sym_file", "sym_start", "sym_end")}
+    name_grams: Dict[str, List[int]] = defaultdict(list)
+    name_tokens: Dict[str, List[int]] = defaultdict(list)
+    paths: List[str] = []
+    for sid, sym in enumerate(symbols):
+        key = (sym.relative_path, str(sym.file_path))
+        fid = file_ids.get(key)
+        if fid is None:
+            fid = file_ids[key] = len(paths)
+            paths.append(sym.relative_path)
+            file_rel.append(strings.intern(sym.relative_path))
+            file_abs.append(strings.intern(key[1]))
+            file_symbols.append([])
+        file_symbols[fid].append(sid)
+        cols["sym_name"].append(strings.intern(sym.name))
+        cols["sym_full"].append(strings.intern(sym.full_name))
+        cols["sym_kind"].append(max(0, sym.kind))
+        cols["sym_file"].append(fid)
+        cols["sym_start"].append(max(0, sym.start_line))
+        cols["sym_end"].append(max(0, sym.end_line))
+        for gram in _trigrams(sym.full_name_lower):
+            name_grams[gram].append(sid)
+        for token in set(split_identifier(sym.name)):
+            name_tokens[token].append(sid)
+
+    path_grams: Dict[str, List[int]] = defaultdict(list)
+    path_tokens: Dict[str, List[int]] = defaultdict(list)
+    for fid, path in enumerate(paths):
+        for gram in _trigrams(path.lower()):
+            path_grams[gram].append(fid)
+        for token in set(split_identifier(path)):
+            path_tokens[token].append(fid)
+
+    sections: List[Tuple[str, Union[array, bytes]]] = list(cols.items())
+    sections += [("file_rel", file_rel), ("file_abs", file_abs)]
+    file_offsets, file_ids_flat = array("I", [0]), array("I")
+    for ids in file_symbols:
+        file_ids_flat.extend(ids)
+        file_offsets.append(len(file_ids_flat))
+    sections += [("file_sym_offsets", file_offsets), ("file_sym_ids", file_ids_flat)]
+    for name, index in zip(_INDEXES, (name_grams, name_tokens, path_grams, path_tokens)):
+        keys, offsets, ids = _csr(strings, index)
+        sections += [(f"{name}_keys", keys), (f"{name}_offsets", offsets), (f"{name}_ids", ids)]
+    # String table last: index keys are interned above
+    str_offsets = array("I", [0])
+    for part in strings.parts:
+        str_offsets.append(str_offsets[-1] + len(part))
+    sections += [("str_offsets", str_offsets), ("str_blob", b"".join(strings.parts))]
+
+    body = bytearray(_PREFIX.size)
+    layout: Dict[str, List[Any]] = {}
+    for name, payload in sections:
+        body += b"\0" * (-len(body) % 8)
+        if isinstance(payload, array):
+            layout[name] = [len(body), len(payload), payload.typecode]
+            body += payload.tobytes()
+        else:
+            layout[name] = [len(body), len(payload), "B"]
+            body += payload
+    header = json.dumps({
+        "version": STORE_VERSION,
+        "byteorder": sys.byteorder,
+        "itemsize": array("I").itemsize,
+        "symbols": len(symbols),
+        "files": len(paths),
+        "sections": layout,
+        "meta": meta or {},
+    }).encode("utf-8")
+    header_offset = len(body)
+    body += header
+    _PREFIX.pack_into(body, 0, _MAGIC, header_offset, len(header))
+    return bytes(body)
+
+
+# ----------------------------------------------------------------------
+# Reader
+# ----------------------------------------------------------------------
+class _SymbolView(SequenceABC):
+    """Read-only sequence of symbols, materialized on access."""
+
+    def __init__(self, store: "SymbolStore") -> None:
+        self._store = store
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __getitem__(self, sid):  # type: ignore[override]
+        if isinstance(sid, slice):
+            return [self._store.symbol(i) for i in range(*sid.indices(len(self)))]
+        if sid < 0:
+            sid += len(self)
+        if not 0 <= sid < len(self):
+            raise IndexError(sid)
+        return self._store.symbol(sid)
+
+
+class SymbolStore:
+    """Query side of the store over ``bytes`` or a read-only ``mmap``."""
+
+    def __init__(self, buffer: Union[bytes, mmap.mmap]) -> None:
+        magic, header_offset, header_length = _PREFIX.unpack_from(buffer, 0)
+        if magic != _MAGIC:
+            raise ValueError("not a symbol store")
+        header = json.loads(buffer[header_offset:header_offset + header_length])
+        if (header.get("version") != STORE_VERSION
+                or header.get("byteorder") != sys.byteorder
+                or header.get("itemsize") != array("I").itemsize):
+            raise ValueError("incompatible symbol store")
+        self.meta: Dict[str, Any] = header.get("meta") or {}
+        self._buffer = buffer
+        self._count = int(header["symbols"])
+        self.file_count = int(header["files"])
+        view = memoryview(buffer)
+        self._cols: Dict[str, memoryview] = {}
+        for name, (offset, count, typecode) in header["sections"].items():
+            size = count * (1 if typecode == "B" else array(typecode).itemsize)
+            section = view[offset:offset + size]
+            self._cols[name] = section if typecode == "B" else section.cast(typecode)
+        self._blob_base = header["sections"]["str_blob"][0]
+        self._str_offsets = self._cols["str_offsets"]
+        self._sym_name = self._cols["sym_name"]
+        self._sym_full = self._cols["sym_full"]
+        self._sym_file = self._cols["sym_file"]
+        self._file_rel = self._cols["file_rel"]
+        self._file_paths: Dict[int, str] = {}
+        self.symbols: Sequence[SerenaSymbol] = _SymbolView(self)
+
+    @classmethod
+    def open(cls, path: Path) -> "SymbolStore":
+        """Map ``path`` read-only (the mapping outlives the file handle)."""
+        with open(path, "rb") as fh:
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapped)
+
+    def __len__(self) -> int:
+        return self._count
+
+    # ------------------------------------------------------------------
+    def _key_bytes(self, string_id: int) -> bytes:
+        start = self._blob_base + self._str_offsets[string_id]
+        end = self._blob_base + self._str_offsets[string_id + 1]
+        return self._buffer[start:end]
+
+    def string(self, string_id: int) -> str:
+        return self._key_bytes(string_id).decode("utf-8")
+
+    def path(self, fid: int) -> str:
+        path = self._file_paths.get(fid)
+        if path is None:
+            path = self._file_paths[fid] = self.string(self._file_rel[fid])
+        return path
+
+    def file_of(self, sid: int) -> int:
+        return self._sym_file[sid]
+
+    def file_symbols(self, fid: int) -> memoryview:
+        offsets = self._cols["file_sym_offsets"]
+        return self._cols["file_sym_ids"][offsets[fid]:offsets[fid + 1]]
+
+    def symbol(self, sid: int) -> SerenaSymbol:
+        fid = self._sym_file[sid]
+        return SerenaSymbol(
+            name=self.string(self._sym_name[sid]),
+            full_name=self.string(self._sym_full[sid]),
+            kind=self._cols["sym_kind"][sid],
+            file_path=Path(self.string(self._cols["file_abs"][fid])),
+            relative_path=self.path(fid),
+            start_line=self._cols["sym_start"][sid],
+            end_line=self._cols["sym_end"][sid],
+        )
+
+    def postings(self, index: str, key: str) -> Optional[memoryview]:
+        """Sorted ids for ``key`` in one of the four indexes, or None."""
+        keys = self._cols[f"{index}_keys"]
+        target = key.encode("utf-8")
+        lo, hi = 0, len(keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_bytes(keys[mid]) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(keys) or self._key_bytes(keys[lo]) != target:
+            return None
+        offsets = self._cols[f"{index}_offsets"]
+        return self._cols[f"{index}_ids"][offsets[lo]:offsets[lo + 1]]
+
+    # ------------------------------------------------------------------
+    def name_matches(self, token: str) -> Dict[int, float]:
+        """Symbols matching ``token`` by name (3) or parent name (2)."""
+        whole = self.postings("name_tokens", token)
+        if len(token) < 3:
+            return {sid: 3.0 + SUBTOKEN_BONUS for sid in whole or ()}
+        grams = [self.postings("name_grams", g) for g in _trigrams(token)]
+        if not all(g is not None for g in grams):
+            return {}
+        matches: Dict[int, float] = {}
+        for sid in _intersect(grams):
+            if token in self.string(self._sym_name[sid]).lower():
+                bonus = SUBTOKEN_BONUS if whole is not None and _contains(whole, sid) else 0.0
+                matches[sid] = 3.0 + bonus
+            elif token in self.string(self._sym_full[sid]).lower():
+                matches[sid] = 2.0
+        return matches
+
+    def path_matches(self, token: str) -> Set[int]:
+        """Files whose relative path contains ``token`` (whole sub-token if short)."""
+        if len(token) < 3:
+            return set(self.postings("path_tokens", token) or ())
+        grams = [self.postings("path_grams", g) for g in _trigrams(token)]
+        if not all(g is not None for g in grams):
+            return set()
+        return {fid for fid in _intersect(grams) if token in self.path(fid).lower()}
+
+    def top(self, tokens: Sequence[str], limit: int) -> List[Tuple[float, int]]:
+        """Best ``limit`` (score, symbol id) pairs (ties in load order).
+
+        Per token: 3 for a name match (+bonus for a whole sub-token), 2 for a
+        parent (full name), 1 for the path. Symbols matched by name get exact
+        scores; path-only matches are scored per file (every symbol of a file
+        has the same score) and only the first ``limit`` of each score level
+        are materialized.
+        """
+        per_token = [(self.name_matches(t), self.path_matches(t)) for t in tokens]
+
+        scored: Dict[int, float] = {}
+        for sid in set().union(*(names for names, _ in per_token)):
+            fid = self._sym_file[sid]
+            scored[sid] = sum(names.get(sid) or (1.0 if fid in files else 0.0) for names, files in per_token)
+
+        file_score: Dict[int, float] = defaultdict(float)
+        for _, files in per_token:
+            for fid in files:
+                file_score[fid] += 1.0
+        candidates = [(-score, sid) for sid, score in scored.items()]
+        by_level: Dict[float, List[int]] = defaultdict(list)
+        for fid, score in file_score.items():
+            by_level[score].append(fid)
+        for score, fids in by_level.items():
+            merged = heapq.merge(*(self.file_symbols(fid) for fid in fids))
+            path_only = (sid for sid in merged if sid not in scored)
+            candidates.extend((-score, sid) for sid in itertools.islice(path_only, limit))
+
+        return [(-neg, sid) for neg, sid in heapq.nsmallest(limit, candidates)]
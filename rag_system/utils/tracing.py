@@ -1,21 +1,136 @@
 """
-OpenTelemetry-based tracing for RAG pipeline
+OpenTelemetry-compatible tracing for RAG pipeline
 Phase 3 Enhancement: Detailed observability
+
+Trace state lives in contextvars, so concurrent queries (batch_query, API
+server, background cache refreshes) each get their own trace. Spans carry
+W3C-style ids (32-hex trace id, 16-hex span ids) and a parent span id;
+``span()`` nests. Worker threads see the caller's trace only when the
+callable is wrapped with :func:`propagate`. Finished traces go to a
+background writer that hands them to the shared log sink (daily JSONL) and,
+when configured, exports the same batches as OTLP (see ``utils/otlp.py``).
 """
 
 from __future__ import annotations
 
+import atexit
+import contextvars
 import os
+import queue
+import secrets
+import threading
 import time
 from contextlib import contextmanager
-from typing import Dict, Optional, Any
+from typing import Any, Callable, Dict, List, Optional
 from datetime import datetime
 import json
 from pathlib import Path
 
+from rag_system.utils.log_sink import get_log_sink
+from rag_system.utils.metrics import get_registry
+from rag_system.utils.otlp import OTLPExporter, exporter_from_env
+from rag_system.utils.profiler import profile_stage
+
+_current_trace: contextvars.ContextVar[Optional[Dict]] = contextvars.ContextVar("rag_trace", default=None)
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("rag_span", default=None)
+
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+def new_span_id() -> str:
+    return secrets.token_hex(8)
+
+
+def propagate(fn: Callable) -> Callable:
+    """Bind ``fn`` to the caller's context (current trace, span, LLM ledger).
+
+    Each call runs in its own copy, so the wrapper may be used by several
+    worker threads at once (``executor.map``, ``run_in_executor``).
+    """
+    ctx = contextvars.copy_context()
+
+    def _run(*args, **kwargs):
+        return ctx.copy().run(fn, *args, **kwargs)
+
+    return _run
+
+
+class TraceWriter:
+    """Append finished traces to ``traces_YYYYMMDD.jsonl`` from a daemon thread.
+
+    Traces are written in batches (every ``flush_interval`` seconds or
+    ``batch_size`` traces); when the queue is full new traces are dropped
+    and counted rather than blocking a query.
+    """
+
+    def __init__(self, logs_dir: Path, flush_interval: float = 1.0,
+                 batch_size: int = 64, max_queue: int = 10000,
+                 exporter: Optional[OTLPExporter] = None) -> None:
+        self.logs_dir = Path(logs_dir)
+        self.exporter = exporter
+        self.sink = get_log_sink()
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.dropped = 0
+        self.written = 0
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._loop, name="rag-trace-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def submit(self, trace: Dict) -> None:
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Block until everything submitted so far is on disk."""
+        if not self._thread.is_alive():
+            return
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+        self.sink.flush(timeout)
+
+    def _loop(self) -> None:
+        batch: List[Dict] = []
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            if isinstance(item, dict):
+                batch.append(item)
+                if len(batch) < self.batch_size:
+                    continue
+            self._write(batch)
+            batch = []
+            if isinstance(item, threading.Event):
+                item.set()
+
+    def _write(self, batch: List[Dict]) -> None:
+        if not batch:
+            return
+        by_file: Dict[Path, List[str]] = {}
+        for trace in batch:
+            day = datetime.utcfromtimestamp(trace.get('end_time') or time.time()).strftime('%Y%m%d')
+            by_file.setdefault(self.logs_dir / f"traces_{day}.jsonl", []).append(json.dumps(trace))
+        # File I/O (batching, rotation) is the shared log sink's job
+        for path, lines in by_file.items():
+            self.sink.write_many(path, lines)
+            self.written += len(lines)
+        if self.exporter is not None:
+            self.exporter.export(batch)
+
 
 class RAGTracer:
-    """Lightweight tracing for RAG pipeline operations"""
+    """Lightweight tracing for RAG pipeline operations (one trace per context)"""
     
     def __init__(self, project_name: str, logs_dir: Optional[Path] = None):
         self.project_name = project_name
@@ -23,18 +138,29 @@ class RAGTracer:
         self.logs_dir.mkdir(parents=True, exist_ok=True)
         
         self.enabled = os.getenv('RAG_TRACING_ENABLED', '1') == '1'
-        self.current_trace: Optional[Dict] = None
-        self.spans: list[Dict] = []
+        self.registry = get_registry()
+        self.writer = TraceWriter(
+            self.logs_dir,
+            flush_interval=float(os.getenv('RAG_TRACE_FLUSH_SEC', '1.0')),
+            batch_size=int(os.getenv('RAG_TRACE_BATCH', '64')),
+            exporter=exporter_from_env(project_name),
+        ) if self.enabled else None
+    
+    @property
+    def current_trace(self) -> Optional[Dict]:
+        """Trace active in the caller's context (None outside a query)"""
+        return _current_trace.get()
     
     def start_trace(self, operation: str, query: str, metadata: Optional[Dict] = None) -> str:
-        """Start a new trace for a RAG operation"""
+        """Start a new trace for a RAG operation in the current context"""
         if not self.enabled:
             return ""
         
-        trace_id = f"{operation}_{int(time.time() * 1000)}"
-        
-        self.current_trace = {
+        trace_id = new_trace_id()
+        root_span_id = new_span_id()
+        trace = {
             'trace_id': trace_id,
+            'span_id': root_span_id,
             'operation': operation,
             'query': query[:200],  # Truncate for privacy
             'metadata': metadata or {},
@@ -42,115 +168,148 @@ class RAGTracer:
             'start_ts': datetime.utcnow().isoformat() + 'Z',
             'spans': []
         }
+        # Tokens restore whatever was active before (nested traces, reused threads)
+        trace['_tokens'] = (_current_trace.set(trace), _current_span.set(root_span_id))
         
         return trace_id
     
     @contextmanager
     def span(self, name: str, attributes: Optional[Dict] = None):
-        """Context manager for creating spans"""
-        if not self.enabled or not self.current_trace:
-            yield
+        """Context manager for creating (nested) spans"""
+        trace = _current_trace.get()
+        if not self.enabled or trace is None:
+            # Stages are still profiled with tracing off (RAG_PROFILE=1)
+            with profile_stage(name):
+                yield
             return
         
         span_data = {
             'name': name,
+            'span_id': new_span_id(),
+            'parent_span_id': _current_span.get(),
             'start_time': time.time(),
             'attributes': attributes or {}
         }
+        token = _current_span.set(span_data['span_id'])
         
         try:
-            yield span_data
+            with profile_stage(name):
+                yield span_data
         except Exception as e:
             span_data['error'] = str(e)
             span_data['status'] = 'error'
             raise
         finally:
+            _current_span.reset(token)
             span_data['end_time'] = time.time()
             span_data['duration_ms'] = round((span_data['end_time'] - span_data['start_time']) * 1000, 2)
             span_data['status'] = span_data.get('status', 'ok')
-            
-            if self.current_trace:
-                self.current_trace['spans'].append(span_data)
+            trace['spans'].append(span_data)
     
-    def end_trace(self, result: Optional[Dict] = None) -> None:
-        """End current trace and save to disk"""
-        if not self.enabled or not self.current_trace:
+    def record_span(self,
+                    name: str,
+                    start_time: float,
+                    end_time: float,
+                    attributes: Optional[Dict] = None,
+                    status: str = 'ok',
+                    error: Optional[str] = None) -> None:
+        """Record a span timed elsewhere (worker threads, cancelled agents)"""
+        trace = _current_trace.get()
+        if not self.enabled or trace is None:
             return
         
-        self.current_trace['end_time'] = time.time()
-        self.current_trace['duration_ms'] = round(
-            (self.current_trace['end_time'] - self.current_trace['start_time']) * 1000, 
-            2
-        )
+        span_data = {
+            'name': name,
+            'span_id': new_span_id(),
+            'parent_span_id': _current_span.get(),
+            'start_time': start_time,
+            'end_time': end_time,
+            'duration_ms': round((end_time - start_time) * 1000, 2),
+            'attributes': attributes or {},
+            'status': status,
+        }
+        if error:
+            span_data['error'] = error
+        trace['spans'].append(span_data)
+    
+    def end_trace(self, result: Optional[Dict] = None, status: str = 'ok', error: Optional[str] = None) -> None:
+        """End the current context's trace and queue it for writing (no-op if none)"""
+        trace = _current_trace.get()
+        if not self.enabled or trace is None:
+            return
+        
+        trace_token, span_token = trace.pop('_tokens')
+        try:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+        except ValueError:
+            # Ended from a different context than it started in
+            _current_span.set(None)
+            _current_trace.set(None)
+        
+        trace['end_time'] = time.time()
+        trace['duration_ms'] = round((trace['end_time'] - trace['start_time']) * 1000, 2)
+        trace['status'] = status
+        if error:
+            trace['error'] = error
         
         if result:
-            self.current_trace['result'] = {
+            trace['result'] = {
                 'retrieved_docs': result.get('retrieved', 0),
                 'reranked_docs': result.get('reranked', 0),
                 'context_chars': result.get('context_chars', 0),
                 'confidence': result.get('confidence', 0),
-                'from_cache': result.get('from_cache', False)
+                'from_cache': result.get('from_cache', False),
+                'intent': result.get('intent'),
             }
+            if result.get('shared'):
+                trace['result']['shared'] = True
         
-        # Save trace to JSONL
-        trace_file = self.logs_dir / f"traces_{datetime.utcnow().strftime('%Y%m%d')}.jsonl"
-        try:
-            with open(trace_file, 'a', encoding='utf-8') as f:
-                json.dump(self.current_trace, f)
-                f.write('\n')
-        except Exception as e:
-            print(f"⚠️  Failed to save trace: {e}")
-        
-        # Reset
-        self.current_trace = None
+        self._observe(trace)
+        self.writer.submit(trace)
+    
+    def _observe(self, trace: Dict) -> None:
+        result = trace.get('result') or {}
+        self.registry.observe(
+            'rag_query_duration_ms', trace['duration_ms'],
+            operation=trace['operation'],
+            intent=result.get('intent'),
+            cache='hit' if result.get('from_cache') else 'miss',
+            status=trace['status'],
+        )
+        for span in trace['spans']:
+            self.registry.observe('rag_span_duration_ms', span.get('duration_ms', 0.0), span=span.get('name'))
+    
+    def flush(self) -> None:
+        """Wait for queued traces to reach disk"""
+        if self.writer is not None:
+            self.writer.flush()
     
     def get_metrics_summary(self, last_n_traces: int = 100) -> Dict:
-        """Get aggregated metrics from recent traces"""
+        """Aggregated latency metrics from the in-process registry (O(1) in traces).
+
+        ``last_n_traces`` is kept for compatibility; the histograms cover
+        every trace this process has ended.
+        """
         if not self.enabled:
             return {}
         
-        # Read last N traces
-        traces = []
-        for trace_file in sorted(self.logs_dir.glob("traces_*.jsonl"), reverse=True)[:3]:
-            try:
-                with open(trace_file, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        if line.strip():
-                            traces.append(json.loads(line))
-                        if len(traces) >= last_n_traces:
-                            break
-            except Exception:
-                continue
-            if len(traces) >= last_n_traces:
-                break
-        
-        if not traces:
+        durations = self.registry.histogram('rag_query_duration_ms')
+        if not durations.count:
             return {}
         
-        # Aggregate metrics
-        durations = [t['duration_ms'] for t in traces if 'duration_ms' in t]
-        
-        # Span analysis
-        span_stats: Dict[str, list] = {}
-        for trace in traces:
-            for span in trace.get('spans', []):
-                name = span['name']
-                if name not in span_stats:
-                    span_stats[name] = []
-                span_stats[name].append(span['duration_ms'])
-        
         return {
-            'total_traces': len(traces),
-            'avg_duration_ms': round(sum(durations) / len(durations), 2) if durations else 0,
-            'p50_duration_ms': round(sorted(durations)[len(durations) // 2], 2) if durations else 0,
-            'p95_duration_ms': round(sorted(durations)[int(len(durations) * 0.95)], 2) if durations else 0,
-            'p99_duration_ms': round(sorted(durations)[int(len(durations) * 0.99)], 2) if durations else 0,
+            'total_traces': durations.count,
+            'avg_duration_ms': round(durations.mean, 2),
+            'p50_duration_ms': round(durations.quantile(0.5), 2),
+            'p95_duration_ms': round(durations.quantile(0.95), 2),
+            'p99_duration_ms': round(durations.quantile(0.99), 2),
             'span_breakdown': {
                 name: {
-                    'avg_ms': round(sum(times) / len(times), 2),
-                    'p95_ms': round(sorted(times)[int(len(times) * 0.95)], 2) if len(times) > 20 else max(times)
+                    'avg_ms': round(hist.mean, 2),
+                    'p95_ms': round(hist.quantile(0.95), 2),
                 }
-                for name, times in span_stats.items()
+                for name, hist in sorted(self.registry.histogram_by('rag_span_duration_ms', 'span').items())
             }
         }
 
@@ -159,9 +318,9 @@ class RAGTracer:
 _global_tracer: Optional[RAGTracer] = None
 
 
-def get_tracer(project_name: str = "scalp") -> RAGTracer:
-    """Get or create global tracer instance"""
+def get_tracer(project_name: str = "scalp", logs_dir: Optional[Path] = None) -> RAGTracer:
+    """Get or create global tracer instance (``logs_dir`` applies on creation)"""
     global _global_tracer
     if _global_tracer is None:
-        _global_tracer = RAGTracer(project_name)
+        _global_tracer = RAGTracer(project_name, logs_dir=logs_dir)
     return _global_tracer